@@ -0,0 +1,144 @@
+"""
+Category Page Snapshot Store
+============================
+
+Step 1 normally saves every category page it fetches as
+backend/categories/htmls/tree_htmls/<category>/<subcategory>/.../<name>.html,
+one folder per node. With --snapshot-store the pages go into one compressed
+archive per day instead:
+
+    backend/categories/snapshots/category_pages_{YYYY-MM-DD}.gz           pages, one gzip member each
+    backend/categories/snapshots/category_pages_{YYYY-MM-DD}.index.jsonl  url, path, offset, length, size, ts
+
+Pages are only ever appended, so an interrupted run leaves a valid archive and
+a resumed run continues it. Each page can be read on its own from its offset
+(`zcat` on the archive prints all of them). Archives older than KEEP_DAYS are
+deleted when a new one is opened.
+
+Usage:
+    python category_snapshots.py [--date YYYY-MM-DD] [--list | --show URL_OR_PATH]
+"""
+
+import os
+import sys
+import zlib
+import json
+import gzip
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+SNAPSHOTS_DIR = os.path.join(os.path.dirname(__file__), "backend", "categories", "snapshots")
+ARCHIVE_PREFIX = "category_pages_"
+KEEP_DAYS = 7  # Archives of older runs are deleted
+COMPRESS_LEVEL = 6
+
+
+def archive_paths(date_str, snapshots_dir=SNAPSHOTS_DIR):
+    base = os.path.join(snapshots_dir, f"{ARCHIVE_PREFIX}{date_str}")
+    return f"{base}.gz", f"{base}.index.jsonl"
+
+
+def prune_archives(keep_days=KEEP_DAYS, snapshots_dir=SNAPSHOTS_DIR):
+    """Delete archives (and their indexes) of runs more than ``keep_days`` days old"""
+    cutoff = (datetime.now() - timedelta(days=keep_days)).strftime("%Y-%m-%d")
+    for fname in os.listdir(snapshots_dir):
+        date_str = fname[len(ARCHIVE_PREFIX):len(ARCHIVE_PREFIX) + 10]
+        if fname.startswith(ARCHIVE_PREFIX) and date_str < cutoff:
+            try:
+                os.remove(os.path.join(snapshots_dir, fname))
+            except OSError as e:
+                print(f"[SNAPSHOT] Could not delete {fname}: {e}")
+
+
+class SnapshotStore:
+    """Append-only, thread-safe archive of one run's category pages"""
+
+    def __init__(self, date_str=None, snapshots_dir=SNAPSHOTS_DIR, keep_days=KEEP_DAYS):
+        os.makedirs(snapshots_dir, exist_ok=True)
+        prune_archives(keep_days, snapshots_dir)
+        self.date_str = date_str or datetime.now().strftime("%Y-%m-%d")
+        self.archive_path, self.index_path = archive_paths(self.date_str, snapshots_dir)
+        self._lock = threading.Lock()
+        self._archive = open(self.archive_path, "ab")
+        self._index = open(self.index_path, "a", encoding="utf-8")
+        self.pages = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+
+    def put(self, path, url, html):
+        """Append one page; ``path`` is the list of category names down to the page"""
+        data = gzip.compress((html or "").encode("utf-8"), compresslevel=COMPRESS_LEVEL)
+        with self._lock:
+            offset = self._archive.tell()
+            self._archive.write(data)
+            self._archive.flush()
+            entry = {"url": url, "path": "/".join(path), "offset": offset, "length": len(data),
+                     "size": len(html or ""), "ts": datetime.now().isoformat()}
+            self._index.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._index.flush()
+            self.pages += 1
+            self.raw_bytes += entry["size"]
+            self.stored_bytes += len(data)
+
+    def close(self):
+        with self._lock:
+            if self._archive.closed:
+                return
+            self._archive.close()
+            self._index.close()
+        if self.pages:
+            print(f"[SNAPSHOT] {self.pages} category pages, {self.raw_bytes / 1e6:.1f}MB stored in "
+                  f"{self.stored_bytes / 1e6:.1f}MB ({self.archive_path})")
+
+
+def iter_index(date_str, snapshots_dir=SNAPSHOTS_DIR):
+    """Index entries of a run's archive in the order the pages were stored"""
+    _, index_path = archive_paths(date_str, snapshots_dir)
+    with open(index_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue  # Torn last line of an interrupted run
+
+
+def read_page(date_str, entry, snapshots_dir=SNAPSHOTS_DIR):
+    archive_path, _ = archive_paths(date_str, snapshots_dir)
+    with open(archive_path, "rb") as f:
+        f.seek(entry["offset"])
+        return zlib.decompress(f.read(entry["length"]), wbits=31).decode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List or show category pages stored by the snapshot store")
+    parser.add_argument("--date", default=datetime.now().strftime("%Y-%m-%d"), help="Run date (default: today)")
+    parser.add_argument("--list", action="store_true", help="List the stored pages")
+    parser.add_argument("--show", metavar="URL_OR_PATH", help="Print the latest stored page with this URL or path")
+    args = parser.parse_args()
+
+    if not os.path.exists(archive_paths(args.date)[1]):
+        print(f"[SNAPSHOT] No archive for {args.date} in {SNAPSHOTS_DIR}")
+        return 1
+    if args.show:
+        latest = None
+        for entry in iter_index(args.date):
+            if args.show in (entry["url"], entry["path"]):
+                latest = entry
+        if latest is None:
+            print(f"[SNAPSHOT] {args.show} is not in the {args.date} archive")
+            return 1
+        sys.stdout.write(read_page(args.date, latest))
+        return 0
+    entries = list(iter_index(args.date))
+    if args.list:
+        for entry in entries:
+            print(f"{entry['ts']} {entry['size']:>8} {entry['path']} {entry['url']}")
+    size = sum(e["size"] for e in entries)
+    stored = sum(e["length"] for e in entries)
+    print(f"[SNAPSHOT] {args.date}: {len(entries)} pages, {size / 1e6:.1f}MB stored in {stored / 1e6:.1f}MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Embedded Page State
+===================
+
+Ad pages carry part of their data twice: in the markup and as inline JSON-LD
+(<script type="application/ld+json">). extract_embedded_fields() finds those
+blocks in the raw HTML, decodes them once and maps them to the parser's output
+keys:
+
+- "cijena"  offers.price in EUR, formatted like the page ("185.000 €")
+- "slike"   image URLs
+
+Only fields that are present and well-formed are returned; the parser takes
+everything else from the DOM. "naslov" is not mapped: the output contract is
+the page <title>, which differs from the JSON-LD name. Uses orjson when it is
+installed, json otherwise.
+"""
+
+import re
+import json
+import math
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+JSON_LD_PATTERN = re.compile(
+    r'<script\b[^>]*\btype\s*=\s*["\']?application/ld\+json["\']?[^>]*>(.*?)</script\s*>',
+    re.IGNORECASE | re.DOTALL,
+)
+
+CURRENCY_SYMBOLS = {"EUR": "€"}
+# Prices written the Croatian way: "185.000" or "185.000,00" (dots group thousands, comma for decimals)
+LOCAL_PRICE_PATTERN = re.compile(r'^\d{1,3}(?:\.\d{3})+(?:,\d+)?$|^\d+,\d+$')
+
+
+def iter_json_ld(html):
+    """Yield every JSON-LD object on the page (top-level lists and @graph are flattened)"""
+    for m in JSON_LD_PATTERN.finditer(html):
+        try:
+            data = _loads(m.group(1))
+        except ValueError:
+            continue
+        stack = [data]
+        while stack:
+            item = stack.pop(0)
+            if isinstance(item, list):
+                stack[:0] = item
+            elif isinstance(item, dict):
+                if isinstance(item.get("@graph"), list):
+                    stack[:0] = item["@graph"]
+                yield item
+
+
+def format_price(price, currency):
+    """Format a JSON-LD price the way the page shows it, or None"""
+    symbol = CURRENCY_SYMBOLS.get(currency)
+    if symbol is None or isinstance(price, bool):
+        return None
+    if isinstance(price, str):
+        price = price.strip()
+        if LOCAL_PRICE_PATTERN.match(price):
+            price = price.replace(".", "").replace(",", ".")
+        try:
+            price = float(price)
+        except ValueError:
+            return None
+    if not isinstance(price, (int, float)) or not math.isfinite(price) or price != int(price) or price < 0:
+        return None  # The page shows decimals in a locale format we do not reproduce
+    return f"{int(price):,}".replace(",", ".") + f" {symbol}"
+
+
+def _first_offer(offers):
+    if isinstance(offers, list):
+        offers = offers[0] if offers else None
+    return offers if isinstance(offers, dict) else None
+
+
+def extract_embedded_fields(html):
+    """Map the page's JSON-LD to output fields; returns only the fields it could fill"""
+    fields = {}
+    for item in iter_json_ld(html):
+        if "cijena" not in fields:
+            offer = _first_offer(item.get("offers"))
+            if offer is not None and "price" in offer:
+                price = format_price(offer["price"], offer.get("priceCurrency", "EUR"))
+                if price is not None:
+                    fields["cijena"] = price
+        if "slike" not in fields:
+            images = item.get("image")
+            if isinstance(images, str):
+                images = [images]
+            if isinstance(images, list) and images and all(isinstance(url, str) for url in images):
+                fields["slike"] = [url for url in images if url]
+    return fields
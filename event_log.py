@@ -0,0 +1,215 @@
+"""
+Buffered Structured Event Log
+=============================
+
+Fetch events from the scrapers (one per ad page, one per category page) are
+appended to a single rotating JSONL stream under backend/logs/events/ instead
+of one small .log file per ad. Records are queued by the caller and serialized
+and written by a background thread, so logging never blocks the event loop.
+
+Usage:
+    python event_log.py AD_ID [--event EVENT] [--stream STREAM]
+
+Example:
+    python event_log.py 37026812
+"""
+
+import os
+import sys
+import json
+import glob
+import queue
+import atexit
+import argparse
+import threading
+from datetime import datetime
+
+EVENTS_DIR = os.path.join(os.path.dirname(__file__), "backend", "logs", "events")
+
+MAX_FILE_BYTES = 64 * 1024 * 1024  # Rotate after 64MB
+FLUSH_INTERVAL = 1.0  # Seconds between flushes when the queue is quiet
+FLUSH_BATCH = 1000  # Records written per flush at most
+
+_STOP = object()
+
+
+class EventLog:
+    """Single-writer JSONL event log with size-based rotation.
+
+    Files are named ``{stream}_{YYYY-MM-DD}.jsonl``; once a file exceeds
+    ``max_bytes`` the writer continues in ``{stream}_{YYYY-MM-DD}.1.jsonl``,
+    ``.2.jsonl`` and so on. The writer thread starts with the first event, so
+    a module that only creates its log at import (and is re-imported by
+    spawned worker processes) does not start one.
+    """
+
+    def __init__(self, stream, events_dir=EVENTS_DIR, max_bytes=MAX_FILE_BYTES):
+        self.stream = stream
+        self.events_dir = events_dir
+        self.max_bytes = max_bytes
+        self._queue = queue.SimpleQueue()
+        self._file = None
+        self._file_date = None
+        self._closed = False
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                os.makedirs(self.events_dir, exist_ok=True)
+                self._thread = threading.Thread(target=self._run, name=f"event-log-{self.stream}", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def log(self, event, key, status, duration_ms=None, **fields):
+        """Queue one event. Cheap enough to call from the event loop."""
+        if self._closed:
+            return
+        record = {
+            "ts": datetime.now().isoformat(),
+            "event": event,
+            "key": str(key),
+            "status": status,
+        }
+        if duration_ms is not None:
+            record["duration_ms"] = duration_ms
+        if fields:
+            record.update(fields)
+        if self._thread is None:
+            self._start()
+        self._queue.put(record)
+
+    def close(self):
+        """Flush pending events and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout=10)
+
+    # --- writer thread ---
+
+    def _target_path(self, date_str):
+        base = os.path.join(self.events_dir, f"{self.stream}_{date_str}")
+        path = f"{base}.jsonl"
+        index = 0
+        while os.path.exists(path) and os.path.getsize(path) >= self.max_bytes:
+            index += 1
+            path = f"{base}.{index}.jsonl"
+        return path
+
+    def _open_for_write(self):
+        date_str = datetime.now().strftime("%Y-%m-%d")
+        if self._file is not None:
+            if self._file_date == date_str and self._file.tell() < self.max_bytes:
+                return self._file
+            self._file.close()
+        self._file = open(self._target_path(date_str), "a", encoding="utf-8")
+        self._file_date = date_str
+        return self._file
+
+    def _write(self, records):
+        try:
+            f = self._open_for_write()
+            f.write("".join(json.dumps(r, ensure_ascii=False, separators=(',', ':')) + "\n" for r in records))
+            f.flush()
+        except Exception as e:
+            print(f"[EVENT LOG ERROR] Could not write {len(records)} events: {e}", file=sys.stderr)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                continue
+            batch = []
+            while True:
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if len(batch) >= FLUSH_BATCH:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_event_logs = {}
+_event_logs_lock = threading.Lock()
+
+
+def get_event_log(stream):
+    """Return the process-wide EventLog for ``stream``, creating it on first use."""
+    with _event_logs_lock:
+        event_log = _event_logs.get(stream)
+        if event_log is None:
+            event_log = EventLog(stream)
+            _event_logs[stream] = event_log
+        return event_log
+
+
+def _rotation_order(path):
+    # "{stream}_{date}.jsonl" comes before "{stream}_{date}.1.jsonl", "....2.jsonl", ...
+    stem = os.path.basename(path)[:-len(".jsonl")]
+    base, _, index = stem.rpartition(".")
+    if base and index.isdigit():
+        return base, int(index)
+    return stem, 0
+
+
+def iter_events(key=None, event=None, stream=None, events_dir=EVENTS_DIR):
+    """Yield logged events in file order, optionally filtered by key, event and stream."""
+    pattern = f"{stream}_*.jsonl" if stream else "*.jsonl"
+    key_marker = f'"key":{json.dumps(str(key), ensure_ascii=False)}' if key is not None else None
+    for path in sorted(glob.glob(os.path.join(events_dir, pattern)), key=_rotation_order):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                # Cheap substring check before decoding every line
+                if key_marker and key_marker not in line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if key is not None and record.get("key") != str(key):
+                    continue
+                if event is not None and record.get("event") != event:
+                    continue
+                yield record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the logged fetch history of one ad or page")
+    parser.add_argument("key", help="Ad ID (or category page file name) to look up")
+    parser.add_argument("--event", help="Only show events of this type (e.g. html_extraction)")
+    parser.add_argument("--stream", help="Only search one stream (e.g. leaf_entries, categories)")
+    parser.add_argument("--json", action="store_true", help="Print raw JSON records")
+    args = parser.parse_args()
+
+    found = 0
+    for record in iter_events(key=args.key, event=args.event, stream=args.stream):
+        found += 1
+        if args.json:
+            print(json.dumps(record, ensure_ascii=False))
+        else:
+            duration = f" {record['duration_ms']}ms" if "duration_ms" in record else ""
+            print(f"{record['ts']} {record['event']} {record.get('file', record['key'])} {record['status']}{duration}")
+    if not found:
+        print(f"No events found for {args.key}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
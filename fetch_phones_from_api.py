@@ -1,14 +1,14 @@
 
 import os
 import re
-import json
 import asyncio
-import sqlite3
 import logging
 import time
 from datetime import datetime
 from curl_cffi.requests import AsyncSession
 
+import phone_store
+
 # Comprehensive logging setup
 def setup_comprehensive_logging():
     """Setup comprehensive logging with info and error loggers"""
@@ -114,25 +114,16 @@ logging.basicConfig(
     ]
 )
 def init_db():
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS phones (
-            ad_id TEXT PRIMARY KEY,
-            phones TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
+    # Creates the typed schema and migrates an old phones(ad_id, phones) table
+    phone_store.migrate(db_path)
 
 def save_phones_to_db(ad_id, phone_list):
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    # Always overwrite (upsert)
-    c.execute("REPLACE INTO phones (ad_id, phones) VALUES (?, ?)",
-              (ad_id, json.dumps(phone_list, ensure_ascii=False) if phone_list is not None else None))
-    conn.commit()
-    conn.close()
+    conn = phone_store.connect(db_path)
+    try:
+        # Always overwrite (upsert)
+        phone_store.save_phones(conn, ad_id, phone_list)
+    finally:
+        conn.close()
 
 
 
@@ -274,12 +265,12 @@ async def main():
     # --- FLAG: re-scrape ad_ids with null phone numbers ---
     RESCRAPE_NULL_PHONES = False  # Set to False to skip nulls, True to re-scrape nulls
 
-    # Load ad_ids and their phone values from DB
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute("SELECT ad_id, phones FROM phones")
-    adid_to_phones = {row[0]: row[1] for row in c.fetchall()}
-    conn.close()
+    # Load ad_ids and their phone counts from DB
+    conn = phone_store.connect(db_path)
+    try:
+        adid_to_phone_count = phone_store.load_phone_counts(conn)
+    finally:
+        conn.close()
 
     files_to_process = []
     skipped = 0
@@ -288,9 +279,8 @@ async def main():
         ad_id = extract_ad_id_from_filename(path)
         if not ad_id:
             continue
-        if ad_id in adid_to_phones:
-            phones_val = adid_to_phones[ad_id]
-            if phones_val is None or phones_val == 'null':
+        if int(ad_id) in adid_to_phone_count:
+            if adid_to_phone_count[int(ad_id)] is None:
                 if RESCRAPE_NULL_PHONES:
                     rescrape_count += 1
                     files_to_process.append(path)
@@ -0,0 +1,185 @@
+"""
+HTML Extraction Backends
+========================
+
+The parser's field extraction only needs a handful of DOM operations:
+parse, compile a CSS selector, select / select_one, text, attribute, parent
+and the raw text of a <script>. Each backend below implements exactly these, so the same
+extraction code runs on:
+
+- "bs4"        BeautifulSoup with the lxml tree builder (reference behaviour)
+- "lxml"       lxml.html with precompiled cssselect selectors
+- "selectolax" selectolax / Lexbor (HTML5 parser, fastest)
+
+text(node, separator) follows BeautifulSoup's get_text(separator, strip=True):
+every text node is stripped, empty ones are dropped and the rest are joined
+with the separator; text inside <script>, <style> and <template> is ignored.
+
+select and select_one take either a CSS string or the result of compile(css);
+compiled selectors skip the per-call selector parsing.
+"""
+
+BACKEND_NAMES = ("bs4", "lxml", "selectolax")
+DEFAULT_BACKEND = "bs4"
+
+_SKIPPED_TEXT_TAGS = ("script", "style", "template")
+
+
+class BeautifulSoupBackend:
+    name = "bs4"
+
+    def __init__(self):
+        from bs4 import BeautifulSoup
+        import soupsieve
+        self._BeautifulSoup = BeautifulSoup
+        self._soupsieve = soupsieve
+
+    def parse(self, html):
+        # Use lxml parser for speed (falls back to html.parser if not available)
+        try:
+            return self._BeautifulSoup(html, "lxml")
+        except Exception:
+            return self._BeautifulSoup(html, "html.parser")
+
+    def compile(self, css):
+        return self._soupsieve.compile(css)
+
+    def select(self, node, css):
+        if isinstance(css, str):
+            return node.select(css)
+        return css.select(node)
+
+    def select_one(self, node, css):
+        if isinstance(css, str):
+            return node.select_one(css)
+        return css.select_one(node)
+
+    def text(self, node, separator=""):
+        return node.get_text(separator, strip=True)
+
+    def attr(self, node, name):
+        value = node.get(name)
+        # bs4 returns multi-valued attributes (class, rel, ...) as lists
+        return " ".join(value) if isinstance(value, list) else value
+
+    def parent(self, node):
+        return node.parent
+
+    def script_text(self, node):
+        return node.string
+
+
+class LxmlBackend:
+    name = "lxml"
+
+    def __init__(self):
+        from lxml import etree
+        from lxml import html as lxml_html
+        from lxml.cssselect import CSSSelector
+        self._lxml_html = lxml_html
+        self._CSSSelector = CSSSelector
+        self._utf8_parser = lxml_html.HTMLParser(encoding="utf-8")
+        self._text_xpath = etree.XPath(
+            ".//text()[not(ancestor::script or ancestor::style or ancestor::template)]",
+            smart_strings=False,
+        )
+        # CSS -> XPath translation is slow; translate each selector once
+        self._selectors = {}
+
+    def _selector(self, css):
+        selector = self._selectors.get(css)
+        if selector is None:
+            selector = self._selectors[css] = self._CSSSelector(css, translator="html")
+        return selector
+
+    def parse(self, html):
+        if isinstance(html, bytes):
+            return self._lxml_html.document_fromstring(html, parser=self._utf8_parser)
+        try:
+            return self._lxml_html.document_fromstring(html)
+        except ValueError:
+            # Unicode input with an XML encoding declaration
+            return self._lxml_html.document_fromstring(html.encode("utf-8"), parser=self._utf8_parser)
+
+    def compile(self, css):
+        return self._selector(css)
+
+    def select(self, node, css):
+        selector = self._selector(css) if isinstance(css, str) else css
+        return selector(node)
+
+    def select_one(self, node, css):
+        selector = self._selector(css) if isinstance(css, str) else css
+        matches = selector(node)
+        return matches[0] if matches else None
+
+    def text(self, node, separator=""):
+        return separator.join(s for s in (t.strip() for t in self._text_xpath(node)) if s)
+
+    def attr(self, node, name):
+        return node.get(name)
+
+    def parent(self, node):
+        return node.getparent()
+
+    def script_text(self, node):
+        return node.text
+
+
+class SelectolaxBackend:
+    name = "selectolax"
+
+    def __init__(self):
+        from selectolax.lexbor import LexborHTMLParser
+        self._LexborHTMLParser = LexborHTMLParser
+
+    def parse(self, html):
+        return self._LexborHTMLParser(html).root
+
+    def compile(self, css):
+        # Lexbor has no reusable selector object; selectors stay strings
+        return css
+
+    def select(self, node, css):
+        return node.css(css)
+
+    def select_one(self, node, css):
+        return node.css_first(css)
+
+    def _iter_text(self, node):
+        for child in node.iter(include_text=True):
+            tag = child.tag
+            if tag == "-text":
+                yield child.text_content
+            elif tag not in _SKIPPED_TEXT_TAGS and not tag.startswith("-"):
+                yield from self._iter_text(child)
+
+    def text(self, node, separator=""):
+        return separator.join(s for s in (t.strip() for t in self._iter_text(node) if t) if s)
+
+    def attr(self, node, name):
+        return node.attributes.get(name)
+
+    def parent(self, node):
+        return node.parent
+
+    def script_text(self, node):
+        return node.text(deep=True)
+
+
+_BACKEND_CLASSES = {
+    "bs4": BeautifulSoupBackend,
+    "lxml": LxmlBackend,
+    "selectolax": SelectolaxBackend,
+}
+_backends = {}
+
+
+def get_backend(name=DEFAULT_BACKEND):
+    """Return the (per-process, cached) backend instance for ``name``."""
+    if name not in _BACKEND_CLASSES:
+        raise ValueError(f"Unknown HTML backend '{name}', expected one of {', '.join(BACKEND_NAMES)}")
+    backend = _backends.get(name)
+    if backend is None:
+        backend = _backends[name] = _BACKEND_CLASSES[name]()
+    return backend
@@ -0,0 +1,174 @@
+"""
+Region Slicing for Ad Pages
+===========================
+
+Ad pages are mostly scripts, ads markup and navigation; the parser only reads
+a few regions. slice_regions() cuts those regions out of the raw HTML and
+joins them, in document order, into a small document that the HTML backends
+parse instead of the whole page:
+
+- <title>, <link rel="canonical">
+- dl.ClassifiedDetailSummary-priceRow, div.ClassifiedDetailBasicDetails,
+  div.ClassifiedDetailDescription-text, section.ClassifiedDetailPropertyGroups-group,
+  div.ClassifiedDetailOwnerDetails, dl.ClassifiedDetailSystemDetails-list
+- li[data-media-type="image"] start tags (only their attributes are read)
+- <script> blocks with the "lat":... coordinates
+
+Tags inside scripts, styles and comments are ignored. slice_regions() returns
+None when the page cannot be sliced safely (a region is not closed, or a
+marker is on the page but no region start tag matched it); the caller then
+parses the full document.
+"""
+
+import re
+import bisect
+
+# (tag, class token) of every element region; the whole element is copied
+ELEMENT_REGIONS = [
+    ("dl", "ClassifiedDetailSummary-priceRow"),
+    ("div", "ClassifiedDetailBasicDetails"),
+    ("div", "ClassifiedDetailDescription-text"),
+    ("section", "ClassifiedDetailPropertyGroups-group"),
+    ("div", "ClassifiedDetailOwnerDetails"),
+    ("dl", "ClassifiedDetailSystemDetails-list"),
+]
+
+# Scripts with coordinates in the shape parser_ultrafast.LAT_LNG_PATTERN reads
+LAT_LNG_MARKER = re.compile(r'"lat":[\d.-]+,"lng":')
+
+# Markers start with a literal and are case-sensitive (as the site writes them) so
+# the regex engine can scan for them quickly; the start tag patterns do the
+# exact (case-insensitive) check.
+
+# Content in which tag-like text is not markup
+OPAQUE_PATTERN = re.compile(
+    r'<!--.*?-->|<script\b[^>]*>.*?</script\s*>|<style\b[^>]*>.*?</style\s*>',
+    re.IGNORECASE | re.DOTALL,
+)
+TITLE_PATTERN = re.compile(r'<title\b[^>]*>.*?</title\s*>', re.IGNORECASE | re.DOTALL)
+CANONICAL_PATTERN = re.compile(
+    r'<link\b[^>]*?\brel\s*=\s*["\']?[^"\'>]*?(?<![\w-])canonical(?![\w-])[^>]*>', re.IGNORECASE)
+CANONICAL_MARKER = re.compile(r'canonical(?![\w-])')
+IMAGE_PATTERN = re.compile(
+    r'<li\b[^>]*?\bdata-media-type\s*=\s*["\']?image(?![\w-])[^>]*>', re.IGNORECASE)
+IMAGE_MARKER = re.compile(r'data-media-type\s*=\s*["\']?image(?![\w-])')
+
+
+def _compile_element_region(tag, token):
+    start = re.compile(
+        rf'<{tag}\b[^>]*?\bclass\s*=\s*["\']?[^"\'>]*?(?<![\w-]){re.escape(token)}(?![\w-])[^>]*>',
+        re.IGNORECASE)
+    # Start and end tags of the same element type, for depth counting
+    tags = re.compile(rf'<(/?){tag}\b[^>]*>', re.IGNORECASE)
+    marker = re.compile(rf'{re.escape(token)}(?![\w-])')
+    return start, tags, marker
+
+
+_COMPILED_REGIONS = [_compile_element_region(tag, token) for tag, token in ELEMENT_REGIONS]
+
+
+class _Opaque:
+    """Sorted (start, end) spans of scripts, styles and comments"""
+
+    def __init__(self, html):
+        self.spans = [m.span() for m in OPAQUE_PATTERN.finditer(html)]
+        self.starts = [s for s, _ in self.spans]
+
+    def contains(self, pos):
+        i = bisect.bisect_right(self.starts, pos) - 1
+        return i >= 0 and pos < self.spans[i][1]
+
+
+def _element_end(html, tags_pattern, start, opaque):
+    """End offset of the element starting at ``start`` or None if it is never closed"""
+    depth = 0
+    for m in tags_pattern.finditer(html, start):
+        if opaque.contains(m.start()):
+            continue
+        if m.group(1):
+            depth -= 1
+            if depth == 0:
+                return m.end()
+        elif not m.group(0).endswith("/>"):
+            depth += 1
+    return None
+
+
+def _start_tags(start_pattern, marker, html, opaque):
+    """Start tags matching ``start_pattern``, found through their (cheap to scan) marker
+
+    Returns None if the marker occurs in markup but no start tag matched it.
+    """
+    matches = []
+    seen = set()
+    in_markup = False
+    for hit in marker.finditer(html):
+        if opaque.contains(hit.start()):
+            continue
+        in_markup = True
+        tag_start = html.rfind("<", 0, hit.start())
+        if tag_start < 0 or tag_start in seen:
+            continue
+        m = start_pattern.match(html, tag_start)
+        if m and m.end() > hit.start():
+            seen.add(tag_start)
+            matches.append(m)
+    if in_markup and not matches:
+        return None
+    return matches
+
+
+def find_regions(html):
+    """Return the sorted, non-overlapping (start, end[, closing tag]) spans of all regions, or None"""
+    opaque = _Opaque(html)
+    spans = []
+
+    for m in TITLE_PATTERN.finditer(html):
+        if not opaque.contains(m.start()):
+            spans.append(m.span())
+            break
+
+    # Void or attribute-only regions: copy the start tag, close <li> ourselves
+    for pattern, marker, closing in ((CANONICAL_PATTERN, CANONICAL_MARKER, None),
+                                     (IMAGE_PATTERN, IMAGE_MARKER, "</li>")):
+        matches = _start_tags(pattern, marker, html, opaque)
+        if matches is None:
+            return None
+        spans.extend((m.start(), m.end(), closing) for m in matches)
+
+    for start_pattern, tags_pattern, marker in _COMPILED_REGIONS:
+        matches = _start_tags(start_pattern, marker, html, opaque)
+        if matches is None:
+            return None
+        for m in matches:
+            end = _element_end(html, tags_pattern, m.start(), opaque)
+            if end is None:
+                return None
+            spans.append((m.start(), end))
+
+    for start, end in opaque.spans:
+        if html[start:start + 7].lower() == "<script" and LAT_LNG_MARKER.search(html, start, end):
+            spans.append((start, end))
+
+    # Document order; drop regions nested in an earlier region
+    result = []
+    last_end = -1
+    for span in sorted(spans):
+        if span[0] >= last_end:
+            result.append(span)
+            last_end = span[1]
+    return result
+
+
+def slice_regions(html):
+    """Small document with only the regions the parser reads, or None to parse the full page"""
+    spans = find_regions(html)
+    if not spans:
+        return None
+    parts = ["<!DOCTYPE html><html><head><meta charset=\"utf-8\"></head><body>"]
+    for span in spans:
+        parts.append(html[span[0]:span[1]])
+        if len(span) == 3 and span[2]:
+            parts[-1] += span[2]
+    parts.append("</body></html>")
+    return "\n".join(parts)
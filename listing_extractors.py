@@ -0,0 +1,242 @@
+"""
+Listing and Category Page Extractors
+====================================
+
+Steps 1 and 2 read two kinds of pages:
+
+- listing pages: ad links in section.EntityList blocks titled "Njuškalo oglasi"
+  (or "Sniff ads" on the English site); entry_urls(), or entry_cards() for
+  the link plus what the card shows (title, price, publish date, teaser)
+- category pages: links in div.entity-list-categories; category_links()
+- the number of ads a listing (or leaf category) page reports; result_count()
+
+Both run on an HTML backend from html_backends.py with precompiled selectors,
+lxml by default (bs4 if lxml is not installed). The *_reference functions are
+the original BeautifulSoup/html.parser implementations; --verify checks the
+fast extractors against them on saved pages:
+
+    python listing_extractors.py --verify [DIR] [--backend lxml|selectolax|bs4] [--limit N]
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+
+from html_backends import get_backend, BACKEND_NAMES
+
+LISTING_BACKEND = "lxml"
+SITE_URL = "https://www.njuskalo.hr"
+ENTRY_GROUP_TITLES = {"Njuškalo oglasi", "Sniff ads"}
+CATEGORY_ITEM_CLASSES = ["CategoryListing-topCategoryItem", "CategoryListing-topCategoryItemFauxAnchor"]
+CATEGORIES_HTMLS_DIR = os.path.join(os.path.dirname(__file__), "backend", "categories", "htmls")
+
+# The scrapers match these classes as substrings ("EntityList" also matches "EntityList--Standard")
+SELECTORS = {
+    "entry_section": 'section[class*="EntityList"]',
+    "entry_title": 'h2[class*="EntityList-groupTitle"]',
+    "entry_list": 'ul[class*="EntityList-items"]',
+    "entry_item": 'li[class*="EntityList-item"]',
+    "entry_link": "a.link",
+    "card_price": ".entity-prices",
+    "card_published": ".entity-pub-date time",
+    "card_teaser": ".entity-description-main",
+    "categories": "div.entity-list-categories",
+    "category_item": ", ".join(f"li.{c}" for c in CATEGORY_ITEM_CLASSES),
+    "category_link": "a.CategoryListing-topCategoryLink",
+    "result_count": ".entities-count",
+}
+
+COUNT_PATTERN = re.compile(r"\d{1,3}(?:\.\d{3})+|\d+")  # "1.234 oglasa"
+
+_compiled = {}
+
+
+def _backend(backend_name):
+    """Backend and its compiled selectors; falls back to bs4 when the backend is not installed"""
+    if backend_name not in _compiled:
+        try:
+            backend = get_backend(backend_name)
+        except ImportError as e:
+            print(f"[WARN] HTML backend '{backend_name}' unavailable ({e}), using bs4")
+            backend = get_backend("bs4")
+        _compiled[backend_name] = (backend, {key: backend.compile(css) for key, css in SELECTORS.items()})
+    return _compiled[backend_name]
+
+
+def absolute_url(href):
+    return SITE_URL + href if href.startswith("/") else href
+
+
+def _iter_entries(backend, css, doc):
+    """(li, a, href) of every ad card in the ad sections of a listing page"""
+    for section in backend.select(doc, css["entry_section"]):
+        title = backend.select_one(section, css["entry_title"])
+        if title is None or backend.text(title) not in ENTRY_GROUP_TITLES:
+            continue
+        items = backend.select_one(section, css["entry_list"])
+        if items is None:
+            continue
+        for li in backend.select(items, css["entry_item"]):
+            a = backend.select_one(li, css["entry_link"])
+            href = backend.attr(a, "href") if a is not None else None
+            if href:
+                yield li, a, href
+
+
+def entry_urls(html, backend_name=LISTING_BACKEND):
+    """Ad URLs of a listing page in document order (duplicates kept)"""
+    if not html.strip():
+        return []
+    backend, css = _backend(backend_name)
+    return [absolute_url(href) for _, _, href in _iter_entries(backend, css, backend.parse(html))]
+
+
+def _text_or_none(backend, node, separator=""):
+    return (backend.text(node, separator) or None) if node is not None else None
+
+
+def entry_cards(html, backend_name=LISTING_BACKEND):
+    """Ad cards of a listing page: [{"url", "title", "price", "published", "teaser"}], missing fields None"""
+    if not html.strip():
+        return []
+    backend, css = _backend(backend_name)
+    cards = []
+    for li, a, href in _iter_entries(backend, css, backend.parse(html)):
+        published = backend.select_one(li, css["card_published"])
+        cards.append({
+            "url": absolute_url(href),
+            "title": _text_or_none(backend, a),
+            "price": _text_or_none(backend, backend.select_one(li, css["card_price"]), " "),
+            # The machine-readable timestamp when there is one
+            "published": (published is not None and backend.attr(published, "datetime")) or _text_or_none(backend, published),
+            "teaser": _text_or_none(backend, backend.select_one(li, css["card_teaser"]), " "),
+        })
+    return cards
+
+
+def category_links(html, backend_name=LISTING_BACKEND):
+    """[{"name", "url"}] of a category page, or None if the page has no category list"""
+    if not html.strip():
+        return None
+    backend, css = _backend(backend_name)
+    doc = backend.parse(html)
+    categories = backend.select_one(doc, css["categories"])
+    if categories is None:
+        return None
+    links = []
+    for li in backend.select(categories, css["category_item"]):
+        a = backend.select_one(li, css["category_link"])
+        href = backend.attr(a, "href") if a is not None else None
+        if href:
+            links.append({"name": backend.text(a), "url": href})
+    return links
+
+
+def result_count(html, backend_name=LISTING_BACKEND):
+    """Number of ads a listing page reports, or None if it shows no count"""
+    if not html.strip():
+        return None
+    backend, css = _backend(backend_name)
+    node = backend.select_one(backend.parse(html), css["result_count"])
+    match = COUNT_PATTERN.search(backend.text(node)) if node is not None else None
+    return int(match.group().replace(".", "")) if match else None
+
+
+def entry_urls_reference(html):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser")
+    urls = []
+    for section in soup.find_all("section", class_=lambda c: c and "EntityList" in c):
+        h2 = section.find("h2", class_=lambda c: c and "EntityList-groupTitle" in c)
+        if not h2 or h2.get_text(strip=True) not in ENTRY_GROUP_TITLES:
+            continue
+        ul = section.find("ul", class_=lambda c: c and "EntityList-items" in c)
+        if not ul:
+            continue
+        for li in ul.find_all("li", class_=lambda c: c and "EntityList-item" in c):
+            a = li.find("a", class_="link")
+            if a and a.get("href"):
+                urls.append(absolute_url(a["href"]))
+    return urls
+
+
+def category_links_reference(html):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "html.parser")
+    categories_div = soup.find("div", class_="entity-list-categories")
+    if not categories_div:
+        return None
+    links = []
+    for li in categories_div.find_all("li", class_=CATEGORY_ITEM_CLASSES):
+        a = li.find("a", class_="CategoryListing-topCategoryLink")
+        if a and a.get("href"):
+            links.append({"name": a.get_text(strip=True), "url": a.get("href")})
+    return links
+
+
+def result_count_reference(html):
+    from bs4 import BeautifulSoup
+    node = BeautifulSoup(html, "html.parser").find(class_="entities-count")
+    match = COUNT_PATTERN.search(node.get_text(strip=True)) if node else None
+    return int(match.group().replace(".", "")) if match else None
+
+
+def verify(corpus_dir, backend_name=LISTING_BACKEND, limit=0):
+    """Compare the fast extractors with the html.parser reference on every saved page"""
+    files = sorted(f for f in os.listdir(corpus_dir) if f.endswith(".html"))
+    if limit:
+        files = files[:limit]
+    checks = [
+        ("entry_urls", entry_urls, entry_urls_reference, set),
+        ("category_links", category_links, category_links_reference, lambda links: links),
+        ("result_count", result_count, result_count_reference, lambda count: count),
+    ]
+    timings = {name: [0.0, 0.0] for name, _, _, _ in checks}
+    found = {name: 0 for name, _, _, _ in checks}
+    mismatches = 0
+    for filename in files:
+        with open(os.path.join(corpus_dir, filename), "r", encoding="utf-8", errors="ignore") as f:
+            html = f.read()
+        for name, fast, reference, normalize in checks:
+            t0 = time.perf_counter()
+            expected = reference(html)
+            t1 = time.perf_counter()
+            got = fast(html, backend_name)
+            t2 = time.perf_counter()
+            timings[name][0] += t1 - t0
+            timings[name][1] += t2 - t1
+            found[name] += bool(expected)
+            # entry URLs are de-duplicated by the scraper, so only the set matters
+            if normalize(expected or []) != normalize(got or []) or (expected is None) != (got is None):
+                mismatches += 1
+                print(f"[VERIFY] {filename}: {name} differs: {str(expected)[:120]!r} != {str(got)[:120]!r}")
+    for name, (reference_time, fast_time) in timings.items():
+        speedup = reference_time / fast_time if fast_time > 0 else 0
+        print(f"[VERIFY] {name}: {found[name]}/{len(files)} pages with results, html.parser {reference_time * 1000:.0f}ms, "
+              f"{backend_name} {fast_time * 1000:.0f}ms ({speedup:.1f}x)")
+    if not mismatches:
+        print(f"[VERIFY] {backend_name}: identical output on all {len(files)} files")
+    return 0 if mismatches == 0 else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fast listing/category page extractors")
+    parser.add_argument("--verify", nargs="?", const=CATEGORIES_HTMLS_DIR, metavar="DIR",
+                        help="Check the fast extractors against html.parser on saved pages "
+                             "(default: backend/categories/htmls)")
+    parser.add_argument("--backend", choices=BACKEND_NAMES, default=LISTING_BACKEND)
+    parser.add_argument("--limit", type=int, default=0, help="Only check the first N files")
+    args = parser.parse_args()
+    if not args.verify:
+        parser.print_help()
+        return 1
+    if not os.path.isdir(args.verify):
+        print(f"[ERROR] {args.verify} is not a directory")
+        return 1
+    return verify(args.verify, args.backend, args.limit)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Event Loop Lag Monitor
+======================
+
+The scrapers keep hundreds of requests in flight on one asyncio event loop;
+anything that runs on the loop thread for long (parsing, regex over a whole
+page, file writes) stalls all of them. LoopLagMonitor runs a probe task that
+sleeps CHECK_INTERVAL seconds and measures how late it wakes up. Every stall
+above the threshold is printed and logged to the event log as "loop_lag";
+stop() prints a summary.
+
+With debug=True asyncio's debug mode is switched on as well, and asyncio logs
+the callback or task step that ran longer than the threshold (debug mode adds
+overhead, so only use it to find the culprit).
+
+Usage:
+    monitor = LoopLagMonitor(threshold_ms=100, event_log=EVENT_LOG)
+    monitor.start()
+    ...
+    await monitor.stop()
+"""
+
+import time
+import asyncio
+import logging
+
+LAG_THRESHOLD_MS = 100  # Report stalls of the event loop longer than this
+CHECK_INTERVAL = 0.05  # Seconds between probes
+
+
+class LoopLagMonitor:
+    """Report event-loop stalls longer than ``threshold_ms``"""
+
+    def __init__(self, threshold_ms=LAG_THRESHOLD_MS, interval=CHECK_INTERVAL, event_log=None, debug=False):
+        self.threshold_ms = threshold_ms
+        self.interval = interval
+        self.event_log = event_log
+        self.debug = debug
+        self.probes = 0
+        self.stalls = 0
+        self.stalled_ms = 0.0
+        self.max_lag_ms = 0.0
+        self._task = None
+
+    def start(self):
+        """Start probing the running loop"""
+        loop = asyncio.get_running_loop()
+        if self.debug:
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.threshold_ms / 1000
+            logging.getLogger("asyncio").setLevel(logging.WARNING)
+        self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag_ms = (time.perf_counter() - t0 - self.interval) * 1000
+            self.probes += 1
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            if lag_ms >= self.threshold_ms:
+                self.stalls += 1
+                self.stalled_ms += lag_ms
+                print(f"[LOOP LAG] Event loop blocked for {lag_ms:.0f}ms")
+                if self.event_log is not None:
+                    self.event_log.log("loop_lag", "event_loop", "BLOCKED", int(lag_ms))
+
+    async def stop(self):
+        """Stop probing and print a summary"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        print(f"[LOOP LAG] {self.stalls} stalls over {self.threshold_ms}ms ({self.stalled_ms / 1000:.1f}s in total), "
+              f"max {self.max_lag_ms:.0f}ms over {self.probes} probes")
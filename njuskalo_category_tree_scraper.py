@@ -13,13 +13,21 @@ def safe_print(s):
 
 import json
 import asyncio
-from bs4 import BeautifulSoup, Tag
+import re
 from tqdm import tqdm
 import random
 import time
 import os
+import contextlib
 from curl_cffi.requests import AsyncSession
 
+from event_log import get_event_log
+import listing_extractors
+import page_cache
+import page_hashes
+from category_snapshots import SnapshotStore
+from loop_monitor import LoopLagMonitor, LAG_THRESHOLD_MS
+
 # Import Playwright token/cookie fetcher
 import importlib.util
 spec = importlib.util.spec_from_file_location("bearer_token_finder", os.path.join(os.path.dirname(__file__), "bearer_token_finder.py"))
@@ -338,9 +346,23 @@ CATEGORIES_DIR = os.path.join(BACKEND_DIR, "categories")
 CATEGORIES_HTMLS_DIR = os.path.join(CATEGORIES_DIR, "htmls")
 CATEGORIES_LOGS_DIR = os.path.join(CATEGORIES_DIR, "logs")
 CATEGORIES_TREE_DIR = os.path.join(CATEGORIES_DIR, "tree_jsons")
+CATEGORIES_DIFF_DIR = os.path.join(CATEGORIES_DIR, "tree_diffs")
+FULL_CRAWLS_FILE = os.path.join(CATEGORIES_DIR, "full_crawls.json")  # {category: date of the last full crawl}
+CHECKPOINTS_DIR = os.path.join(os.path.dirname(__file__), "checkpoints")
 os.makedirs(CATEGORIES_HTMLS_DIR, exist_ok=True)
 os.makedirs(CATEGORIES_LOGS_DIR, exist_ok=True)
 os.makedirs(CATEGORIES_TREE_DIR, exist_ok=True)
+os.makedirs(CATEGORIES_DIFF_DIR, exist_ok=True)
+
+REQUESTS_PER_SECOND = 10  # Global budget for category page requests, shared by all categories (0 = no limit)
+PROGRESS_INTERVAL = 30  # Seconds between per-category progress lines
+
+# Incremental refresh: between full crawls a tree is rebuilt from the previous day's tree
+FULL_TREE_DAYS = 7  # Full crawl of every node at least this often
+REFRESH_SAMPLE = 1.0  # Fraction of the previous tree's nodes re-fetched on an incremental run
+
+# Category page fetch events go to the shared buffered event log (see event_log.py)
+EVENT_LOG = get_event_log("categories")
 
 
 def is_proxy_forbidden(response_text):
@@ -359,6 +381,62 @@ def get_concurrency():
 
 SEM = asyncio.Semaphore(get_concurrency())
 
+def get_run_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sequential', action='store_true',
+                        help='Depth-first crawl, one category page at a time (default: --concurrency workers)')
+    parser.add_argument('--rate', type=float, default=REQUESTS_PER_SECOND,
+                        help='Category page requests per second across all categories, concurrent crawl only (0 = no limit)')
+    parser.add_argument('--category-concurrency', type=int, default=0,
+                        help='Top-level categories crawled at the same time (default: all)')
+    parser.add_argument('--snapshot-store', action='store_true',
+                        help='Keep category pages in one compressed archive per run instead of tree_htmls/ folders')
+    parser.add_argument('--full-tree', action='store_true',
+                        help='Fetch every node instead of refreshing the previous tree')
+    parser.add_argument('--full-tree-days', type=int, default=FULL_TREE_DAYS,
+                        help='Days between full crawls of a category (default: %(default)s)')
+    parser.add_argument('--refresh-sample', type=float, default=REFRESH_SAMPLE,
+                        help='Fraction of the previous tree\'s nodes re-fetched on an incremental run (default: %(default)s)')
+    parser.add_argument('--page-cache-ttl', type=int, default=page_cache.TTL_SECONDS,
+                        help='Keep leaf pages in the shared page cache for Step 2 this many seconds (0 = off)')
+    parser.add_argument('--loop-lag-ms', type=int, default=LAG_THRESHOLD_MS,
+                        help='Report event-loop stalls longer than this (0 = off)')
+    parser.add_argument('--loop-debug', action='store_true',
+                        help='asyncio debug mode: log the callback behind each stall (slower)')
+    args, _ = parser.parse_known_args()
+    return args
+
+class RateBudget:
+    """Start at most ``rate`` requests per second, however many tasks share it"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        # Reserve the next free slot before sleeping, so concurrent callers queue up behind each other
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+RATE_BUDGET = RateBudget(0)  # No limit until main_category_tree_scrape applies --rate to the concurrent crawl
+
+SHIELDSQUARE_PATTERN = re.compile(r'<title>\s*ShieldSquare Captcha\s*</title>', re.IGNORECASE)
+
+def is_block_page(html):
+    if not html:
+        return False
+    # Only match <title>ShieldSquare Captcha</title>
+    return SHIELDSQUARE_PATTERN.search(html) is not None
+
+def write_text(path, text, mode="w"):
+    with open(path, mode, encoding="utf-8") as f:
+        f.write(text)
+
 class CategoryLogger:
     def __init__(self, log_file_path=None):
         self.lines = []
@@ -430,9 +508,9 @@ def extract_category_links_from_html(html):
             # 'security check',
             # 'blocked',
         ]
-        soup = BeautifulSoup(html, "html.parser")
-        categories_div = soup.find("div", class_="entity-list-categories")
-        if not categories_div:
+        # lxml with precompiled selectors; same result as the former html.parser walk
+        links = listing_extractors.category_links(html)
+        if links is None:
             lower_html = html.lower()
             for signal in antibot_signals:
                 if signal in lower_html:
@@ -441,14 +519,6 @@ def extract_category_links_from_html(html):
             # Log successful empty parsing
             log_parsing_completion("extract_category_links", 0, "leaf_category")
             return []  # treat as leaf if no subcategories and no anti-bot
-        links = []
-        # Find all li elements for categories (works for both single and multi-column)
-        for li in categories_div.find_all("li", class_=["CategoryListing-topCategoryItem", "CategoryListing-topCategoryItemFauxAnchor"]):
-            a = li.find("a", class_="CategoryListing-topCategoryLink")
-            if a and a.get("href"):
-                name = a.get_text(strip=True)
-                href = a.get("href")
-                links.append({"name": name, "url": href})
         
         # Log successful parsing
         log_parsing_completion("extract_category_links", len(links), "category_list")
@@ -462,6 +532,7 @@ async def fetch_html(session, url):
     """Fetch HTML with cycling between local and proxy connections"""
     timeout = 10  # seconds
     
+    await RATE_BUDGET.acquire()
     use_local = should_use_local_connection()
     
     try:
@@ -550,12 +621,13 @@ async def fetch_html(session, url):
         
         return None
 
-async def fetch_and_save_html(url, out_file, log_dir):
-    """Fetch and save HTML with cycling between local and proxy connections"""
+async def fetch_and_save_html(url, out_file, session=None):
+    """Fetch and save HTML with cycling between local and proxy connections (own session unless ``session`` is given)"""
     import time
     t0 = time.time()
     
-    async with AsyncSession() as client:
+    await RATE_BUDGET.acquire()
+    async with (contextlib.nullcontext(session) if session is not None else AsyncSession()) as client:
         try:
             use_local = should_use_local_connection()
             
@@ -628,17 +700,113 @@ async def fetch_and_save_html(url, out_file, log_dir):
                 status = "FAILED"
         
         duration_ms = int((time.time() - t0) * 1000)
-        timestamp = datetime.now().isoformat()
-        log_line = f"{timestamp} HTML EXTRACTION {os.path.basename(out_file)} {status} {duration_ms}ms\n"
-        log_file = os.path.join(log_dir, os.path.basename(out_file).replace('.html', '.log'))
-        with open(log_file, "w", encoding="utf-8") as logf:
-            logf.write(log_line)
+        filename = os.path.basename(out_file)
+        EVENT_LOG.log("html_extraction", filename, status, duration_ms, file=filename, url=url)
         return status == "SUCCESS"
 
 global_subcat_counter = 0
+
+# Clean up names for filesystem
+def clean_name(n):
+    return ''.join(c for c in n if c.isalnum() or c in (' ', '-', '_')).replace(' ', '_')
+
+def leaf_url_file_for(main_category):
+    """Today's leaf URL file of a top-level category (created directory included)"""
+    leaf_urls_dir = os.path.join(os.path.dirname(__file__), "backend", "categories", "leaf_urls")
+    os.makedirs(leaf_urls_dir, exist_ok=True)
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    return os.path.join(leaf_urls_dir, f"{clean_name(main_category)}_leaf_urls_{today_str}.txt")
 SLEEP_AFTER_SUBCATS = 15
 SLEEP_DURATION = 1  # 1 minute in seconds
 
+SNAPSHOT_STORE = None  # Set by --snapshot-store (category_snapshots.SnapshotStore)
+PAGE_CACHE_TTL = page_cache.TTL_SECONDS  # Set by --page-cache-ttl (0 = leaf pages are not cached)
+
+async def save_category_page(path, url, html):
+    """Keep a fetched category page: in the run's snapshot archive, or as tree_htmls/<path>/<name>.html"""
+    if SNAPSHOT_STORE is not None:
+        await asyncio.to_thread(SNAPSHOT_STORE.put, [clean_name(n) for n in path], url, html)
+        return
+    html_folder = os.path.join(CATEGORIES_HTMLS_DIR, 'tree_htmls', *(clean_name(n) for n in path))
+    await asyncio.to_thread(os.makedirs, html_folder, exist_ok=True)
+    await asyncio.to_thread(write_text, os.path.join(html_folder, f"{clean_name(path[-1])}.html"), html)
+
+def leaf_page_url(url):
+    """URL to fetch a category page as: the page 1 URL Step 2 will request if it is a leaf
+
+    That is ?sort=new for a leaf Step 2 crawls incrementally today, the plain
+    URL for one due for a full sweep (and for parents, which Step 2 never
+    crawled). The page lists the same subcategories and ad count either way.
+    """
+    if PAGE_CACHE_TTL <= 0:
+        return url
+    conn = page_hashes.connect()
+    try:
+        due = page_hashes.full_sweep_due(conn, url)
+    finally:
+        conn.close()
+    return page_cache.listing_page_url(url, 1, newest_first=not due)
+
+def cache_leaf_page(url, html):
+    """Put a leaf page that lists ads into the shared page cache, where Step 2 finds it as page 1"""
+    if PAGE_CACHE_TTL <= 0 or not listing_extractors.entry_urls(html):
+        return
+    conn = page_cache.connect()
+    try:
+        page_cache.put(conn, url, html, "categories")
+    finally:
+        conn.close()
+
+# Crawl checkpoints: one append-only file per run. The sequential crawl adds {"node": ..., "done": subcategory}
+# per finished subcategory, the frontier crawl {"category": ..., "url": ..., "status": ..., "links": [...]} per node
+_node_checkpoints = None
+_frontier_checkpoints = None
+_node_checkpoint_lock = threading.Lock()
+
+def node_checkpoint_file():
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    return os.path.join(CHECKPOINTS_DIR, f"category_node_checkpoint_{today_str}.jsonl")
+
+def load_node_checkpoints():
+    """({node: finished subcategories}, {(category, url): finished frontier node}) of today's run, read once"""
+    global _node_checkpoints, _frontier_checkpoints
+    if _node_checkpoints is None:
+        _node_checkpoints, _frontier_checkpoints = {}, {}
+        path = node_checkpoint_file()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line of an interrupted run
+                    if "node" in entry:
+                        _node_checkpoints.setdefault(entry["node"], set()).add(entry["done"])
+                    else:
+                        _frontier_checkpoints[(entry["category"], entry["url"])] = entry
+    return _node_checkpoints, _frontier_checkpoints
+
+def completed_subcategories(node_key):
+    """Subcategories of ``node_key`` finished earlier today"""
+    return load_node_checkpoints()[0].setdefault(node_key, set())
+
+def append_node_checkpoint(entry):
+    os.makedirs(CHECKPOINTS_DIR, exist_ok=True)
+    with _node_checkpoint_lock:  # Categories crawl at the same time and append from worker threads
+        write_text(node_checkpoint_file(), json.dumps(entry, ensure_ascii=False) + "\n", "a")
+
+def mark_subcategory_done(node_key, subcat_name):
+    completed_subcategories(node_key).add(subcat_name)
+    append_node_checkpoint({"node": node_key, "done": subcat_name})
+
+def finished_node(main_category, url):
+    """Checkpoint entry of a frontier node of ``main_category`` finished earlier today, or None"""
+    return load_node_checkpoints()[1].get((main_category, url))
+
+def mark_node_done(main_category, node, links):
+    append_node_checkpoint({"category": main_category, "url": node["url"], "status": node["status"],
+                            "links": links, "count": node["count"], "carried": node["carried"]})
+
 async def build_category_tree(session, url, name, depth=0, max_depth=10, logger=None, main_category=None):
     if logger is None:
         logger = CategoryLogger()
@@ -648,12 +816,7 @@ async def build_category_tree(session, url, name, depth=0, max_depth=10, logger=
         logger.log(name, is_last=True)
         return {"name": name, "url": url, "children": []}
     # Fetch HTML
-    # Build tree-like folder path for HTML saving that mirrors the website's category/subcategory hierarchy
-    tree_html_base = os.path.join(CATEGORIES_HTMLS_DIR, 'tree_htmls')
-    os.makedirs(tree_html_base, exist_ok=True)
-    # Clean up names for filesystem
-    def clean_name(n):
-        return ''.join(c for c in n if c.isalnum() or c in (' ', '-', '_')).replace(' ', '_')
+    # Pages are saved under a path that mirrors the website's category/subcategory hierarchy
     # Use logger.stack to build the hierarchy path (category, subcategory, ...)
     # logger.stack contains is_last flags, but we need the actual names for the path
     # We'll build the path from the current recursion: pass down a path argument
@@ -662,37 +825,27 @@ async def build_category_tree(session, url, name, depth=0, max_depth=10, logger=
     parent_names = getattr(logger, 'current_names', []) if hasattr(logger, 'current_names') else []
     # For root, parent_names is empty; for subcategories, it's the chain of parent names
     full_path = parent_names + [name]
-    html_folder = os.path.join(tree_html_base, *(clean_name(n) for n in full_path))
-    os.makedirs(html_folder, exist_ok=True)
-    html_file_path = os.path.join(html_folder, f"{clean_name(name)}.html")
     # Determine main_category for leaf URL file naming
     if main_category is None:
         # If not set, use the first name in parent_names or current name
         main_category = parent_names[0] if parent_names else name
-    # Block detection and retry logic
-    def is_block_page(html):
-        if not html:
-            return False
-        # Only match <title>ShieldSquare Captcha</title>
-        import re
-        match = re.search(r'<title>\s*ShieldSquare Captcha\s*</title>', html, re.IGNORECASE)
-        return bool(match)
-
+    # Block detection and retry logic; whole-page scans, parsing and writes run off the event loop
     html = None
+    fetch_url = await asyncio.to_thread(leaf_page_url, url)
     async with SEM:
-        html = await fetch_html(session, url)
-    if is_block_page(html):
+        html = await fetch_html(session, fetch_url)
+    blocked = await asyncio.to_thread(is_block_page, html)
+    if blocked:
         safe_print(f"[BLOCK DETECTED] {name} ({url}) - Exiting script and pausing for 1 minute...")
         await asyncio.sleep(60)
         sys.exit(99)  # Custom exit code for blockage
 
     # Save HTML for every node, even if it's None or error response
     try:
-        with open(html_file_path, "w", encoding="utf-8") as f:
-            f.write(html if html is not None else "")
+        await save_category_page(full_path, url, html if html is not None else "")
     except Exception as e:
         safe_print(f"[ERROR] Could not save HTML for {name}: {e}")
-    if not html or is_block_page(html):
+    if not html or blocked:
         # Try to get error code from previous fetch attempt (if available)
         error_code = getattr(session, 'last_status', None)
         error_reason = getattr(session, 'last_reason', None)
@@ -703,8 +856,8 @@ async def build_category_tree(session, url, name, depth=0, max_depth=10, logger=
         if logger:
             logger.log(msg)
         logger.log(name, is_last=True)
-        return {"name": name, "url": url, "children": []}
-    children = extract_category_links_from_html(html)
+        return {"name": name, "url": url, "children": [], "failed": True}
+    children = await asyncio.to_thread(extract_category_links_from_html, html)
     if children == 'ANTIBOT_DETECTED':
         logger.log(f"[ANTIBOT BLOCKED] {name}", is_last=True)
         safe_print(f"{indent}[ANTIBOT DETECTED] {name} ({url}) - Skipping this branch!")
@@ -717,13 +870,14 @@ async def build_category_tree(session, url, name, depth=0, max_depth=10, logger=
         safe_print(f"{indent}Leaf: {name}")
         logger.log(name, leaf_count=1, is_last=True)
         # Save leaf URL to category-specific file in leaf_urls folder
-        leaf_urls_dir = os.path.join(os.path.dirname(__file__), "backend", "categories", "leaf_urls")
-        os.makedirs(leaf_urls_dir, exist_ok=True)
-        today_str = datetime.now().strftime("%Y-%m-%d")
-        leaf_url_file = os.path.join(leaf_urls_dir, f"{clean_name(main_category)}_leaf_urls_{today_str}.txt")
-        with open(leaf_url_file, "a", encoding="utf-8") as f:
-            f.write(f"{url}\n")
-        return {"name": name, "url": url, "children": []}
+        await asyncio.to_thread(write_text, leaf_url_file_for(main_category), f"{url}\n", "a")
+        # A leaf page is page 1 of its listing: keep the number of ads it reports for partition_leaves.py
+        leaf = {"name": name, "url": url, "children": []}
+        await asyncio.to_thread(cache_leaf_page, fetch_url, html)
+        count = await asyncio.to_thread(listing_extractors.result_count, html)
+        if count is not None:
+            leaf["count"] = count
+        return leaf
     tree_children = []
     batch_size = 20
     global global_subcat_counter
@@ -732,25 +886,9 @@ async def build_category_tree(session, url, name, depth=0, max_depth=10, logger=
         logger.current_names = []
     logger.current_names.append(name)
 
-    # Date-based checkpoint file for this node
-    checkpoint_folder = html_folder
-    today_str = datetime.now().strftime("%Y-%m-%d")
-    checkpoint_file = os.path.join(checkpoint_folder, f"checkpoint_{today_str}.json")
-    completed_subcats = set()
-    # Remove old checkpoint files (not for today)
-    for fname in os.listdir(checkpoint_folder):
-        if fname.startswith("checkpoint_") and not fname.endswith(f"{today_str}.json"):
-            try:
-                os.remove(os.path.join(checkpoint_folder, fname))
-            except Exception:
-                pass
-    # Load today's checkpoint if exists
-    if os.path.exists(checkpoint_file):
-        try:
-            with open(checkpoint_file, "r", encoding="utf-8") as f:
-                completed_subcats = set(json.load(f))
-        except Exception:
-            completed_subcats = set()
+    # Subcategories finished earlier today, from the run's node checkpoint
+    node_key = "/".join([main_category] + full_path)
+    completed_subcats = completed_subcategories(node_key)
 
     for idx, child in enumerate(children):
         subcat_name = child["name"]
@@ -774,18 +912,372 @@ async def build_category_tree(session, url, name, depth=0, max_depth=10, logger=
         tree_children.append(subtree)
         logger.exit()
         # Save checkpoint after each successful subcategory (date-based)
-        completed_subcats.add(subcat_name)
         try:
-            with open(checkpoint_file, "w", encoding="utf-8") as f:
-                json.dump(list(completed_subcats), f)
+            mark_subcategory_done(node_key, subcat_name)
         except Exception as e:
             safe_print(f"[ERROR] Could not save checkpoint for {name}: {e}")
     logger.current_names.pop()
     return {"name": name, "url": url, "children": tree_children}
 
+# --- Frontier crawler: all nodes of a category tree fetched by N concurrent workers ---
+
+class CategoryBlocked(Exception):
+    """A category page came back as the ShieldSquare captcha"""
+
+def new_category_node(link, parent_path, depth, previous=None):
+    """Frontier node; ``previous`` is the same node in the previous tree JSON (incremental refresh)"""
+    return {"name": link["name"], "url": link["url"], "path": parent_path + [link["name"]], "depth": depth,
+            "status": None, "error": None, "children": [], "previous": previous, "fetched": False, "carried": False,
+            "restored": False, "count": None}
+
+async def fetch_category_node(session, node):
+    """Fetch and save one category page; sets node["status"] and returns its child links"""
+    global global_subcat_counter
+    name, url = node["name"], node["url"]
+    indent = '  ' * node["depth"]
+    safe_print(f"{indent}Processing: {name} (depth={node['depth']})")
+    # Same pause as the sequential crawl: every SLEEP_AFTER_SUBCATS first-level subcategories
+    if node["depth"] == 1:
+        global_subcat_counter += 1
+        if global_subcat_counter % SLEEP_AFTER_SUBCATS == 0:
+            safe_print(f"[RATE LIMIT] Sleeping for {SLEEP_DURATION}s after {global_subcat_counter} subcategories...")
+            await asyncio.sleep(SLEEP_DURATION)
+    fetch_url = await asyncio.to_thread(leaf_page_url, url)
+    async with SEM:
+        html = await fetch_html(session, fetch_url)
+    node["fetched"] = True
+    if await asyncio.to_thread(is_block_page, html):
+        raise CategoryBlocked(f"{name} ({url})")
+    # Save HTML for every node, even if it's None or error response
+    try:
+        await save_category_page(node["path"], url, html or "")
+    except Exception as e:
+        safe_print(f"[ERROR] Could not save HTML for {name}: {e}")
+    if not html:
+        error_code = getattr(session, 'last_status', None)
+        node["error"] = f"[ERROR] Failed to fetch: {name} ({url})"
+        if error_code:
+            node["error"] += f" [HTTP {error_code} - {getattr(session, 'last_reason', None)}]"
+        safe_print(node["error"])
+        node["status"] = "failed"
+        return []
+    children = await asyncio.to_thread(extract_category_links_from_html, html)
+    if children == 'ANTIBOT_DETECTED':
+        safe_print(f"{indent}[ANTIBOT DETECTED] {name} ({url}) - Skipping this branch!")
+        node["status"] = "antibot"
+        return []
+    if not children:
+        safe_print(f"{name} ({url}) - LEAF-NODE")
+        safe_print(f"{indent}Leaf: {name}")
+        node["status"] = "leaf"
+        await asyncio.to_thread(cache_leaf_page, fetch_url, html)
+        node["count"] = await asyncio.to_thread(listing_extractors.result_count, html)
+        return []
+    node["status"] = "inner"
+    return children
+
+async def refresh_category_node(session, node, sample):
+    """fetch_category_node for a node of the previous tree
+
+    A ``sample`` fraction of the nodes, leaves and parents alike, is
+    re-fetched: a leaf gets its current ad count, and one that now lists
+    subcategories becomes a parent. The rest keep their previous status,
+    count and children without a request. A node whose fetch fails keeps its
+    previous children (or count), so one bad response does not drop a branch.
+    """
+    previous = node["previous"]
+    links = [{"name": child["name"], "url": child["url"]} for child in previous.get("children") or []]
+    if not previous.get("failed") and not previous.get("antibot") and random.random() >= sample:
+        node["status"], node["carried"] = ("inner" if links else "leaf"), True
+        if not links:
+            node["count"] = previous.get("count")
+        return links
+    children = await fetch_category_node(session, node)
+    if node["status"] in ("failed", "antibot") and not previous.get("failed") and not previous.get("antibot"):
+        safe_print(f"[REFRESH] Keeping the previous {f'{len(links)} subcategories' if links else 'count'} of {node['name']}")
+        node["status"], node["carried"] = ("inner" if links else "leaf"), True
+        if not links:
+            node["count"] = previous.get("count")
+        return links
+    return children
+
+def previous_children(previous):
+    return {child["url"]: child for child in (previous or {}).get("children") or []}
+
+async def crawl_category_tree(session, root_links, workers=None, max_depth=10, previous=None, sample=REFRESH_SAMPLE,
+                              progress=None, checkpoint=None):
+    """Breadth-first crawl of the trees under ``root_links`` with ``workers`` concurrent fetches
+
+    Returns the root nodes; children keep the order of the links on their
+    parent page, so the result matches the depth-first build_category_tree.
+    With ``previous`` (the last tree JSON of the category) only a ``sample``
+    fraction of its nodes is re-fetched, and only new subcategories are
+    crawled below. ``progress`` (a dict) is kept up to date with the number
+    of pages fetched and nodes waiting in the frontier. With ``checkpoint``
+    (the top-level category) every finished node goes to the day's node
+    checkpoint, and nodes finished by an interrupted run are not fetched again.
+    """
+    workers = workers or get_concurrency()
+    if checkpoint is not None:
+        await asyncio.to_thread(load_node_checkpoints)
+    previous_roots = previous_children({"children": previous})
+    roots = [new_category_node(link, [], 0, previous_roots.get(link["url"])) for link in root_links]
+    frontier = asyncio.Queue()
+    for root in roots:
+        frontier.put_nowait(root)
+
+    async def worker():
+        while True:
+            node = await frontier.get()
+            try:
+                if node["depth"] > max_depth:
+                    node["status"] = "too_deep"
+                    continue
+                restored = finished_node(checkpoint, node["url"]) if checkpoint is not None else None
+                if restored is not None:
+                    node["status"], node["count"] = restored["status"], restored.get("count")
+                    node["carried"], node["restored"] = restored.get("carried", False), True
+                    links = restored["links"]
+                elif node["previous"] is not None:
+                    links = await refresh_category_node(session, node, sample)
+                else:
+                    links = await fetch_category_node(session, node)
+                # Failed and antibot nodes are not recorded, a resumed run tries them again
+                if checkpoint is not None and restored is None and node["status"] in ("leaf", "inner"):
+                    await asyncio.to_thread(mark_node_done, checkpoint, node, links)
+                known = previous_children(node["previous"])
+                for link in links:
+                    child = new_category_node(link, node["path"], node["depth"] + 1, known.get(link["url"]))
+                    node["children"].append(child)
+                    frontier.put_nowait(child)
+            finally:
+                if progress is not None:
+                    progress["fetched"] += node["fetched"]
+                    progress["frontier"] = frontier.qsize()
+                frontier.task_done()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    drained = asyncio.create_task(frontier.join())
+    try:
+        done, _ = await asyncio.wait([drained, *tasks], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        # Also when this crawl is cancelled, so no worker outlives it
+        for task in tasks + [drained]:
+            task.cancel()
+        await asyncio.gather(*tasks, drained, return_exceptions=True)
+    for task in done:
+        if task is not drained:
+            task.result()  # A worker only finishes by raising (CategoryBlocked or a bug)
+    return roots
+
+def category_tree_json(node):
+    """Tree JSON of a crawled node, in the format build_category_tree returns"""
+    tree = {"name": node["name"], "url": node["url"], "children": [category_tree_json(c) for c in node["children"]]}
+    if node["status"] == "antibot":
+        tree["antibot"] = True
+    elif node["status"] == "failed":
+        tree["failed"] = True
+    if node["count"] is not None:
+        tree["count"] = node["count"]  # Ads on a leaf, as its page reported them
+    return tree
+
+def iter_category_nodes(nodes):
+    for node in nodes:
+        yield node
+        yield from iter_category_nodes(node["children"])
+
+def replay_category_tree(roots, logger, main_category):
+    """Write the CategoryLogger lines and leaf URL file of a crawled tree in depth-first order
+
+    Produces the same log and leaf list as the sequential crawl, which writes
+    them while it walks the tree.
+    """
+    leaf_urls = []
+
+    def visit(node):
+        name = node["name"]
+        status = node["status"]
+        if status == "failed":
+            logger.log(node["error"])
+            logger.log(name, is_last=True)
+        elif status == "antibot":
+            logger.log(f"[ANTIBOT BLOCKED] {name}", is_last=True)
+        elif status == "leaf":
+            logger.log(f"{name} ({node['url']}) - LEAF-NODE")
+            logger.log(name, leaf_count=1, is_last=True)
+            leaf_urls.append(node["url"])
+        elif status == "inner":
+            for idx, child in enumerate(node["children"]):
+                is_last = (idx == len(node["children"]) - 1)
+                logger.log(child["name"], is_last=is_last)
+                logger.enter(is_last)
+                visit(child)
+                logger.exit()
+        else:  # Deeper than max_depth
+            logger.log(name, is_last=True)
+
+    for idx, root in enumerate(roots):
+        is_last = (idx == len(roots) - 1)
+        logger.log(root["name"], is_last=is_last)
+        logger.enter(is_last)
+        visit(root)
+        logger.exit()
+    if leaf_urls:
+        write_text(leaf_url_file_for(main_category), "".join(f"{url}\n" for url in leaf_urls), "a")
+    return leaf_urls
+
+# --- Incremental refresh: previous tree, full crawl schedule, tree diff ---
+
+def load_previous_tree(main_category):
+    """(date, tree JSON) of the newest {main_category}_tree_{date}.json before today, or (None, None)"""
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    pattern = re.compile(rf"^{re.escape(main_category)}_tree_(\d{{4}}-\d{{2}}-\d{{2}})\.json$")
+    dates = sorted(m.group(1) for m in map(pattern.match, os.listdir(CATEGORIES_TREE_DIR)) if m and m.group(1) < today_str)
+    for date in reversed(dates):
+        try:
+            with open(os.path.join(CATEGORIES_TREE_DIR, f"{main_category}_tree_{date}.json"), "r", encoding="utf-8") as f:
+                return date, json.load(f)
+        except (OSError, ValueError) as e:
+            safe_print(f"[WARN] Could not load the {date} tree of {main_category}: {e}")
+    return None, None
+
+def load_full_crawls():
+    try:
+        with open(FULL_CRAWLS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def needs_full_crawl(main_category, full_tree_days=FULL_TREE_DAYS):
+    """True if the category has not had a full crawl in the last ``full_tree_days`` days"""
+    last = load_full_crawls().get(main_category)
+    if last is None:
+        return True
+    return (datetime.now() - datetime.strptime(last, "%Y-%m-%d")).days >= full_tree_days
+
+def record_full_crawl(main_category):
+    full_crawls = load_full_crawls()
+    full_crawls[main_category] = datetime.now().strftime("%Y-%m-%d")
+    write_text(FULL_CRAWLS_FILE, json.dumps(full_crawls, indent=2))
+
+def flatten_category_tree(tree):
+    """{url: (path, name, child count)} of every node of a tree JSON"""
+    nodes = {}
 
+    def visit(node, path):
+        path = path + [node["name"]]
+        children = node.get("children") or []
+        nodes[node["url"]] = (" > ".join(path), node["name"], len(children))
+        for child in children:
+            visit(child, path)
+
+    for root in tree:
+        visit(root, [])
+    return nodes
+
+def diff_category_trees(old, new):
+    """Nodes added, removed, renamed, or turned from parent to leaf (or back) between two tree JSONs"""
+    before, after = flatten_category_tree(old), flatten_category_tree(new)
+    common = [url for url in after if url in before]
+    return {
+        "added": [{"path": after[url][0], "url": url} for url in after if url not in before],
+        "removed": [{"path": before[url][0], "url": url} for url in before if url not in after],
+        "renamed": [{"url": url, "from": before[url][1], "to": after[url][1]}
+                    for url in common if before[url][1] != after[url][1]],
+        "now_leaf": [{"path": after[url][0], "url": url} for url in common if before[url][2] and not after[url][2]],
+        "now_parent": [{"path": after[url][0], "url": url} for url in common if not before[url][2] and after[url][2]],
+    }
+
+def write_tree_diff(main_category, previous_date, diff, stats):
+    """Save today's diff against the previous tree to tree_diffs/{main_category}_diff_{today}.json"""
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    diff_file = os.path.join(CATEGORIES_DIFF_DIR, f"{main_category}_diff_{today_str}.json")
+    write_text(diff_file, json.dumps({"category": main_category, "previous_tree": previous_date, **stats, **diff},
+                                     ensure_ascii=False, indent=2))
+    changes = ", ".join(f"{len(diff[key])} {key}" for key in diff)
+    safe_print(f"[TREE DIFF] {main_category} vs {previous_date}: {changes} -> {diff_file}")
+
+
+
+async def scrape_category(session, cat, run_args, progress):
+    """Build (or load) today's tree of one top-level category; returns (tree, logger), tree None on failure"""
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    url = f"https://www.njuskalo.hr/{cat}"
+    html_file = os.path.join(CATEGORIES_HTMLS_DIR, f"{cat}_{today_str}.html")
+    tree_file = os.path.join(CATEGORIES_TREE_DIR, f"{cat}_tree_{today_str}.json")
+    log_file = os.path.join(CATEGORIES_LOGS_DIR, f"{cat}_{today_str}.log")
+    logger = CategoryLogger(log_file_path=log_file)
+    try:
+        if not os.path.exists(html_file):
+            safe_print(f"Fetching first page for {cat} and saving as {html_file}...")
+            if not await fetch_and_save_html(url, html_file, session):
+                safe_print(f"[ERROR] Could not fetch the first page of '{cat}', skipping it")
+                progress["state"] = "failed"
+                return None, logger
+        if not os.path.exists(tree_file):
+            with open(html_file, "r", encoding="utf-8") as f:
+                html = f.read()
+            root_links = await asyncio.to_thread(extract_category_links_from_html, html)
+            # Debug and error handling for root_links
+            if not isinstance(root_links, list) or (root_links and not isinstance(root_links[0], dict)):
+                safe_print(f"[ERROR] Unexpected root_links structure for category '{cat}': {root_links}")
+                logger.log(f"[ERROR] Unexpected root_links structure for category '{cat}': {root_links}")
+                progress["state"] = "failed"
+                return None, logger
+            progress["state"] = "crawling"
+            tree = []
+            previous_date, previous_tree = load_previous_tree(cat)
+            incremental = (previous_tree is not None and not run_args.sequential and not run_args.full_tree
+                           and not needs_full_crawl(cat, run_args.full_tree_days))
+            stats = {"mode": "incremental" if incremental else "full"}
+            if run_args.sequential:
+                for idx, root_cat in enumerate(root_links):
+                    is_last = (idx == len(root_links) - 1)
+                    logger.log(root_cat["name"], is_last=is_last)
+                    logger.enter(is_last)
+                    subtree = await build_category_tree(session, root_cat["url"], root_cat["name"], logger=logger, main_category=cat)
+                    tree.append(subtree)
+                    logger.exit()
+            else:
+                if incremental:
+                    safe_print(f"[REFRESH] {cat}: refreshing the {previous_date} tree "
+                               f"({run_args.refresh_sample:.0%} of nodes re-fetched)")
+                roots = await crawl_category_tree(session, root_links, previous=previous_tree if incremental else None,
+                                                  sample=run_args.refresh_sample, progress=progress, checkpoint=cat)
+                tree = [category_tree_json(root) for root in roots]
+                await asyncio.to_thread(replay_category_tree, roots, logger, cat)
+                nodes = list(iter_category_nodes(roots))
+                stats["fetched"] = sum(node["fetched"] for node in nodes)
+                stats["carried"] = sum(node["carried"] for node in nodes)
+                stats["restored"] = sum(node["restored"] for node in nodes)
+                safe_print(f"[REFRESH] {cat}: {stats['fetched']} category pages fetched, "
+                           f"{stats['carried']} carried over, {stats['restored']} from the node checkpoint")
+            await asyncio.to_thread(write_text, tree_file, json.dumps(tree, ensure_ascii=False, indent=2))
+            safe_print(f"Tree for {cat} saved to {tree_file}")
+            if not incremental:
+                record_full_crawl(cat)
+            if previous_tree is not None:
+                write_tree_diff(cat, previous_date, diff_category_trees(previous_tree, tree), stats)
+        else:
+            safe_print(f"Tree for {cat} already exists, skipping.")
+        with open(tree_file, "r", encoding="utf-8") as f:
+            tree = json.load(f)
+        progress["state"] = "done"
+        return tree, logger
+    finally:
+        logger.close()
+
+async def report_progress(progress, interval=PROGRESS_INTERVAL):
+    """Print one line per running category every ``interval`` seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        done = sum(p["state"] == "done" for p in progress.values())
+        running = [f"{cat}: {p['fetched']} pages, {p['frontier']} queued"
+                   for cat, p in progress.items() if p["state"] == "crawling"]
+        safe_print(f"[PROGRESS] {done}/{len(progress)} categories done" + (" | " + " | ".join(running) if running else ""))
 
 async def main_category_tree_scrape():
+    global SNAPSHOT_STORE, PAGE_CACHE_TTL, RATE_BUDGET
     # Setup comprehensive logging
     setup_comprehensive_logging()
     
@@ -793,14 +1285,28 @@ async def main_category_tree_scrape():
     start_time = time.time()
     log_process_start("category_tree_scraping")
     
+    run_args = get_run_args()
+    if not run_args.sequential:
+        RATE_BUDGET = RateBudget(run_args.rate)  # The sequential crawl was never rate limited
+    loop_monitor = None
+    if run_args.loop_lag_ms > 0:
+        loop_monitor = LoopLagMonitor(run_args.loop_lag_ms, event_log=EVENT_LOG, debug=run_args.loop_debug)
+        loop_monitor.start()
+    
+    PAGE_CACHE_TTL = run_args.page_cache_ttl
+    if PAGE_CACHE_TTL > 0:
+        expired = await asyncio.to_thread(page_cache.purge_expired, PAGE_CACHE_TTL)
+        if expired:
+            safe_print(f"[PAGE CACHE] Deleted {expired} expired pages")
+
     # Checkpoint setup
-    CHECKPOINTS_DIR = os.path.join(os.path.dirname(__file__), "checkpoints")
     os.makedirs(CHECKPOINTS_DIR, exist_ok=True)
     today_str = datetime.now().strftime("%Y-%m-%d")
     checkpoint_file = os.path.join(CHECKPOINTS_DIR, f"category_tree_checkpoint_{today_str}.json")
     # Remove old checkpoint files
     old_checkpoints = [os.path.join(CHECKPOINTS_DIR, f) for f in os.listdir(CHECKPOINTS_DIR)
-                      if f.startswith("category_tree_checkpoint_") and not f.startswith(f"category_tree_checkpoint_{today_str}") and f.endswith(".json")]
+                      if f.startswith(("category_tree_checkpoint_", "category_node_checkpoint_"))
+                      and today_str not in f and f.endswith((".json", ".jsonl"))]
     for cp in old_checkpoints:
         try:
             os.remove(cp)
@@ -814,62 +1320,83 @@ async def main_category_tree_scrape():
                 completed = set(json.load(f))
         except Exception:
             completed = set()
-    all_trees = {}
     for cat in CATEGORIES:
         if cat in completed:
             safe_print(f"[CHECKPOINT] Skipping already completed category: {cat}")
-            continue
-        url = f"https://www.njuskalo.hr/{cat}"
-        html_file = os.path.join(CATEGORIES_HTMLS_DIR, f"{cat}_{today_str}.html")
-        tree_file = os.path.join(CATEGORIES_TREE_DIR, f"{cat}_tree_{today_str}.json")
-        log_file = os.path.join(CATEGORIES_LOGS_DIR, f"{cat}_{today_str}.log")
-        logger = CategoryLogger(log_file_path=log_file)
-        if not os.path.exists(html_file):
-            safe_print(f"Fetching first page for {cat} and saving as {html_file}...")
-            await fetch_and_save_html(url, html_file, CATEGORIES_LOGS_DIR)
-        if not os.path.exists(tree_file):
-            with open(html_file, "r", encoding="utf-8") as f:
-                html = f.read()
-            root_links = extract_category_links_from_html(html)
-            # Debug and error handling for root_links
-            if not isinstance(root_links, list) or (root_links and not isinstance(root_links[0], dict)):
-                safe_print(f"[ERROR] Unexpected root_links structure for category '{cat}': {root_links}")
-                logger.log(f"[ERROR] Unexpected root_links structure for category '{cat}': {root_links}")
-                logger.close()
-                continue
-            tree = []
-            async with AsyncSession() as session:
-                for idx, root_cat in enumerate(root_links):
-                    is_last = (idx == len(root_links) - 1)
-                    logger.log(root_cat["name"], is_last=is_last)
-                    logger.enter(is_last)
-                    subtree = await build_category_tree(session, root_cat["url"], root_cat["name"], logger=logger, main_category=cat)
-                    tree.append(subtree)
-                    logger.exit()
-            with open(tree_file, "w", encoding="utf-8") as f:
-                json.dump(tree, f, ensure_ascii=False, indent=2)
-            safe_print(f"Tree for {cat} saved to {tree_file}")
-        else:
-            safe_print(f"Tree for {cat} already exists, skipping.")
-        with open(tree_file, "r", encoding="utf-8") as f:
-            all_trees[cat] = json.load(f)
-        logger.close()
+    pending = [cat for cat in CATEGORIES if cat not in completed]
+
+    # All categories share one session, the request semaphore and the rate budget
+    checkpoint_lock = asyncio.Lock()
+    category_slots = asyncio.Semaphore(run_args.category_concurrency or max(len(pending), 1))
+    progress = {cat: {"state": "queued", "fetched": 0, "frontier": 0} for cat in pending}
+    results = {}
+
+    async def run_category(session, cat):
+        try:
+            async with category_slots:
+                tree, logger = await scrape_category(session, cat, run_args, progress[cat])
+        except CategoryBlocked:
+            # Blocked on one category means blocked on all of them
+            for task in tasks:
+                if task is not asyncio.current_task():
+                    task.cancel()
+            raise
+        except Exception as e:
+            # One broken category must not take the others down with it
+            progress[cat]["state"] = "failed"
+            log_exception(f"category tree of {cat}", e)
+            safe_print(f"[ERROR] {cat} failed: {type(e).__name__}: {e}")
+            return
+        results[cat] = (tree, logger)
+        if tree is None:
+            return
         # Save checkpoint after each category
-        completed.add(cat)
-        with open(checkpoint_file, "w", encoding="utf-8") as f:
-            json.dump(list(completed), f)
+        async with checkpoint_lock:
+            completed.add(cat)
+            await asyncio.to_thread(write_text, checkpoint_file, json.dumps(sorted(completed)))
+        safe_print(f"[CHECKPOINT] {cat} done ({len(completed)}/{len(CATEGORIES)} categories)")
+
+    if run_args.snapshot_store:
+        SNAPSHOT_STORE = SnapshotStore()
+    progress_task = asyncio.create_task(report_progress(progress, PROGRESS_INTERVAL))
+    async with AsyncSession() as session:
+        tasks = [asyncio.create_task(run_category(session, cat)) for cat in pending]
+        try:
+            outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            progress_task.cancel()
+            if SNAPSHOT_STORE is not None:
+                SNAPSHOT_STORE.close()
+    blocked = next((e for e in outcomes if isinstance(e, CategoryBlocked)), None)
+    if blocked is not None:
+        safe_print(f"[BLOCK DETECTED] {blocked} - Exiting script and pausing for 1 minute...")
+        await asyncio.sleep(60)
+        sys.exit(99)  # Custom exit code for blockage
+    failed = [cat for cat in pending if progress[cat]["state"] == "failed"]
+    if failed:
+        safe_print(f"[ERROR] {len(failed)} categories failed: {', '.join(failed)}")
+
+    all_trees = {}
+    for cat in CATEGORIES:
+        tree_file = os.path.join(CATEGORIES_TREE_DIR, f"{cat}_tree_{today_str}.json")
+        if cat in completed and os.path.exists(tree_file):
+            with open(tree_file, "r", encoding="utf-8") as f:
+                all_trees[cat] = json.load(f)
     merged_tree_file = os.path.join(CATEGORIES_TREE_DIR, f"category_tree_{today_str}.json")
     with open(merged_tree_file, "w", encoding="utf-8") as f:
         json.dump(all_trees, f, ensure_ascii=False, indent=2)
     safe_print(f"\nMerged category tree saved to {merged_tree_file}")
+    if loop_monitor is not None:
+        await loop_monitor.stop()
     
     # Log process end
     log_process_end("category_tree_scraping", start_time)
     
     safe_print("\nCategory Tree Structure:\n")
-    # Optionally print the last logger's log (for the last category)
-    if 'logger' in locals():
-        logger.print_log()
+    # Optionally print the last category's log
+    crawled = [cat for cat in pending if results.get(cat, (None, None))[1] is not None]
+    if crawled:
+        results[crawled[-1]][1].print_log()
 
 if __name__ == "__main__":
     import aiofiles
@@ -0,0 +1,290 @@
+"""
+Typed Normalization of Parsed Ads
+=================================
+
+The parser (Step 4) keeps values as the page shows them: "185.000 €",
+"65,00 m2", "20.07.2025. u 14:35", "29 dana, 3 sata". This stage turns batches
+of parsed records into typed columns with vectorized pandas/NumPy string and
+numeric operations and stores them in one table:
+
+    ad_id, price_eur, living_area_m2, land_area_m2, price_per_m2,
+    published_at, expires_at, views, lat, lng, location_approximate
+
+Dates are Europe/Zagreb timestamps. "Do isteka još" is relative to the time the
+page was fetched, which comes from backend/pageDB/pages.db. Values that are
+present but cannot be parsed are counted per field and reported with examples.
+
+Usage:
+    python normalize_records.py [--input backend/json | FILE.ndjson] [--output FILE.db|.csv|.parquet]
+                                [--report report.json]
+"""
+
+import os
+import re
+import sys
+import json
+import sqlite3
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import page_hashes
+
+JSON_DIR = os.path.join(os.path.dirname(__file__), "backend", "json")
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "backend", "normalized")
+OUTPUT_PATH = os.path.join(OUTPUT_DIR, "ads.db")
+TABLE_NAME = "ads"
+
+BATCH_SIZE = 50000  # Records per vectorized batch
+TIMEZONE = "Europe/Zagreb"
+HRK_PER_EUR = 7.5345  # Fixed conversion rate for prices still listed in kuna
+
+# BasicDetails keys holding areas -> output column
+AREA_KEYS = {
+    "Stambena površina": "living_area_m2",
+    "Površina zemljišta": "land_area_m2",
+}
+
+# Croatian number format: "." groups thousands, "," is the decimal separator
+NUMBER = r'(\d{1,3}(?:\.\d{3})+(?:,\d+)?|\d+(?:,\d+)?)'
+PRICE_PATTERN = NUMBER + r'\s*(€|eur|kn|hrk)'
+AREA_PATTERN = NUMBER + r'\s*m'
+VIEWS_PATTERN = r'(\d{1,3}(?:\.\d{3})+|\d+)'
+PUBLISHED_FORMAT = "%d.%m.%Y. u %H:%M"
+DURATION_PATTERNS = {
+    86400: r'(\d+)\s*dan',
+    3600: r'(\d+)\s*sat',
+    60: r'(\d+)\s*min',
+}
+
+RAW_COLUMNS = ["id", "cijena", "oglas_objavljen", "do_isteka", "oglas_prikazan", "lokacija"] + list(AREA_KEYS)
+FAILURE_EXAMPLES = 5
+
+
+def to_number(text):
+    """Croatian-formatted number strings -> float (NaN where not a number)"""
+    text = text.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    return pd.to_numeric(text, errors="coerce").astype("float64")
+
+
+def parse_price_eur(raw):
+    parts = raw.str.extract(PRICE_PATTERN, flags=re.IGNORECASE)
+    amount = to_number(parts[0])
+    in_kuna = parts[1].str.lower().isin(["kn", "hrk"])
+    return amount.where(~in_kuna, amount / HRK_PER_EUR)
+
+
+def parse_area_m2(raw):
+    return to_number(raw.str.extract(AREA_PATTERN, flags=re.IGNORECASE)[0])
+
+
+def parse_published_at(raw):
+    published = pd.to_datetime(raw.str.strip(), format=PUBLISHED_FORMAT, errors="coerce")
+    return published.dt.tz_localize(TIMEZONE, ambiguous="NaT", nonexistent="NaT")
+
+
+def parse_remaining_seconds(raw):
+    """ "29 dana, 3 sata" -> seconds; NaN if no unit was recognized"""
+    total = pd.Series(0.0, index=raw.index)
+    found = pd.Series(False, index=raw.index)
+    for seconds, pattern in DURATION_PATTERNS.items():
+        count = pd.to_numeric(raw.str.extract(pattern, flags=re.IGNORECASE)[0], errors="coerce").astype("float64")
+        found |= count.notna()
+        total += count.fillna(0) * seconds
+    return total.where(found & raw.notna())
+
+
+def parse_views(raw):
+    views = raw.str.extract(VIEWS_PATTERN)[0].str.replace(".", "", regex=False)
+    return pd.to_numeric(views, errors="coerce").astype("Int64")
+
+
+def load_fetch_times(db_path=page_hashes.PAGE_DB_PATH):
+    """Return {ad_id: changed_at ISO string} from pages.db (empty if it does not exist)
+
+    changed_at is when the saved HTML was fetched; fetched_at moves on every
+    re-fetch, also when the unchanged page is not rewritten.
+    """
+    if not os.path.exists(db_path):
+        return {}
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(conn.execute("SELECT ad_id, changed_at FROM page_hashes WHERE changed_at IS NOT NULL"))
+    finally:
+        conn.close()
+
+
+def _failure(report, column, raw, parsed):
+    present = raw.notna() & (raw.astype("string").str.strip() != "")
+    failed = present & parsed.isna()
+    entry = report.setdefault(column, {"present": 0, "parsed": 0, "failed": 0, "examples": []})
+    entry["present"] += int(present.sum())
+    entry["parsed"] += int((present & parsed.notna()).sum())
+    entry["failed"] += int(failed.sum())
+    room = FAILURE_EXAMPLES - len(entry["examples"])
+    if room > 0 and failed.any():
+        entry["examples"].extend(str(value) for value in raw[failed].head(room))
+
+
+def normalize_frame(records, fetch_times=None, report=None):
+    """Typed DataFrame for a batch of parsed records; failures are added to ``report``"""
+    report = {} if report is None else report
+    raw = pd.DataFrame.from_records(records, columns=RAW_COLUMNS)
+    for column in RAW_COLUMNS:
+        if column not in ("id", "lokacija"):
+            raw[column] = raw[column].astype("string")
+
+    out = pd.DataFrame({"ad_id": pd.to_numeric(raw["id"], errors="coerce").astype("Int64")})
+
+    out["price_eur"] = parse_price_eur(raw["cijena"])
+    _failure(report, "price_eur", raw["cijena"], out["price_eur"])
+
+    for key, column in AREA_KEYS.items():
+        out[column] = parse_area_m2(raw[key])
+        _failure(report, column, raw[key], out[column])
+
+    living_area = out["living_area_m2"].where(out["living_area_m2"] > 0)
+    out["price_per_m2"] = out["price_eur"] / living_area
+
+    out["published_at"] = parse_published_at(raw["oglas_objavljen"])
+    _failure(report, "published_at", raw["oglas_objavljen"], out["published_at"])
+
+    remaining = parse_remaining_seconds(raw["do_isteka"])
+    _failure(report, "expires_at", raw["do_isteka"], remaining)
+    fetched = out["ad_id"].map(fetch_times or {})
+    fetched_at = pd.to_datetime(fetched, errors="coerce", format="ISO8601")
+    fetched_at = fetched_at.dt.tz_localize(TIMEZONE, ambiguous="NaT", nonexistent="NaT")
+    out["expires_at"] = fetched_at + pd.to_timedelta(remaining, unit="s")
+    missing_fetch = int((remaining.notna() & fetched_at.isna()).sum())
+    if missing_fetch:
+        report.setdefault("expires_at", {})["no_fetch_time"] = \
+            report.get("expires_at", {}).get("no_fetch_time", 0) + missing_fetch
+
+    out["views"] = parse_views(raw["oglas_prikazan"])
+    _failure(report, "views", raw["oglas_prikazan"], out["views"])
+
+    location = pd.DataFrame.from_records(
+        [loc if isinstance(loc, dict) else {} for loc in raw["lokacija"]],
+        columns=["lat", "lng", "approximate"], index=raw.index)
+    out["lat"] = pd.to_numeric(location["lat"], errors="coerce")
+    out["lng"] = pd.to_numeric(location["lng"], errors="coerce")
+    out["location_approximate"] = location["approximate"].astype("boolean")
+
+    # Coordinates outside the valid range are data errors, not locations
+    invalid = ~(out["lat"].between(-90, 90) & out["lng"].between(-180, 180))
+    out.loc[invalid, ["lat", "lng"]] = np.nan
+    return out
+
+
+def iter_records(input_path):
+    """Yield parsed records from a JSON directory or an NDJSON file"""
+    if os.path.isdir(input_path):
+        for name in sorted(os.listdir(input_path)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(input_path, name), "r", encoding="utf-8") as f:
+                    yield json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[WARN] Skipping {name}: {e}")
+    else:
+        with open(input_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def iter_batches(records, batch_size=BATCH_SIZE):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class TableWriter:
+    """Write typed batches to SQLite (default), CSV or Parquet, chosen by file extension"""
+
+    def __init__(self, path):
+        self.path = path
+        self.kind = os.path.splitext(path)[1].lower()
+        self._frames = []
+        self._first = True
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+        if self.kind not in (".db", ".sqlite", ".csv", ".parquet"):
+            raise ValueError(f"Unsupported output format '{self.kind}', use .db, .csv or .parquet")
+
+    def write(self, frame):
+        if self.kind == ".parquet":
+            self._frames.append(frame)  # Written in one piece on close
+        elif self.kind == ".csv":
+            frame.to_csv(self.path, mode="w" if self._first else "a", header=self._first, index=False)
+        else:
+            conn = sqlite3.connect(self.path)
+            try:
+                dated = frame.assign(**{c: frame[c].map(lambda t: t.isoformat() if pd.notna(t) else None)
+                                        for c in ("published_at", "expires_at")})
+                dated.to_sql(TABLE_NAME, conn, if_exists="replace" if self._first else "append", index=False)
+                if self._first:
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_ad_id ON {TABLE_NAME}(ad_id)")
+                conn.commit()
+            finally:
+                conn.close()
+        self._first = False
+
+    def close(self):
+        if self.kind == ".parquet" and self._frames:
+            pd.concat(self._frames, ignore_index=True).to_parquet(self.path, index=False)
+
+
+def print_report(report, total):
+    print(f"\n[NORMALIZE] {total} records")
+    print("[NORMALIZE] field              present    parsed    failed  examples")
+    for column, entry in report.items():
+        if "present" not in entry:
+            continue
+        examples = ", ".join(repr(e) for e in entry["examples"][:3])
+        print(f"[NORMALIZE] {column:<16} {entry['present']:>9} {entry['parsed']:>9} {entry['failed']:>9}  {examples}")
+    no_fetch = report.get("expires_at", {}).get("no_fetch_time", 0)
+    if no_fetch:
+        print(f"[NORMALIZE] expires_at: {no_fetch} records without a fetch time in pages.db")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Normalize parsed ad records into typed columns")
+    parser.add_argument("--input", default=JSON_DIR, help="Directory of parser JSON files or an NDJSON file")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="Output table (.db, .csv or .parquet)")
+    parser.add_argument("--report", help="Also write the per-field failure report as JSON")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Records per vectorized batch")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"[ERROR] Input {args.input} does not exist")
+        return 1
+
+    fetch_times = load_fetch_times()
+    writer = TableWriter(args.output)
+    report = {}
+    total = 0
+    for batch in iter_batches(iter_records(args.input), args.batch_size):
+        writer.write(normalize_frame(batch, fetch_times, report))
+        total += len(batch)
+        print(f"[NORMALIZE] {total} records normalized")
+    writer.close()
+
+    print_report(report, total)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"records": total, "fields": report}, f, ensure_ascii=False, indent=2)
+    print(f"[NORMALIZE] Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
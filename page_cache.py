@@ -0,0 +1,114 @@
+"""
+Shared Listing Page Cache
+=========================
+
+A leaf category page fetched by Step 1 is also page 1 of that leaf's listing,
+which Step 2 used to request again. Listing pages are now kept for a while in
+backend/pageDB/page_cache.db, shared by both steps:
+
+    page_cache(url, html, fetched_at, source)   html is zlib-compressed
+
+- Step 1 stores every leaf page that lists ads, fetched under the URL Step 2
+  will request as page 1 (?sort=new unless the leaf is due for a full sweep)
+- Step 2 stores the listing pages it fetches and looks each listing page up
+  here before requesting it (a resumed or repeated run reuses them too)
+
+Pages older than TTL_SECONDS count as missing and are deleted by purge(),
+which both steps run at start.
+
+Usage:
+    python page_cache.py [--purge] [--ttl SECONDS]
+"""
+
+import os
+import sys
+import time
+import zlib
+import sqlite3
+import argparse
+
+from listing_extractors import absolute_url
+
+PAGE_DB_DIR = os.path.join(os.path.dirname(__file__), "backend", "pageDB")
+PAGE_CACHE_PATH = os.path.join(PAGE_DB_DIR, "page_cache.db")
+
+TTL_SECONDS = 12 * 3600  # Step 1 of a daily run can take hours before Step 2 reaches a leaf
+COMPRESS_LEVEL = 6
+
+
+def listing_page_url(leaf_url, page=1, newest_first=False):
+    """URL of a leaf's listing page; both steps build page 1 with this, so Step 2 finds what Step 1 stored"""
+    params = (["sort=new"] if newest_first else []) + ([f"page={page}"] if page > 1 else [])
+    if not params:
+        return leaf_url
+    return leaf_url + ("&" if "?" in leaf_url else "?") + "&".join(params)
+
+
+def connect(db_path=PAGE_CACHE_PATH):
+    """Open page_cache.db (WAL, so Step 1 and Step 2 can use it at the same time)"""
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS page_cache (
+            url TEXT PRIMARY KEY,
+            html BLOB NOT NULL,
+            fetched_at REAL NOT NULL,
+            source TEXT
+        )
+    """)
+    conn.commit()
+    return conn
+
+
+def get(conn, url, ttl=TTL_SECONDS):
+    """Cached HTML of ``url`` if it was stored less than ``ttl`` seconds ago, else None"""
+    row = conn.execute("SELECT html, fetched_at FROM page_cache WHERE url=?", (absolute_url(url),)).fetchone()
+    if row is None or time.time() - row[1] > ttl:
+        return None
+    return zlib.decompress(row[0]).decode("utf-8")
+
+
+def put(conn, url, html, source):
+    conn.execute("INSERT OR REPLACE INTO page_cache (url, html, fetched_at, source) VALUES (?, ?, ?, ?)",
+                 (absolute_url(url), zlib.compress(html.encode("utf-8"), COMPRESS_LEVEL), time.time(), source))
+    conn.commit()
+
+
+def purge(conn, ttl=TTL_SECONDS):
+    """Delete pages older than ``ttl`` seconds; returns how many"""
+    deleted = conn.execute("DELETE FROM page_cache WHERE fetched_at < ?", (time.time() - ttl,)).rowcount
+    conn.commit()
+    return deleted
+
+
+def purge_expired(ttl=TTL_SECONDS):
+    conn = connect()
+    try:
+        return purge(conn, ttl)
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or purge the shared listing page cache")
+    parser.add_argument("--purge", action="store_true", help="Delete expired pages")
+    parser.add_argument("--ttl", type=int, default=TTL_SECONDS, help="Page lifetime in seconds")
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        if args.purge:
+            print(f"[PAGE CACHE] Deleted {purge(conn, args.ttl)} expired pages")
+        fresh_after = time.time() - args.ttl
+        for source, pages, fresh, size in conn.execute("""
+                SELECT source, COUNT(*), SUM(fetched_at >= ?), SUM(LENGTH(html))
+                FROM page_cache GROUP BY source ORDER BY source""", (fresh_after,)):
+            print(f"[PAGE CACHE] {source}: {pages} pages ({fresh} fresh), {size / 1e6:.1f}MB")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
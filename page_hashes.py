@@ -0,0 +1,263 @@
+"""
+Normalized Content Hashes for Ad Pages
+======================================
+
+Re-downloaded ad pages usually differ from the previous copy only in volatile
+bits (inline scripts, CSRF tokens, timestamps, view counters, tracking pixels).
+content_hash() strips those and hashes what is left, so two downloads of an
+unchanged ad hash to the same value.
+
+Hashes live in backend/pageDB/pages.db next to the HTML files:
+
+    page_hashes(ad_id, content_hash, fetched_at, changed_at,
+                parsed_hash, parsed_at, parser_version, field_versions)
+
+- The scraper stores content_hash on every fetch and skips rewriting the HTML
+  when it has not changed.
+- The parser (or the scraper with --parse-inline) stores parsed_hash,
+  parsed_at and the parser/field versions it ran with after writing the JSON.
+  Together these form the parse manifest the parser plans reparses from:
+  changed content, phones fetched after parsed_at, or stale versions.
+
+The scraper also keeps a snapshot of each ad's listing card:
+
+    listing_cards(ad_id, card_hash, title, price, published, teaser, seen_at, changed_at)
+
+Step 2 fetches the detail page only for ads whose card is new or changed
+since the snapshot; the snapshot is updated after a successful fetch.
+
+Incremental crawls remember, per leaf category, when it was last crawled
+and when it last had a full sweep (every page, default sort order):
+
+    leaf_crawls(leaf_url, last_crawl, last_full_sweep)
+"""
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+from datetime import datetime
+from collections import namedtuple
+
+PAGE_DB_DIR = os.path.join(os.path.dirname(__file__), "backend", "pageDB")
+PAGE_DB_PATH = os.path.join(PAGE_DB_DIR, "pages.db")
+
+# Removed before hashing, in this order
+VOLATILE_PATTERNS = [
+    re.compile(r'<script\b.*?</script\s*>', re.IGNORECASE | re.DOTALL),
+    re.compile(r'<style\b.*?</style\s*>', re.IGNORECASE | re.DOTALL),
+    re.compile(r'<noscript\b.*?</noscript\s*>', re.IGNORECASE | re.DOTALL),
+    re.compile(r'<!--.*?-->', re.DOTALL),
+    # Hidden form fields carry CSRF tokens
+    re.compile(r'<input\b[^>]*type=["\']hidden["\'][^>]*>', re.IGNORECASE),
+    # Tracking pixels and beacons
+    re.compile(r'<img\b[^>]*(?:width=["\']1["\'][^>]*height=["\']1["\']|height=["\']1["\'][^>]*width=["\']1["\'])[^>]*>', re.IGNORECASE),
+    # Per-request attributes
+    re.compile(r'\s(?:nonce|data-[\w-]*(?:token|nonce|timestamp|tracking)[\w-]*)=(?:"[^"]*"|\'[^\']*\')', re.IGNORECASE),
+    # Values that change every day without the ad changing ("Oglas prikazan", "Do isteka još")
+    re.compile(r'(Oglas prikazan|Do isteka još)(</dt>\s*<dd[^>]*>).*?(</dd>)', re.IGNORECASE | re.DOTALL),
+    # ISO timestamps and epoch milliseconds
+    re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})?'),
+    re.compile(r'\b1\d{12}\b'),
+]
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Columns added after the first release; connect() adds them to older databases
+ADDED_COLUMNS = [("parsed_at", "INTEGER"), ("parser_version", "INTEGER"), ("field_versions", "TEXT")]
+
+FULL_SWEEP_DAYS = 7  # A leaf gets a full sweep (every page, default order) at least this often
+
+# Listing card fields that decide whether an ad's detail page is fetched again
+CARD_FIELDS = ("title", "price", "published", "teaser")
+
+ParseState = namedtuple('ParseState', 'content_hash parsed_hash parsed_at parser_version field_versions')
+
+
+def normalize_html(html):
+    """Return ``html`` with volatile content removed and whitespace collapsed."""
+    for pattern in VOLATILE_PATTERNS:
+        if pattern.groups == 3:
+            html = pattern.sub(r'\1\2\3', html)
+        else:
+            html = pattern.sub('', html)
+    return WHITESPACE_PATTERN.sub(' ', html).strip()
+
+
+def content_hash(html):
+    """Normalized content hash of an ad page (hex string)."""
+    if isinstance(html, bytes):
+        html = html.decode("utf-8", errors="ignore")
+    return hashlib.blake2b(normalize_html(html).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def connect(db_path=PAGE_DB_PATH):
+    """Open pages.db, creating the table on first use."""
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS page_hashes (
+            ad_id INTEGER PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            fetched_at TEXT,
+            changed_at TEXT,
+            parsed_hash TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS listing_cards (
+            ad_id INTEGER PRIMARY KEY,
+            card_hash TEXT NOT NULL,
+            title TEXT,
+            price TEXT,
+            published TEXT,
+            teaser TEXT,
+            seen_at TEXT,
+            changed_at TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS leaf_crawls (
+            leaf_url TEXT PRIMARY KEY,
+            last_crawl TEXT,
+            last_full_sweep TEXT
+        )
+    """)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(page_hashes)")}
+    for name, sql_type in ADDED_COLUMNS:
+        if name not in columns:
+            conn.execute(f"ALTER TABLE page_hashes ADD COLUMN {name} {sql_type}")
+    conn.commit()
+    return conn
+
+
+def get_content_hash(conn, ad_id):
+    row = conn.execute("SELECT content_hash FROM page_hashes WHERE ad_id=?", (int(ad_id),)).fetchone()
+    return row[0] if row else None
+
+
+def record_fetch(conn, ad_id, new_hash, rewritten=False):
+    """Store the hash of a freshly fetched page. Returns True if the content changed.
+
+    changed_at is when the saved HTML was fetched; ``rewritten`` says the page
+    is saved again although unchanged (its file was missing), which moves it too.
+    """
+    now = datetime.now().isoformat()
+    old_hash = get_content_hash(conn, ad_id)
+    if old_hash == new_hash and not rewritten:
+        conn.execute("UPDATE page_hashes SET fetched_at=? WHERE ad_id=?", (now, int(ad_id)))
+        conn.commit()
+        return False
+    conn.execute("""
+        INSERT INTO page_hashes (ad_id, content_hash, fetched_at, changed_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(ad_id) DO UPDATE SET
+            content_hash=excluded.content_hash,
+            fetched_at=excluded.fetched_at,
+            changed_at=excluded.changed_at
+    """, (int(ad_id), new_hash, now, now))
+    conn.commit()
+    return old_hash != new_hash
+
+
+def load_parse_state(conn):
+    """Return {ad_id (str): ParseState} for every known page (field_versions decoded to a dict)."""
+    cursor = conn.execute("""
+        SELECT ad_id, content_hash, parsed_hash, parsed_at, parser_version, field_versions FROM page_hashes
+    """)
+    return {
+        str(row[0]): ParseState(row[1], row[2], row[3], row[4], json.loads(row[5]) if row[5] else {})
+        for row in cursor
+    }
+
+
+def record_parsed(conn, parsed, parser_version=None, field_versions=None):
+    """Mark pages as parsed. ``parsed`` is an iterable of (ad_id, content_hash)."""
+    now = int(time.time())
+    versions_json = json.dumps(field_versions, sort_keys=True) if field_versions else None
+    conn.executemany("""
+        INSERT INTO page_hashes (ad_id, content_hash, parsed_hash, parsed_at, parser_version, field_versions)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(ad_id) DO UPDATE SET
+            parsed_hash=excluded.parsed_hash,
+            parsed_at=excluded.parsed_at,
+            parser_version=excluded.parser_version,
+            field_versions=excluded.field_versions
+    """, [(int(ad_id), h, h, now, parser_version, versions_json) for ad_id, h in parsed])
+    conn.commit()
+
+
+def record_versions(conn, ad_ids, parser_version, field_versions):
+    """Move pages to new parser/field versions without reparsing (their output cannot change)."""
+    versions_json = json.dumps(field_versions, sort_keys=True) if field_versions else None
+    conn.executemany("UPDATE page_hashes SET parser_version=?, field_versions=? WHERE ad_id=?",
+                     [(parser_version, versions_json, int(ad_id)) for ad_id in ad_ids])
+    conn.commit()
+
+
+def card_hash(card):
+    """Hash of a listing card's CARD_FIELDS, or None if the card has no title and no price."""
+    if not card.get("title") and not card.get("price"):
+        return None  # Card markup not recognized; nothing to compare against
+    values = [WHITESPACE_PATTERN.sub(" ", card.get(name) or "").strip() for name in CARD_FIELDS]
+    return hashlib.blake2b("\x1f".join(values).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def load_card_hashes(conn, ad_ids):
+    """Return {ad_id (str): card_hash} for the given ads that have a snapshot."""
+    ids = [int(ad_id) for ad_id in ad_ids]
+    hashes = {}
+    for i in range(0, len(ids), 500):  # Stay under SQLite's bound-parameter limit
+        chunk = ids[i:i + 500]
+        cursor = conn.execute(f"SELECT ad_id, card_hash FROM listing_cards WHERE ad_id IN ({','.join('?' * len(chunk))})",
+                              chunk)
+        hashes.update((str(ad_id), h) for ad_id, h in cursor)
+    return hashes
+
+
+def record_cards(conn, cards):
+    """Store listing card snapshots. ``cards`` is an iterable of (ad_id, card) with a card_hash()."""
+    now = datetime.now().isoformat()
+    rows = []
+    for ad_id, card in cards:
+        h = card_hash(card)
+        if h is not None:
+            rows.append((int(ad_id), h) + tuple(card.get(name) for name in CARD_FIELDS) + (now, now))
+    conn.executemany(f"""
+        INSERT INTO listing_cards (ad_id, card_hash, {', '.join(CARD_FIELDS)}, seen_at, changed_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(ad_id) DO UPDATE SET
+            changed_at=CASE WHEN card_hash=excluded.card_hash THEN changed_at ELSE excluded.changed_at END,
+            card_hash=excluded.card_hash,
+            title=excluded.title,
+            price=excluded.price,
+            published=excluded.published,
+            teaser=excluded.teaser,
+            seen_at=excluded.seen_at
+    """, rows)
+    conn.commit()
+
+
+def last_full_sweep(conn, leaf_url):
+    """Time of the leaf's last full sweep (datetime) or None if it never had one."""
+    row = conn.execute("SELECT last_full_sweep FROM leaf_crawls WHERE leaf_url=?", (leaf_url,)).fetchone()
+    return datetime.fromisoformat(row[0]) if row and row[0] else None
+
+
+def full_sweep_due(conn, leaf_url, days=FULL_SWEEP_DAYS):
+    """True if the leaf never had a full sweep or its last one is ``days`` or more days old."""
+    last = last_full_sweep(conn, leaf_url)
+    return last is None or (datetime.now() - last).days >= days
+
+
+def record_leaf_crawl(conn, leaf_url, full_sweep):
+    """Remember that a leaf was crawled now (and whether every page was swept)."""
+    now = datetime.now().isoformat()
+    conn.execute("""
+        INSERT INTO leaf_crawls (leaf_url, last_crawl, last_full_sweep) VALUES (?, ?, ?)
+        ON CONFLICT(leaf_url) DO UPDATE SET
+            last_crawl=excluded.last_crawl,
+            last_full_sweep=COALESCE(excluded.last_full_sweep, last_full_sweep)
+    """, (leaf_url, now, now if full_sweep else None))
+    conn.commit()
@@ -2,16 +2,22 @@ import os
 import sys
 import json
 import time
+import math
 import traceback
 import re
-import sqlite3
 import logging
 from datetime import datetime
-from bs4 import BeautifulSoup
+from collections import namedtuple, Counter
 from multiprocessing import Pool, cpu_count
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import psutil
 
+import page_hashes
+import phone_store
+import html_regions
+import embedded_state
+from html_backends import get_backend, BACKEND_NAMES, DEFAULT_BACKEND
+
 # Comprehensive logging setup
 def setup_comprehensive_logging():
     """Setup comprehensive logging with info and error loggers"""
@@ -118,11 +124,13 @@ def log_exception(operation, exception):
         import traceback
         print(f"EXCEPTION: {operation} - {str(exception)} | Traceback: {traceback.format_exc()}")
 
-# Paths
-INPUT_DIR = "backend/website"
-OUTPUT_DIR = "backend/json"
-LOG_DIR = "backend/logs"
-DB_PATH = "backend/phoneDB/phones.db"
+# Paths, next to this file like the scrapers' (the inline parser runs from Step 2's working directory)
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), "backend")
+INPUT_DIR = os.path.join(BACKEND_DIR, "website")
+OUTPUT_DIR = os.path.join(BACKEND_DIR, "json")
+LOG_DIR = os.path.join(BACKEND_DIR, "logs")
+DB_PATH = phone_store.PHONE_DB_PATH
+PHONE_INDEX_PATH = phone_store.PHONE_INDEX_PATH
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -138,41 +146,329 @@ EXIT_FS_ERROR = 4
 BATCH_SIZE = 200  # Much larger batches
 MAX_WORKERS = cpu_count()  # Use all CPU cores
 CHUNK_SIZE = 50  # Files per worker chunk
+IN_FLIGHT_PER_WORKER = 2  # Chunks queued per worker so none idles while results are collected
+
+# Memory governor: the pool is resized to keep this process and its workers under a ceiling
+MEMORY_CEILING_FRACTION = 0.5  # Default ceiling as a share of total RAM (--memory-ceiling-mb)
+MIN_AVAILABLE_FRACTION = 0.10  # Also shrink when less system memory than this is available
+MEMORY_CHECK_INTERVAL = 2.0  # Seconds between memory samples
+GROW_INTERVAL = 30.0  # Seconds between two pool growths (and after a shrink)
+MIN_WORKERS = 1
 
 # Pre-compiled regex patterns for speed
 LAT_LNG_PATTERN = re.compile(r'"lat":([\d\.-]+),"lng":([\d\.-]+),"approximate":(true|false)')
 AD_ID_PATTERN = re.compile(r'^(\d+)\.html$')
 
-# Global database connection cache to avoid repeated DB connections
-_db_cache = {}
+# Memory-mapped phone index (phone_store.PhoneIndex), shared by all workers through the page cache
+_phone_index = None
+
+# HTML extraction backend used by this process (see html_backends.py)
+_backend_name = DEFAULT_BACKEND
+
+# "full" parses the whole page, "regions" only the regions cut out by html_regions.py
+EXTRACT_MODES = ("full", "regions")
+_extract_mode = "full"
+_embedded_state = False
 
-def load_phone_cache():
-    """Load all phone data into memory cache for ultra-fast lookups"""
-    global _db_cache
+def prepare_phone_index():
+    """Rebuild the phone index if phones.db is newer. Returns its path or None on failure"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT ad_id, phones FROM phones")
-        _db_cache = {row[0]: row[1] for row in cursor.fetchall()}
-        conn.close()
-        print(f"[CACHE] Loaded {len(_db_cache)} phone records into memory")
+        return phone_store.ensure_phone_index(DB_PATH, PHONE_INDEX_PATH)
     except Exception as e:
-        print(f"[CACHE ERROR] Failed to load phone cache: {e}")
-        _db_cache = {}
+        print(f"[CACHE ERROR] Failed to build phone index: {e}")
+        return None
+
+def load_phone_cache(index_path=PHONE_INDEX_PATH, verbose=True):
+    """Memory-map the phone index; workers share its pages instead of each holding a dict copy"""
+    global _phone_index
+    if _phone_index is not None:
+        _phone_index.close()
+        _phone_index = None
+    if not index_path:
+        return
+    try:
+        _phone_index = phone_store.PhoneIndex(index_path)
+        if verbose:
+            print(f"[CACHE] Mapped {len(_phone_index)} phone records from {index_path}")
+    except Exception as e:
+        print(f"[CACHE ERROR] Failed to load phone index: {e}")
 
 def get_phone_from_cache(ad_id):
-    """Ultra-fast phone lookup from memory cache"""
-    phones_json = _db_cache.get(ad_id)
-    if phones_json:
-        try:
-            phones = json.loads(phones_json)
-            return phones[0].strip() if phones and isinstance(phones[0], str) else None
-        except:
-            return None
-    return None
-
-def process_single_file_ultrafast(filename):
-    """Ultra-optimized single file processing"""
+    """Ultra-fast phone lookup in the memory-mapped index"""
+    if _phone_index is None:
+        return None
+    return _phone_index.get(ad_id)
+
+def location_from_match(match):
+    return {
+        "lat": float(match.group(1)),
+        "lng": float(match.group(2)),
+        "approximate": match.group(3) == 'true'
+    }
+
+# --- Declarative field extraction spec ---
+#
+# One FieldSpec per group of output keys, in output key order:
+#   selector  CSS selector matched against the document (None = not from the page)
+#   many      select all matches instead of the first one
+#   post      post(backend, match, sub, podaci) writes the output key(s)
+#   sub       named CSS selectors the post-processor runs inside the match
+#   version   bump when the extractor's output changes (see stale_fields)
+#   markers   lowercase raw HTML markers the extractor depends on (None = not page-bound)
+# Selectors are compiled once per worker and backend (compile_field_specs).
+FieldSpec = namedtuple('FieldSpec', 'name selector many post sub version markers')
+
+SYSTEM_DETAIL_KEYS = {
+    "Oglas objavljen": "oglas_objavljen",
+    "Do isteka još": "do_isteka",
+    "Oglas prikazan": "oglas_prikazan",
+}
+
+def post_link(backend, tag, sub, podaci):
+    if tag is not None and backend.attr(tag, "href"):
+        podaci["link"] = backend.attr(tag, "href")
+
+def post_lokacija(backend, scripts, sub, podaci):
+    for script in scripts:
+        script_text = backend.script_text(script)
+        if script_text:
+            match = LAT_LNG_PATTERN.search(script_text)
+            if match:
+                podaci["lokacija"] = location_from_match(match)
+                return
+
+def post_text(key, separator=""):
+    def post(backend, tag, sub, podaci):
+        podaci[key] = backend.text(tag, separator) if tag is not None else None
+    return post
+
+def post_opis(backend, tag, sub, podaci):
+    podaci["opis"] = backend.text(tag, " ").replace("\n", " ") if tag is not None else None
+
+def post_osnovni_podaci(backend, section, sub, podaci):
+    if section is None:
+        return
+    for dt, dd in zip(backend.select(section, sub["dt"]), backend.select(section, sub["dd"])):
+        key_span = backend.select_one(dt, sub["value"])
+        val_span = backend.select_one(dd, sub["value"])
+        if key_span is not None and val_span is not None:
+            kljuc = backend.text(key_span)
+            vrijednost = backend.text(val_span)
+            if kljuc and vrijednost:
+                podaci[kljuc] = vrijednost
+
+def post_grupe_svojstava(backend, sekcije, sub, podaci):
+    for sekcija in sekcije:
+        naslov_grupe = backend.select_one(sekcija, sub["title"])
+        if naslov_grupe is None:
+            continue
+        stavke = [t for t in (backend.text(li) for li in backend.select(sekcija, sub["item"])) if t]
+        if stavke:
+            podaci[backend.text(naslov_grupe)] = stavke
+
+def post_agencija(backend, owner_section, sub, podaci):
+    if owner_section is None:
+        return
+    agencija_tag = backend.select_one(owner_section, sub["name"])
+    if agencija_tag is not None:
+        podaci["naziv_agencije"] = backend.text(agencija_tag)
+    web_tag = backend.select_one(owner_section, sub["web"])
+    if web_tag is not None:
+        podaci["profil_agencije"] = backend.attr(web_tag, "href")
+    email_tag = backend.select_one(owner_section, sub["email"])
+    if email_tag is not None:
+        podaci["email_agencije"] = backend.text(email_tag)
+    adresa_li = backend.select_one(owner_section, sub["address_icon"])
+    if adresa_li is not None and backend.parent(adresa_li) is not None:
+        podaci["adresa_agencije"] = backend.text(backend.parent(adresa_li)).replace("Adresa: ", "")
+
+def post_telefon(backend, _, sub, podaci):
+    # Ultra-fast phone lookup from the memory-mapped index
+    podaci["telefon"] = get_phone_from_cache(podaci["id"])
+
+def post_sustavni_podaci(backend, system_details, sub, podaci):
+    if system_details is None:
+        return
+    for dt, dd in zip(backend.select(system_details, sub["dt"]), backend.select(system_details, sub["dd"])):
+        key = backend.text(dt)
+        val = backend.text(dd)
+        if key and val and key in SYSTEM_DETAIL_KEYS:
+            podaci[SYSTEM_DETAIL_KEYS[key]] = val
+
+def post_slike(backend, tags, sub, podaci):
+    image_urls = (backend.attr(tag, "data-large-image-url") for tag in tags)
+    podaci["slike"] = [url for url in image_urls if url]
+
+FIELD_SPECS = [
+    FieldSpec("link", "link[rel~='canonical']", False, post_link, {}, 1, ("canonical",)),
+    FieldSpec("lokacija", "script", True, post_lokacija, {}, 1, ('"lat":',)),
+    FieldSpec("naslov", "title", False, post_text("naslov"), {}, 1, ("<title",)),
+    FieldSpec("cijena", "dl.ClassifiedDetailSummary-priceRow dd.ClassifiedDetailSummary-priceDomestic", False,
+              post_text("cijena"), {}, 1, ("classifieddetailsummary-pricerow", "application/ld+json")),
+    FieldSpec("osnovni_podaci", "div.ClassifiedDetailBasicDetails dl.ClassifiedDetailBasicDetails-list", False,
+              post_osnovni_podaci,
+              {"dt": "dt", "dd": "dd", "value": "span.ClassifiedDetailBasicDetails-textWrapContainer"},
+              1, ("classifieddetailbasicdetails",)),
+    FieldSpec("opis", "div.ClassifiedDetailDescription-text", False, post_opis, {}, 1,
+              ("classifieddetaildescription-text",)),
+    FieldSpec("grupe_svojstava", "section.ClassifiedDetailPropertyGroups-group", True, post_grupe_svojstava,
+              {"title": "h3.ClassifiedDetailPropertyGroups-groupTitle",
+               "item": "li.ClassifiedDetailPropertyGroups-groupListItem"},
+              1, ("classifieddetailpropertygroups-group",)),
+    FieldSpec("agencija", "div.ClassifiedDetailOwnerDetails", False, post_agencija,
+              {"name": "h2.ClassifiedDetailOwnerDetails-title a",
+               "web": "a[href^='http']:not([href^='mailto'])",
+               "email": "a[href^='mailto']",
+               "address_icon": "li.ClassifiedDetailOwnerDetails-contactEntry i[aria-label='Adresa']"},
+              1, ("classifieddetailownerdetails",)),
+    FieldSpec("telefon", None, False, post_telefon, {}, 1, None),
+    FieldSpec("sustavni_podaci", "dl.ClassifiedDetailSystemDetails-list", False, post_sustavni_podaci,
+              {"dt": "dt", "dd": "dd"}, 1, ("classifieddetailsystemdetails-list",)),
+    FieldSpec("slike", "li[data-media-type='image']", True, post_slike, {}, 1,
+              ("data-media-type", "application/ld+json")),
+]
+
+# Output versions, stored in every record and in the pages.db manifest. Bump a
+# FieldSpec's version when only that extractor changes, PARSER_VERSION when
+# every record changes; the planner then reparses what the change affects.
+PARSER_VERSION = 1
+FIELD_VERSIONS = {spec.name: spec.version for spec in FIELD_SPECS}
+FIELD_MARKERS = {spec.name: spec.markers for spec in FIELD_SPECS}
+
+_compiled_specs = {}
+
+# Per-process {field name: [calls, hits, seconds]}; workers send theirs back with every chunk
+_field_stats = {}
+
+def compile_field_specs(backend):
+    """Return [(spec, selector, sub selectors)] with selectors compiled for ``backend`` (cached)"""
+    compiled = _compiled_specs.get(backend.name)
+    if compiled is None:
+        compiled = _compiled_specs[backend.name] = [
+            (spec,
+             backend.compile(spec.selector) if spec.selector else None,
+             {key: backend.compile(css) for key, css in spec.sub.items()})
+            for spec in FIELD_SPECS
+        ]
+    return compiled
+
+def take_field_stats():
+    """Return and reset this process's per-field counters"""
+    global _field_stats
+    stats, _field_stats = _field_stats, {}
+    return stats
+
+def merge_field_stats(total, stats):
+    for name, (calls, hits, seconds) in stats.items():
+        entry = total.setdefault(name, [0, 0, 0.0])
+        entry[0] += calls
+        entry[1] += hits
+        entry[2] += seconds
+
+def print_field_stats(stats):
+    """Per-field hit rate and time, slowest first - dead or slow selectors stand out"""
+    if not stats:
+        return
+    print("\n[FIELD STATS] field                 hit rate   avg ms   total s")
+    for name, (calls, hits, seconds) in sorted(stats.items(), key=lambda item: -item[1][2]):
+        hit_rate = hits / calls * 100 if calls else 0
+        avg_ms = seconds / calls * 1000 if calls else 0
+        print(f"[FIELD STATS] {name:<20} {hit_rate:7.1f}%  {avg_ms:7.3f}  {seconds:8.2f}")
+
+def extract_ad_fields(backend, html, oglas_id, extract_mode="full", embedded=False):
+    """Extract all output fields of one ad page with the given HTML backend (see FIELD_SPECS)
+
+    embedded=True takes price, images and location from the page's inline
+    state (embedded_state.py, one regex over the raw HTML) and uses the DOM
+    only for fields the inline state does not have.
+    """
+    inline = {}
+    if embedded:
+        inline = embedded_state.extract_embedded_fields(html)
+        match = LAT_LNG_PATTERN.search(html)
+        if match:
+            inline["lokacija"] = location_from_match(match)
+    if extract_mode == "regions":
+        # Falls back to the full page when it cannot be sliced safely
+        html = html_regions.slice_regions(html) or html
+    soup = backend.parse(html)
+    podaci = {"id": oglas_id}
+
+    for spec, selector, sub in compile_field_specs(backend):
+        t0 = time.perf_counter()
+        if spec.name in inline:
+            podaci[spec.name] = inline[spec.name]
+            hit = True
+        elif selector is None:
+            spec.post(backend, None, sub, podaci)
+            hit = podaci.get(spec.name) is not None
+        elif spec.many:
+            match = backend.select(soup, selector)
+            spec.post(backend, match, sub, podaci)
+            hit = bool(match)
+        else:
+            match = backend.select_one(soup, selector)
+            spec.post(backend, match, sub, podaci)
+            hit = match is not None
+        stats = _field_stats.get(spec.name)
+        if stats is None:
+            stats = _field_stats[spec.name] = [0, 0, 0.0]
+        stats[0] += 1
+        stats[1] += hit
+        stats[2] += time.perf_counter() - t0
+
+    return podaci
+
+# Compact per-file result passed back from workers. detail is the input content
+# hash on success and the (truncated) error message on error; record is the
+# parsed dict, only filled in when streaming NDJSON.
+ParseResult = namedtuple('ParseResult', 'filename status duration_ms ad_id detail record')
+
+def parse_ad_html(html, ad_id, content_hash=None, write_json=True):
+    """Parse one ad page held in memory - library entry point
+
+    ``html`` may be str or UTF-8 bytes. Uses this process's backend and
+    extraction settings (see init_parse_worker), writes OUTPUT_DIR/{ad_id}.json
+    unless write_json is False and returns (record, content_hash). Pass the
+    content hash if the caller already computed it.
+    """
+    if isinstance(html, bytes):
+        html = html.decode("utf-8", errors="ignore")
+    oglas_id = str(ad_id)
+    if content_hash is None:
+        content_hash = page_hashes.content_hash(html)
+    podaci = extract_ad_fields(get_backend(_backend_name), html, oglas_id, _extract_mode, _embedded_state)
+    podaci["_meta"] = {"parser_version": PARSER_VERSION, "field_versions": FIELD_VERSIONS, "input_hash": content_hash}
+
+    # Fast JSON write with minimal formatting
+    if write_json:
+        json_putanja = os.path.join(OUTPUT_DIR, oglas_id + ".json")
+        with open(json_putanja, "w", encoding="utf-8") as jf:
+            json.dump(podaci, jf, ensure_ascii=False, separators=(',', ':'))  # No indent for speed
+    return podaci, content_hash
+
+def process_page_inline(html, ad_id, content_hash=None, write_json=True, return_record=False):
+    """Pool task for pages handed over by the scraper (--parse-inline); returns a ParseResult
+
+    write_json and return_record work as in process_single_file_ultrafast.
+    """
+    file_start = time.time()
+    filename = f"{ad_id}.html"
+    try:
+        podaci, content_hash = parse_ad_html(html, ad_id, content_hash, write_json=write_json)
+        log_parsing_completion("html_to_json", 1, "ad_data")
+        return ParseResult(filename, 'success', int((time.time() - file_start) * 1000), str(ad_id), content_hash,
+                           podaci if return_record else None)
+    except Exception as e:
+        log_parsing_failure("html_to_json", str(e)[:200], html[:1000] if isinstance(html, str) else "")
+        return ParseResult(filename, 'error', int((time.time() - file_start) * 1000), str(ad_id), str(e)[:200], None)
+
+def process_single_file_ultrafast(filename, reparse=False, write_json=True, return_record=False):
+    """Ultra-optimized single file processing
+
+    write_json=False skips the per-file JSON write; return_record=True puts the
+    parsed dict in the result's record field (used for NDJSON streaming).
+    """
     if not filename.endswith(".html"):
         return None
     
@@ -180,141 +476,27 @@ def process_single_file_ultrafast(filename):
     filepath = os.path.join(INPUT_DIR, filename)
     base_filename = os.path.splitext(filename)[0]
     
-    # Skip if JSON already exists (should be pre-filtered but double check)
+    # Skip if JSON already exists (should be pre-filtered but double check),
+    # unless the page content changed since it was parsed
     json_file = os.path.join(OUTPUT_DIR, base_filename + ".json")
-    if os.path.exists(json_file):
-        return {'filename': filename, 'status': 'skipped', 'duration_ms': 0}
+    if not reparse and write_json and os.path.exists(json_file):
+        return ParseResult(filename, 'skipped', 0, base_filename, None, None)
     
     try:
         # Fast file read with minimal encoding detection
         with open(filepath, "r", encoding="utf-8", errors='ignore') as f:
             html = f.read()
 
-        # Use lxml parser for speed (falls back to html.parser if not available)
-        try:
-            soup = BeautifulSoup(html, "lxml")
-        except:
-            soup = BeautifulSoup(html, "html.parser")
-
         # Extract ad_id from filename (now just the number before .html)
         oglas_id = base_filename
-        podaci = {"id": oglas_id}
-
-        # Canonical link - single selector
-        canonical_tag = soup.find("link", rel="canonical")
-        if canonical_tag and canonical_tag.get("href"):
-            podaci["link"] = canonical_tag["href"]
-
-        # Location from script tags - optimized regex search
-        script_tags = soup.find_all("script")
-        for script in script_tags:
-            if script.string:
-                match = LAT_LNG_PATTERN.search(script.string)
-                if match:
-                    podaci["lokacija"] = {
-                        "lat": float(match.group(1)),
-                        "lng": float(match.group(2)),
-                        "approximate": match.group(3) == 'true'
-                    }
-                    break
-
-        # Title - direct find
-        title_tag = soup.find("title")
-        podaci["naslov"] = title_tag.get_text(strip=True) if title_tag else None
-
-        # Price - single CSS selector
-        price_tag = soup.select_one("dl.ClassifiedDetailSummary-priceRow dd.ClassifiedDetailSummary-priceDomestic")
-        podaci["cijena"] = price_tag.get_text(strip=True) if price_tag else None
-
-        # Basic details - optimized processing
-        info_section = soup.select_one("div.ClassifiedDetailBasicDetails dl.ClassifiedDetailBasicDetails-list")
-        if info_section:
-            dt_tags = info_section.find_all("dt")
-            dd_tags = info_section.find_all("dd")
-            for dt, dd in zip(dt_tags, dd_tags):
-                key_span = dt.find("span", class_="ClassifiedDetailBasicDetails-textWrapContainer")
-                val_span = dd.find("span", class_="ClassifiedDetailBasicDetails-textWrapContainer")
-                if key_span and val_span:
-                    kljuc = key_span.get_text(strip=True)
-                    vrijednost = val_span.get_text(strip=True)
-                    if kljuc and vrijednost:
-                        podaci[kljuc] = vrijednost
-
-        # Description - single operation
-        desc_tag = soup.find("div", class_="ClassifiedDetailDescription-text")
-        podaci["opis"] = desc_tag.get_text(" ", strip=True).replace("\n", " ") if desc_tag else None
-
-        # Additional property groups - batch processing
-        dodatne_sekcije = soup.select("section.ClassifiedDetailPropertyGroups-group")
-        for sekcija in dodatne_sekcije:
-            naslov_grupe = sekcija.find("h3", class_="ClassifiedDetailPropertyGroups-groupTitle")
-            if not naslov_grupe:
-                continue
-            ime_grupe = naslov_grupe.get_text(strip=True)
-
-            # Fast list comprehension instead of loop
-            stavke = [li.get_text(strip=True) for li in sekcija.select("li.ClassifiedDetailPropertyGroups-groupListItem") if li.get_text(strip=True)]
-            if stavke:
-                podaci[ime_grupe] = stavke
-
-        # Owner details - batch selectors
-        owner_section = soup.select_one("div.ClassifiedDetailOwnerDetails")
-        if owner_section:
-            agencija_tag = owner_section.select_one("h2.ClassifiedDetailOwnerDetails-title a")
-            if agencija_tag:
-                podaci["naziv_agencije"] = agencija_tag.get_text(strip=True)
-
-            web_tag = owner_section.select_one("a[href^='http']:not([href^='mailto'])")
-            if web_tag:
-                podaci["profil_agencije"] = web_tag.get("href")
-
-            email_tag = owner_section.select_one("a[href^='mailto']")
-            if email_tag:
-                podaci["email_agencije"] = email_tag.get_text(strip=True)
-
-            adresa_li = owner_section.select_one("li.ClassifiedDetailOwnerDetails-contactEntry i[aria-label='Adresa']")
-            if adresa_li and adresa_li.parent:
-                podaci["adresa_agencije"] = adresa_li.parent.get_text(strip=True).replace("Adresa: ", "")
-
-        # Ultra-fast phone lookup from memory cache
-        podaci["telefon"] = get_phone_from_cache(oglas_id)
-
-        # System details - optimized processing
-        system_details = soup.select_one("dl.ClassifiedDetailSystemDetails-list")
-        if system_details:
-            dt_tags = system_details.find_all("dt")
-            dd_tags = system_details.find_all("dd")
-            for dt, dd in zip(dt_tags, dd_tags):
-                key = dt.get_text(strip=True)
-                val = dd.get_text(strip=True)
-                if key and val:
-                    if key == "Oglas objavljen":
-                        podaci["oglas_objavljen"] = val
-                    elif key == "Do isteka još":
-                        podaci["do_isteka"] = val
-                    elif key == "Oglas prikazan":
-                        podaci["oglas_prikazan"] = val
-
-        # Images - list comprehension for speed
-        image_tags = soup.select("li[data-media-type='image']")
-        podaci["slike"] = [tag.get("data-large-image-url") for tag in image_tags if tag.get("data-large-image-url")]
-
-        # Fast JSON write with minimal formatting
-        json_putanja = os.path.join(OUTPUT_DIR, base_filename + ".json")
-        with open(json_putanja, "w", encoding="utf-8") as jf:
-            json.dump(podaci, jf, ensure_ascii=False, separators=(',', ':'))  # No indent for speed
+        podaci, input_hash = parse_ad_html(html, oglas_id, write_json=write_json)
 
         duration_ms = int((time.time() - file_start) * 1000)
         
         # Log successful parsing
         log_parsing_completion("html_to_json", 1, "ad_data")
         
-        return {
-            'filename': filename,
-            'status': 'success',
-            'duration_ms': duration_ms,
-            'ad_id': oglas_id
-        }
+        return ParseResult(filename, 'success', duration_ms, oglas_id, input_hash, podaci if return_record else None)
 
     except Exception as e:
         duration_ms = int((time.time() - file_start) * 1000)
@@ -322,44 +504,231 @@ def process_single_file_ultrafast(filename):
         # Log parsing failure
         log_parsing_failure("html_to_json", str(e)[:200], html[:1000] if 'html' in locals() else "")
         
-        return {
-            'filename': filename,
-            'status': 'error',
-            'duration_ms': duration_ms,
-            'error': str(e)[:200],  # Truncate error for speed
-            'ad_id': oglas_id if 'oglas_id' in locals() else 'unknown'
-        }
-
-def process_batch_ultrafast(filenames):
-    """Ultra-fast batch processing with ProcessPoolExecutor"""
-    print(f"[BATCH] Processing {len(filenames)} files with {MAX_WORKERS} workers...")
-    
-    batch_start = time.time()
+        return ParseResult(filename, 'error', duration_ms, oglas_id if 'oglas_id' in locals() else 'unknown',
+                           str(e)[:200], None)  # Truncate error for speed
+
+def process_chunk_ultrafast(filenames, reparse_flags, write_json=True, return_record=False):
+    """Parse a chunk of files in one task; returns compact ParseResult tuples and the chunk's field stats"""
     results = []
+    for filename, reparse in zip(filenames, reparse_flags):
+        result = process_single_file_ultrafast(filename, reparse, write_json, return_record)
+        if result is not None:
+            results.append(result)
+    return results, take_field_stats()
+
+class NdjsonWriter:
+    """Writes parsed records as newline-delimited JSON to stdout or a size-rotated file.
+
+    With a file target, output continues in "name.1.ndjson", "name.2.ndjson", ...
+    once the current file exceeds max_bytes.
+    """
+
+    def __init__(self, target, max_bytes=None, stream=None):
+        self.target = target
+        self.max_bytes = max_bytes
+        self.records_written = 0
+        self._index = 0
+        self._bytes = 0
+        if target == "-":
+            self._stream = stream or sys.stdout
+            self._owns_stream = False
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+            self._stream = open(target, "w", encoding="utf-8")
+            self._owns_stream = True
+
+    def _rotate(self):
+        self._stream.close()
+        self._index += 1
+        stem, ext = os.path.splitext(self.target)
+        self._stream = open(f"{stem}.{self._index}{ext or '.ndjson'}", "w", encoding="utf-8")
+        self._bytes = 0
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n"
+        size = len(line.encode("utf-8"))  # Files are UTF-8; Croatian letters take two bytes
+        if self._owns_stream and self.max_bytes and self._bytes and self._bytes + size > self.max_bytes:
+            self._rotate()
+        self._stream.write(line)
+        self._bytes += size
+        self.records_written += 1
+
+    def flush(self):
+        self._stream.flush()
+
+    def close(self):
+        if self._owns_stream:
+            self._stream.close()
+        else:
+            self._stream.flush()
+
+def init_parse_worker(backend_name=DEFAULT_BACKEND, phone_index_path=PHONE_INDEX_PATH, extract_mode="full",
+                      embedded=False, stdout_to_stderr=False):
+    """Per-worker setup, run once when the pool starts each worker process"""
+    global _backend_name, _extract_mode, _embedded_state
+    if stdout_to_stderr:
+        sys.stdout = sys.stderr  # stdout carries the parent's NDJSON records
+    _backend_name = backend_name
+    _extract_mode = extract_mode
+    _embedded_state = embedded
+    get_backend(backend_name)  # Import the backend once per worker
+    setup_comprehensive_logging()
+    # Forked workers inherit the parent's mapping; spawned workers map the same file
+    if _phone_index is None:
+        load_phone_cache(phone_index_path, verbose=False)
+
+def iter_chunks(filenames, chunk_size):
+    for i in range(0, len(filenames), chunk_size):
+        yield filenames[i:i + chunk_size]
+
+class MemoryGovernor:
+    """Size the worker pool so the parser stays under a memory ceiling
+
+    Samples the RSS of this process and its workers and the system's available
+    memory. Over the ceiling, or with less than MIN_AVAILABLE_FRACTION of RAM
+    available, the pool shrinks by as many workers as the excess needs; with
+    room for two more workers it grows by one. A resize drains the running
+    chunks and restarts the pool at the new size, which also hands back the
+    memory held by long-lived workers.
+    """
+
+    def __init__(self, make_executor, max_workers, ceiling_bytes):
+        self.make_executor = make_executor
+        self.max_workers = max_workers
+        self.ceiling = ceiling_bytes
+        self.workers = self.target = max_workers
+        self.executor = make_executor(max_workers)
+        self.used = self.peak = 0
+        self.resizes = 0
+        self._process = psutil.Process()
+        self._reserve = psutil.virtual_memory().total * MIN_AVAILABLE_FRACTION
+        self._last_check = 0.0
+        self._last_resize = time.time()
+
+    def sample(self):
+        """Return (RSS of the parser and its workers, average worker RSS, available system memory)"""
+        own = self._process.memory_info().rss
+        workers = []
+        for child in self._process.children(recursive=True):
+            try:
+                workers.append(child.memory_info().rss)
+            except psutil.Error:
+                pass  # Exited between listing and sampling
+        self.used = own + sum(workers)
+        self.peak = max(self.peak, self.used)
+        per_worker = sum(workers) / len(workers) if workers else own
+        return self.used, per_worker, psutil.virtual_memory().available
+
+    def check(self):
+        """Sample memory (at most every MEMORY_CHECK_INTERVAL); True while the pool needs a resize"""
+        now = time.time()
+        if now - self._last_check >= MEMORY_CHECK_INTERVAL:
+            self._last_check = now
+            used, per_worker, available = self.sample()
+            excess = max(used - self.ceiling, self._reserve - available)
+            target = self.workers
+            if excess > 0:
+                target = max(MIN_WORKERS, self.workers - math.ceil(excess / max(per_worker, 1)))
+            elif (self.workers < self.max_workers and now - self._last_resize >= GROW_INTERVAL
+                  and used + 2 * per_worker <= self.ceiling and available - 2 * per_worker >= self._reserve):
+                target = self.workers + 1
+            if target != self.target:
+                print(f"[MEMORY] {used / 1024**2:.0f}MB used (ceiling {self.ceiling / 1024**2:.0f}MB), "
+                      f"{available / 1024**2:.0f}MB available: workers {self.workers} -> {target}")
+                self.target = target
+        return self.target != self.workers
+
+    def resize(self):
+        """Restart the (drained) pool with ``target`` workers"""
+        self.executor.shutdown(wait=True)
+        self.workers = self.target
+        self.executor = self.make_executor(self.workers)
+        self.resizes += 1
+        self._last_resize = time.time()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+def iter_parse_results(governor, filenames, reparse_files=frozenset(), write_json=True, return_record=False,
+                       field_stats=None):
+    """Keep the governed pool fed with file chunks and yield results in completion order
+
+    Each task carries up to CHUNK_SIZE files, so pickling and IPC happen once
+    per chunk instead of once per file. Small runs use smaller chunks so every
+    worker still gets work. At most IN_FLIGHT_PER_WORKER chunks per current
+    worker are queued at a time; when the governor asks for another pool size,
+    submission pauses until the queue drains and the pool is restarted.
+    Per-field stats from the workers are merged into ``field_stats`` if given.
+    """
+    chunk_size = max(1, min(CHUNK_SIZE, len(filenames) // (governor.max_workers * IN_FLIGHT_PER_WORKER) or 1))
+    chunks = iter_chunks(filenames, chunk_size)
+    pending = set()
+    submitted = 0
+    while True:
+        if not governor.check():
+            for chunk in chunks:
+                pending.add(governor.executor.submit(process_chunk_ultrafast, chunk, [f in reparse_files for f in chunk],
+                                                     write_json, return_record))
+                submitted += len(chunk)
+                if len(pending) >= governor.workers * IN_FLIGHT_PER_WORKER:
+                    break
+        elif not pending:
+            if submitted == len(filenames):
+                return
+            governor.resize()
+            continue
+        if not pending:
+            return
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            results, stats = future.result()
+            if field_stats is not None:
+                merge_field_stats(field_stats, stats)
+            yield from results
+
+def record_parsed(parsed):
+    """Store (ad_id, content_hash) pairs in the pages.db manifest with the current versions"""
+    conn = page_hashes.connect()
+    try:
+        page_hashes.record_parsed(conn, parsed, PARSER_VERSION, FIELD_VERSIONS)
+    finally:
+        conn.close()
+
+EMPTY_PARSE_STATE = page_hashes.ParseState(None, None, None, None, {})
+
+def stale_fields(state):
+    """Extractors that changed since a page was parsed; {"*"} if the whole parser did
+
+    Pages parsed before versions were recorded count as version 1 of everything.
+    """
+    if (state.parser_version or 1) != PARSER_VERSION:
+        return {"*"}
+    return {name for name, version in FIELD_VERSIONS.items() if state.field_versions.get(name, 1) != version}
+
+def page_affected(filename, fields):
+    """True if a change to ``fields`` can change this page's output (marker check on the raw HTML)"""
+    if "*" in fields or any(FIELD_MARKERS.get(name) is None for name in fields):
+        return True
+    with open(os.path.join(INPUT_DIR, filename), "r", encoding="utf-8", errors='ignore') as f:
+        html = f.read().lower()
+    return any(marker in html for name in fields for marker in FIELD_MARKERS[name])
+
+def finish_batch(results, batch_duration):
+    """Record parse hashes and print statistics for one batch of results"""
+    # Remember which content each JSON was built from
+    parsed = [(r.ad_id, r.detail) for r in results if r.status == 'success' and r.ad_id.isdigit()]
+    if parsed:
+        record_parsed(parsed)
     
-    # Use ProcessPoolExecutor for better performance than Pool
-    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        # Submit all tasks
-        future_to_filename = {executor.submit(process_single_file_ultrafast, filename): filename 
-                             for filename in filenames}
-        
-        # Collect results as they complete
-        for future in as_completed(future_to_filename):
-            result = future.result()
-            if result is not None:
-                results.append(result)
-    
-    batch_duration = time.time() - batch_start
-    
-    success_count = len([r for r in results if r['status'] == 'success'])
-    error_count = len([r for r in results if r['status'] == 'error'])
-    skipped_count = len([r for r in results if r['status'] == 'skipped'])
+    success_count = len([r for r in results if r.status == 'success'])
+    error_count = len([r for r in results if r.status == 'error'])
+    skipped_count = len([r for r in results if r.status == 'skipped'])
     total_files = len(results)
     
     if total_files > 0:
-        processed_results = [r for r in results if r['status'] in ['success', 'error']]
+        processed_results = [r for r in results if r.status in ['success', 'error']]
         if processed_results:
-            avg_duration = sum(r['duration_ms'] for r in processed_results) / len(processed_results)
+            avg_duration = sum(r.duration_ms for r in processed_results) / len(processed_results)
             files_per_second = len(processed_results) / batch_duration if batch_duration > 0 else 0
         else:
             avg_duration = 0
@@ -370,18 +739,141 @@ def process_batch_ultrafast(filenames):
             print(f"[BATCH STATS] Avg: {avg_duration:.1f}ms per file, Rate: {files_per_second:.1f} files/sec")
         
         # Only show first 3 errors to avoid spam
-        error_results = [r for r in results if r['status'] == 'error']
+        error_results = [r for r in results if r.status == 'error']
         if error_results:
             print(f"[ERRORS] First few errors:")
             for result in error_results[:3]:
-                print(f"  - {result['filename']}: {result['error']}")
+                print(f"  - {result.filename}: {result.detail}")
             if len(error_results) > 3:
                 print(f"  ... and {len(error_results) - 3} more errors")
-    
-    return results
 
-def main():
+def verify_backends(corpus_dir, backend_names, limit=None, extract_mode="full", embedded=False, field_stats=False):
+    """Parse a saved corpus with every backend and report fields that differ from bs4
+
+    The reference is always bs4 on the full page; with extract_mode="regions"
+    or embedded=True every backend (bs4 included) is checked in that mode.
+    """
+    files = sorted(f for f in os.listdir(corpus_dir) if f.endswith(".html"))
+    if limit:
+        files = files[:limit]
+    backends = {}
+    for name in [DEFAULT_BACKEND] + [n for n in backend_names if n != DEFAULT_BACKEND]:
+        try:
+            backends[name] = get_backend(name)
+        except ImportError as e:
+            print(f"[VERIFY] Skipping {name}: {e}")
+    # (label, backend name, extract mode, embedded); the first entry is the reference
+    suffix = (f"/{extract_mode}" if extract_mode != "full" else "") + ("/embedded" if embedded else "")
+    variants = [(DEFAULT_BACKEND, DEFAULT_BACKEND, "full", False)]
+    variants += [(name + suffix, name, extract_mode, embedded)
+                 for name in backends if suffix or name != DEFAULT_BACKEND]
+    names = [label for label, _, _, _ in variants]
+    timings = {name: 0.0 for name in names}
+    variant_stats = {name: {} for name in names}
+    take_field_stats()
+    mismatches = {name: Counter() for name in names[1:]}
+    examples = {}
+    fallbacks = 0
+
+    print(f"[VERIFY] Comparing {', '.join(names[1:])} against {DEFAULT_BACKEND} on {len(files)} files from {corpus_dir}")
+    for filename in files:
+        with open(os.path.join(corpus_dir, filename), "r", encoding="utf-8", errors='ignore') as f:
+            html = f.read()
+        oglas_id = os.path.splitext(filename)[0]
+        if extract_mode == "regions" and html_regions.slice_regions(html) is None:
+            fallbacks += 1
+        outputs = {}
+        for label, name, mode, inline in variants:
+            t0 = time.perf_counter()
+            try:
+                outputs[label] = extract_ad_fields(backends[name], html, oglas_id, mode, inline)
+            except Exception as e:
+                outputs[label] = {"__error__": str(e)[:200]}
+            timings[label] += time.perf_counter() - t0
+            merge_field_stats(variant_stats[label], take_field_stats())
+        expected = outputs[DEFAULT_BACKEND]
+        for name in names[1:]:
+            got = outputs[name]
+            for key in set(expected) | set(got):
+                if expected.get(key) != got.get(key):
+                    mismatches[name][key] += 1
+                    examples.setdefault((name, key), (filename, expected.get(key), got.get(key)))
+
+    for name in names:
+        avg_ms = timings[name] / len(files) * 1000 if files else 0
+        print(f"[VERIFY] {name}: {avg_ms:.2f}ms per file")
+    if field_stats:
+        for name in names:
+            print(f"\n[FIELD STATS] {name}")
+            print_field_stats(variant_stats[name])
+    if extract_mode == "regions":
+        print(f"[VERIFY] {fallbacks}/{len(files)} files fell back to a full parse")
+    total_mismatches = 0
+    for name in names[1:]:
+        if not mismatches[name]:
+            print(f"[VERIFY] {name}: identical output on all {len(files)} files")
+            continue
+        for key, count in mismatches[name].most_common():
+            total_mismatches += count
+            filename, expected_value, got_value = examples[(name, key)]
+            print(f"[VERIFY] {name}: '{key}' differs in {count} files, e.g. {filename}: "
+                  f"{str(expected_value)[:80]!r} != {str(got_value)[:80]!r}")
+    return EXIT_SUCCESS if total_mismatches == 0 else EXIT_PARSING_ERROR
+
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Parse ad HTML files to structured JSON")
+    parser.add_argument("--ndjson", metavar="TARGET",
+                        help="Stream parsed records as NDJSON to a file, or '-' for stdout (progress then goes to stderr)")
+    parser.add_argument("--ndjson-max-mb", type=int, default=0,
+                        help="Rotate the NDJSON file after this many MB (0 = never)")
+    parser.add_argument("--no-json-files", action="store_true",
+                        help="Skip the per-file JSON writes (requires --ndjson)")
+    parser.add_argument("--all", action="store_true",
+                        help="Parse every HTML file, ignoring what was parsed before")
+    parser.add_argument("--only-affected", action="store_true",
+                        help="After a field extractor version bump, only reparse pages that contain that field's markup")
+    parser.add_argument("--field-stats", action="store_true",
+                        help="Print per-field hit rate and extraction time at the end of the run")
+    parser.add_argument("--backend", choices=BACKEND_NAMES, default=DEFAULT_BACKEND,
+                        help="HTML extraction backend (default: bs4)")
+    parser.add_argument("--extract-mode", choices=EXTRACT_MODES, default="full",
+                        help="Parse the full page or only the regions the parser reads (default: full)")
+    parser.add_argument("--embedded-state", action="store_true",
+                        help="Take price, images and location from the page's inline JSON/JS state, DOM for the rest")
+    parser.add_argument("--verify-backends", nargs="?", const=INPUT_DIR, metavar="CORPUS_DIR",
+                        help="Check that every backend gives the same output as bs4 on a saved corpus, then exit")
+    parser.add_argument("--verify-limit", type=int, default=0,
+                        help="Only use the first N files of the corpus for --verify-backends")
+    parser.add_argument("--memory-ceiling-mb", type=int, default=0,
+                        help="Keep the parser and its workers under this many MB of RSS "
+                             f"(default: {MEMORY_CEILING_FRACTION:.0%} of RAM)")
+    args = parser.parse_args(argv)
+    if args.no_json_files and not args.ndjson:
+        parser.error("--no-json-files requires --ndjson")
+    return args
+
+def main(argv=None):
     """Ultra-fast main function"""
+    global _backend_name, _extract_mode, _embedded_state
+    args = parse_args(argv)
+    _backend_name = args.backend
+    _extract_mode = args.extract_mode
+    _embedded_state = args.embedded_state
+    
+    if args.verify_backends:
+        load_phone_cache(prepare_phone_index())
+        return verify_backends(args.verify_backends, BACKEND_NAMES, args.verify_limit, args.extract_mode,
+                              args.embedded_state, args.field_stats)
+    
+    # Records own stdout when streaming to it; everything else goes to stderr
+    ndjson_writer = None
+    if args.ndjson:
+        ndjson_writer = NdjsonWriter(args.ndjson, max_bytes=args.ndjson_max_mb * 1024 * 1024, stream=sys.stdout)
+        if args.ndjson == "-":
+            sys.stdout = sys.stderr
+    write_json = not args.no_json_files
+    
     # Setup comprehensive logging
     setup_comprehensive_logging()
     
@@ -395,64 +887,149 @@ def main():
     try:
         print(f"[INIT] System info: {cpu_count()} CPU cores, {psutil.virtual_memory().total // (1024**3)}GB RAM")
         
-        # Load phone cache into memory for ultra-fast lookups
-        load_phone_cache()
+        # Map the phone index for ultra-fast lookups (rebuilt when phones.db changed)
+        phone_index_path = prepare_phone_index()
+        load_phone_cache(phone_index_path)
         
         # Pre-filter files to avoid redundant checks
         print("[INIT] Scanning for unparsed files...")
         all_html_files = [f for f in os.listdir(INPUT_DIR) if f.endswith(".html")]
         unparsed_files = []
+        changed_files = set()
+        phone_updated_files = set()
+        stale_files = set()
+        version_only_ids = []
+        
+        # Content hashes recorded by the scraper (fetch) and by earlier parser runs
+        conn = page_hashes.connect()
+        try:
+            parse_state = page_hashes.load_parse_state(conn)
+        finally:
+            conn.close()
+        conn = phone_store.connect(DB_PATH)
+        try:
+            phone_fetch_times = phone_store.load_fetch_times(conn)
+        finally:
+            conn.close()
         
         # Batch check for existing JSON files
         for f in all_html_files:
             base_filename = os.path.splitext(f)[0]
-            json_file = os.path.join(OUTPUT_DIR, base_filename + ".json")
-            if not os.path.exists(json_file):
+            state = parse_state.get(base_filename, EMPTY_PARSE_STATE)
+            content_hash, parsed_hash, parsed_at = state.content_hash, state.parsed_hash, state.parsed_at
+            if args.all:
+                unparsed_files.append(f)
+                changed_files.add(f)
+                continue
+            if write_json:
+                json_file = os.path.join(OUTPUT_DIR, base_filename + ".json")
+                already_parsed = os.path.exists(json_file)
+            else:
+                # Without per-file JSONs, pages.db is the only record of what was parsed
+                already_parsed = parsed_hash is not None
+            if not already_parsed:
+                unparsed_files.append(f)
+                continue
+            # Reparse only when the page was re-downloaded with different content
+            if content_hash and content_hash != parsed_hash:
+                unparsed_files.append(f)
+                changed_files.add(f)
+                continue
+            # Pages parsed before their phone numbers were fetched (e.g. by the scraper's --parse-inline)
+            if parsed_at and base_filename.isdigit() and phone_fetch_times.get(int(base_filename), 0) >= parsed_at:
                 unparsed_files.append(f)
+                phone_updated_files.add(f)
+                continue
+            # Parsed by an older parser or field extractor version
+            fields = stale_fields(state)
+            if fields:
+                if args.only_affected and not page_affected(f, fields):
+                    version_only_ids.append(base_filename)
+                else:
+                    unparsed_files.append(f)
+                    stale_files.add(f)
+        
+        if version_only_ids:
+            conn = page_hashes.connect()
+            try:
+                page_hashes.record_versions(conn, version_only_ids, PARSER_VERSION, FIELD_VERSIONS)
+            finally:
+                conn.close()
+            print(f"[INIT] {len(version_only_ids)} pages not affected by the changed extractors, moved to the current versions")
         
         total_files = len(unparsed_files)
         skipped_count = len(all_html_files) - total_files
 
         if total_files == 0:
-            print(f"[COMPLETE] All {len(all_html_files)} HTML files already parsed!")
+            print(f"[COMPLETE] All {len(all_html_files)} HTML files already parsed and unchanged!")
             return EXIT_SUCCESS
 
-        print(f"[INIT] Found {total_files} unparsed files ({skipped_count} already parsed)")
-        print(f"[INIT] Using {MAX_WORKERS} workers, batch size: {BATCH_SIZE}")
+        print(f"[INIT] Found {total_files} files to parse ({len(changed_files)} changed since last parse, "
+              f"{len(phone_updated_files)} with new phone data, {len(stale_files)} from an older parser version, "
+              f"{skipped_count} unchanged)")
+        ceiling_mb = args.memory_ceiling_mb or int(psutil.virtual_memory().total * MEMORY_CEILING_FRACTION / 1024**2)
+        print(f"[INIT] Using up to {MAX_WORKERS} workers, memory ceiling {ceiling_mb}MB, batch size: {BATCH_SIZE}")
 
-        # Process in large batches for maximum efficiency
-        all_results = []
+        # One pool for the whole run, fed continuously; BATCH_SIZE only sets the reporting interval.
+        # Only counters survive a batch, so memory stays flat however many files are parsed.
+        status_counts = Counter()
+        field_stats = {}
         processed_count = 0
+        completed_count = 0
+        total_batches = (total_files + BATCH_SIZE - 1) // BATCH_SIZE
 
-        for i in range(0, total_files, BATCH_SIZE):
-            batch_files = unparsed_files[i:i + BATCH_SIZE]
-            batch_num = (i // BATCH_SIZE) + 1
-            total_batches = (total_files + BATCH_SIZE - 1) // BATCH_SIZE
-
-            print(f"\n[BATCH {batch_num}/{total_batches}] Processing files {i+1}-{min(i+BATCH_SIZE, total_files)} of {total_files}")
+        print(f"[INIT] HTML backend: {args.backend}")
+        def make_executor(workers):
+            return ProcessPoolExecutor(max_workers=workers, initializer=init_parse_worker,
+                                       initargs=(args.backend, phone_index_path, args.extract_mode, args.embedded_state,
+                                                 args.ndjson == "-"))
+        governor = MemoryGovernor(make_executor, MAX_WORKERS, ceiling_mb * 1024**2)
+        try:
+            batch_results = []
+            batch_start = time.time()
+            results = iter_parse_results(governor, unparsed_files, changed_files | phone_updated_files | stale_files, write_json,
+                                         return_record=ndjson_writer is not None, field_stats=field_stats)
+            for result in results:
+                # Stream records in completion order, never keep them around
+                if result.record is not None:
+                    ndjson_writer.write(result.record)
+                    result = result._replace(record=None)
+                batch_results.append(result)
+                status_counts[result.status] += 1
+                completed_count += 1
+                if len(batch_results) < BATCH_SIZE and completed_count < total_files:
+                    continue
 
-            batch_results = process_batch_ultrafast(batch_files)
-            all_results.extend(batch_results)
-            processed_count += len([r for r in batch_results if r['status'] != 'skipped'])
+                batch_num = (completed_count + BATCH_SIZE - 1) // BATCH_SIZE
+                print(f"\n[BATCH {batch_num}/{total_batches}] {completed_count} of {total_files} files done")
+                if ndjson_writer is not None:
+                    ndjson_writer.flush()
+                finish_batch(batch_results, time.time() - batch_start)
+                processed_count += len([r for r in batch_results if r.status != 'skipped'])
+                batch_results = []
+                batch_start = time.time()
 
-            # Quick progress update
-            if total_files > 0:
-                progress = ((i + len(batch_files)) / total_files) * 100
+                # Quick progress update
+                progress = (completed_count / total_files) * 100
                 elapsed = time.time() - start_time
                 rate = processed_count / elapsed if elapsed > 0 else 0
-                eta = (total_files - processed_count) / rate if rate > 0 else 0
-                print(f"[PROGRESS] {progress:.1f}% complete, Rate: {rate:.1f} files/sec, ETA: {eta:.1f}s")
+                eta = (total_files - completed_count) / rate if rate > 0 else 0
+                print(f"[PROGRESS] {progress:.1f}% complete, Rate: {rate:.1f} files/sec, ETA: {eta:.1f}s, "
+                      f"Workers: {governor.workers}, Memory: {governor.used / 1024**2:.0f}MB")
+            if batch_results:
+                finish_batch(batch_results, time.time() - batch_start)
+        finally:
+            governor.close()
         
         # Lightning-fast final statistics
         total_elapsed = time.time() - start_time
-        success_count = len([r for r in all_results if r['status'] == 'success'])
-        error_count = len([r for r in all_results if r['status'] == 'error'])
-        final_skipped = len([r for r in all_results if r['status'] == 'skipped'])
+        success_count = status_counts['success']
+        error_count = status_counts['error']
         actual_processed = success_count + error_count
         
         print(f"\n[ULTRAFAST RESULTS]")
         print(f"Total files: {len(all_html_files)}")
-        print(f"Already parsed: {skipped_count}")
+        print(f"Already parsed (unchanged): {skipped_count}")
         print(f"Newly processed: {actual_processed}")
         print(f"  - Successful: {success_count}")
         print(f"  - Errors: {error_count}")
@@ -461,6 +1038,12 @@ def main():
             print(f"Processing rate: {actual_processed / total_elapsed:.1f} files/sec")
             print(f"Avg per file: {(total_elapsed / actual_processed) * 1000:.1f}ms")
         
+        print(f"Peak memory: {governor.peak / 1024**2:.0f}MB (ceiling {ceiling_mb}MB), "
+              f"workers at end: {governor.workers}, pool resizes: {governor.resizes}")
+        
+        if args.field_stats:
+            print_field_stats(field_stats)
+        
         if error_count > 0:
             exit_code = EXIT_PARSING_ERROR
             print(f"\n[ERRORS] {error_count} files failed to process")
@@ -472,13 +1055,18 @@ def main():
                 f.write(f"Ultrafast Processing - {datetime.now().isoformat()}\n")
                 f.write(f"Rate: {actual_processed / total_elapsed:.1f} files/sec\n")
                 f.write(f"Success: {success_count}, Errors: {error_count}\n")
-                f.write(f"Workers: {MAX_WORKERS}, Batch: {BATCH_SIZE}\n")
+                f.write(f"Workers: {governor.workers}/{MAX_WORKERS}, Batch: {BATCH_SIZE}\n")
+                f.write(f"Peak memory: {governor.peak / 1024**2:.0f}MB, Ceiling: {ceiling_mb}MB, Resizes: {governor.resizes}\n")
             print(f"[LOG] Summary: {summary_log_path}")
         
     except Exception as e:
         exit_code = EXIT_FS_ERROR
         print(f"FATAL ERROR: {str(e)}")
         traceback.print_exc()
+    finally:
+        if ndjson_writer is not None:
+            ndjson_writer.close()
+            print(f"[NDJSON] Streamed {ndjson_writer.records_written} records to {'stdout' if args.ndjson == '-' else args.ndjson}")
     
     # Log process end
     log_process_end("html_parsing", process_start_time)
@@ -0,0 +1,216 @@
+"""
+Leaf Work Partitioner
+=====================
+
+Step 2 crawls the leaves of the day's leaf URL files one after another, whether
+a leaf holds 5 ads or 5000. Step 1 keeps the number of ads each leaf page
+reports ("count" on the leaves of tree_jsons/{category}_tree_{date}.json; the
+leaf URL files carry no counts); this splits the leaves into N shards of about
+the same estimated work for this run:
+
+- a leaf due for a full sweep (page_hashes.full_sweep_due) with more than
+  MAX_UNIT_PAGES listing pages becomes several work units by page range; the
+  last range runs to the end, so ads added since Step 1 are not lost
+- a leaf that is not due is crawled newest first from page 1 and stops at
+  known ads, so it is one unit estimated at one listing page
+- leaves are handed out largest first, each to the least loaded shard; the
+  page ranges of a leaf stay on one shard
+- leaves without a count are estimated at the median count of the others
+
+Every machine computes the same partition from the same leaf and tree files
+and the same sweep history (leaf_crawls in backend/pageDB/pages.db), so shard
+K of N is crawled with
+
+    python scrape_leaf_entries.py --shard K/N
+
+Usage:
+    python partition_leaves.py --shards N [--date YYYY-MM-DD] [--max-unit-pages P] [--output FILE]
+                               [--full-sweep | --full-sweep-days D]
+"""
+
+import os
+import sys
+import json
+import heapq
+import argparse
+from datetime import datetime
+
+import page_hashes
+
+CATEGORIES_DIR = os.path.join(os.path.dirname(__file__), "backend", "categories")
+LEAF_URLS_DIR = os.path.join(CATEGORIES_DIR, "leaf_urls")
+CATEGORIES_TREE_DIR = os.path.join(CATEGORIES_DIR, "tree_jsons")
+SHARDS_DIR = os.path.join(CATEGORIES_DIR, "shards")
+
+ADS_PER_PAGE = 25  # Ads on a full listing page
+MAX_UNIT_PAGES = 40  # Leaves with more listing pages are split into ranges of this many pages
+
+
+def load_leaves(date_str):
+    """[(category, leaf URL)] of the day's leaf URL files, in file order, duplicates dropped"""
+    suffix = f"_leaf_urls_{date_str}.txt"
+    leaves, seen = [], set()
+    for fname in sorted(os.listdir(LEAF_URLS_DIR)):
+        if not fname.endswith(suffix):
+            continue
+        with open(os.path.join(LEAF_URLS_DIR, fname), "r", encoding="utf-8") as f:
+            for line in f:
+                url = line.strip()
+                if url and url not in seen:
+                    seen.add(url)
+                    leaves.append((fname[:-len(suffix)], url))
+    return leaves
+
+
+def load_counts(date_str):
+    """{leaf URL: ads reported on its page} from the day's category trees"""
+    counts = {}
+
+    def visit(node):
+        children = node.get("children") or []
+        if not children and node.get("count") is not None:
+            counts[node["url"]] = node["count"]
+        for child in children:
+            visit(child)
+
+    suffix = f"_tree_{date_str}.json"
+    for fname in sorted(os.listdir(CATEGORIES_TREE_DIR)):
+        if fname.startswith("category_tree_") or not fname.endswith(suffix):
+            continue
+        try:
+            with open(os.path.join(CATEGORIES_TREE_DIR, fname), "r", encoding="utf-8") as f:
+                tree = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Skipping {fname}: {e}")
+            continue
+        for root in tree:
+            visit(root)
+    return counts
+
+
+def load_sweeps_due(urls, days=page_hashes.FULL_SWEEP_DAYS):
+    """{leaf URL: True if this run gives it a full sweep} from the sweep history in pages.db"""
+    conn = page_hashes.connect()
+    try:
+        return {url: page_hashes.full_sweep_due(conn, url, days) for url in urls}
+    finally:
+        conn.close()
+
+
+def work_units(leaves, counts, max_unit_pages=MAX_UNIT_PAGES, sweeps=None):
+    """Split leaves into {"category", "url", "first_page", "last_page", "estimate", "full_sweep"} units
+
+    ``last_page`` None means "to the last page"; ``estimate`` is the expected
+    number of ads this run reads. ``sweeps`` ({url: full sweep due}, see
+    load_sweeps_due) marks the leaves that only get their page 1 unit;
+    without it every leaf is planned as a full sweep.
+    """
+    known = sorted(counts[url] for _, url in leaves if url in counts)
+    default = known[len(known) // 2] if known else ADS_PER_PAGE
+    units = []
+    for category, url in leaves:
+        count = counts.get(url, default)
+        full_sweep = sweeps is None or sweeps.get(url, True)
+        if not full_sweep:
+            units.append({"category": category, "url": url, "first_page": 1, "last_page": None,
+                          "estimate": max(min(count, ADS_PER_PAGE), 1), "full_sweep": False})
+            continue
+        pages = max(1, -(-count // ADS_PER_PAGE))
+        for first_page in range(1, pages + 1, max_unit_pages):
+            last_page = first_page + max_unit_pages - 1
+            if last_page >= pages:
+                last_page = None
+            estimate = (min(count, last_page * ADS_PER_PAGE) if last_page else count) - (first_page - 1) * ADS_PER_PAGE
+            units.append({"category": category, "url": url, "first_page": first_page,
+                          "last_page": last_page, "estimate": max(estimate, 1), "full_sweep": True})
+    return units
+
+
+def partition(units, shards):
+    """Assign leaves largest first to the least loaded of ``shards`` shards; returns (shards, loads)
+
+    All page ranges of a leaf go to the same shard, so the machine crawling it
+    can tell when the whole leaf is done.
+    """
+    leaves = {}
+    for unit in units:
+        leaves.setdefault(unit["url"], []).append(unit)
+    heap = [(0, index) for index in range(shards)]
+    assigned = [[] for _ in range(shards)]
+    loads = [0] * shards
+    for url, leaf_units in sorted(leaves.items(), key=lambda item: (-sum(u["estimate"] for u in item[1]), item[0])):
+        load, index = heapq.heappop(heap)
+        assigned[index].extend(leaf_units)
+        loads[index] = load + sum(u["estimate"] for u in leaf_units)
+        heapq.heappush(heap, (loads[index], index))
+    # Crawl a shard's units in leaf order
+    order = {(u["url"], u["first_page"]): i for i, u in enumerate(units)}
+    for shard in assigned:
+        shard.sort(key=lambda u: order[(u["url"], u["first_page"])])
+    return assigned, loads
+
+
+def build_shards(shards, date_str=None, max_unit_pages=MAX_UNIT_PAGES, full_sweep_days=page_hashes.FULL_SWEEP_DAYS,
+                 force_full_sweep=False):
+    """(shards, loads) for the day's leaves; the same files and sweep history always give the same partition"""
+    date_str = date_str or datetime.now().strftime("%Y-%m-%d")
+    leaves = load_leaves(date_str)
+    sweeps = None if force_full_sweep else load_sweeps_due([url for _, url in leaves], full_sweep_days)
+    return partition(work_units(leaves, load_counts(date_str), max_unit_pages, sweeps), shards)
+
+
+def parse_shard(value):
+    """ "K/N" -> (K, N), 1 <= K <= N"""
+    try:
+        k, n = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected K/N, got '{value}'")
+    if not 1 <= k <= n:
+        raise argparse.ArgumentTypeError(f"shard {k} is not between 1 and {n}")
+    return k, n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split the day's leaves into shards of about equal work")
+    parser.add_argument("--shards", type=int, required=True, help="Number of shards")
+    parser.add_argument("--date", default=datetime.now().strftime("%Y-%m-%d"), help="Leaf/tree date (default: today)")
+    parser.add_argument("--max-unit-pages", type=int, default=MAX_UNIT_PAGES,
+                        help="Split leaves with more listing pages than this into page ranges")
+    parser.add_argument("--output", help="Shard file (default: backend/categories/shards/shards_{date}_{N}.json)")
+    parser.add_argument("--full-sweep", action="store_true", help="Plan a full sweep of every leaf (as Step 2 --full-sweep)")
+    parser.add_argument("--full-sweep-days", type=int, default=page_hashes.FULL_SWEEP_DAYS,
+                        help="Days between full sweeps of a leaf (as Step 2 --full-sweep-days)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(LEAF_URLS_DIR):
+        print(f"[ERROR] {LEAF_URLS_DIR} does not exist, run Step 1 first")
+        return 1
+    leaves = load_leaves(args.date)
+    if not leaves:
+        print(f"[ERROR] No leaf URL files for {args.date} in {LEAF_URLS_DIR}")
+        return 1
+    counts = load_counts(args.date) if os.path.isdir(CATEGORIES_TREE_DIR) else {}
+    sweeps = None if args.full_sweep else load_sweeps_due([url for _, url in leaves], args.full_sweep_days)
+    units = work_units(leaves, counts, args.max_unit_pages, sweeps)
+    shards, loads = partition(units, args.shards)
+
+    counted = sum(1 for _, url in leaves if url in counts)
+    sweeping = len(leaves) if sweeps is None else sum(sweeps.values())
+    print(f"[PARTITION] {len(leaves)} leaves ({counted} with a count, {sweeping} due for a full sweep), {len(units)} work units, "
+          f"~{sum(loads)} ads in {args.shards} shards")
+    mean = sum(loads) / args.shards
+    for index, (shard, load) in enumerate(zip(shards, loads), 1):
+        split = sum(1 for u in shard if u["first_page"] > 1 or u["last_page"])
+        print(f"[PARTITION] shard {index}/{args.shards}: {len(shard):>5} units ({split} page ranges), "
+              f"~{load} ads ({load / mean if mean else 0:.2f}x mean)")
+
+    output = args.output or os.path.join(SHARDS_DIR, f"shards_{args.date}_{args.shards}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"date": args.date, "shards": shards, "loads": loads}, f, ensure_ascii=False, indent=2)
+    print(f"[PARTITION] Wrote {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
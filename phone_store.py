@@ -0,0 +1,352 @@
+"""
+Phone Number Store (backend/phoneDB/phones.db)
+==============================================
+
+Typed schema shared by the scraper (Step 2), the phone fetcher (Step 3) and
+the parser (Step 4):
+
+    ads(ad_id INTEGER PRIMARY KEY, phone_count, fetched_at)  WITHOUT ROWID
+    ad_phones(ad_id, position, number, number_e164)          WITHOUT ROWID
+    idx_ad_phones_e164 ON ad_phones(number_e164)
+
+Every fetched ad has a row in ``ads``. phone_count is NULL when the API
+returned no numbers (NULL in the old schema too; RESCRAPE_NULL_PHONES in the
+phone fetcher re-fetches these) and 0 for ads the old schema stored as an
+empty list, which are not fetched again. Databases with the old
+``phones(ad_id TEXT, phones TEXT)`` table are migrated by the phone fetcher
+on startup or with --migrate; connect() never migrates, so read paths stay
+cheap.
+
+Usage:
+    python phone_store.py --migrate
+    python phone_store.py --ad 37026812
+    python phone_store.py --number "091 123 4567"
+    python phone_store.py --stats
+    python phone_store.py --build-index
+
+Workers that only need the first number of each ad read it from
+phone_index.bin, a sorted read-only index that every process memory-maps
+(see PhoneIndex).
+"""
+
+import os
+import re
+import sys
+import json
+import mmap
+import time
+import array
+import bisect
+import struct
+import sqlite3
+import argparse
+
+PHONE_DB_DIR = os.path.join(os.path.dirname(__file__), "backend", "phoneDB")
+PHONE_DB_PATH = os.path.join(PHONE_DB_DIR, "phones.db")
+
+DEFAULT_COUNTRY_CODE = "385"  # Croatia
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ads (
+    ad_id INTEGER PRIMARY KEY,
+    phone_count INTEGER,
+    fetched_at INTEGER
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ad_phones (
+    ad_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    number TEXT NOT NULL,
+    number_e164 TEXT,
+    PRIMARY KEY (ad_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_ad_phones_e164 ON ad_phones(number_e164);
+"""
+
+NON_DIGIT_PATTERN = re.compile(r'\D')
+
+
+def normalize_e164(number, country_code=DEFAULT_COUNTRY_CODE):
+    """Normalize a displayed phone number ("091 123 4567", "+385 1 2345 678") to E.164."""
+    if not number:
+        return None
+    number = number.strip()
+    digits = NON_DIGIT_PATTERN.sub('', number)
+    if number.startswith("+"):
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]
+    elif digits.startswith("0"):
+        digits = country_code + digits[1:]
+    elif not digits.startswith(country_code):
+        digits = country_code + digits
+    if len(digits) < 7 or len(digits) > 15:
+        return None
+    return "+" + digits
+
+
+def _table_names(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+
+def _has_legacy_table(conn):
+    return "phones" in _table_names(conn)
+
+
+def migrate_legacy(conn):
+    """Move rows from the old phones(ad_id TEXT, phones JSON) table into the typed schema."""
+    if not _has_legacy_table(conn):
+        return 0
+    conn.executescript(SCHEMA)
+    ads_rows = []
+    phone_rows = []
+    skipped = 0
+    for ad_id, phones_json in conn.execute("SELECT ad_id, phones FROM phones"):
+        try:
+            ad_id = int(ad_id)
+        except (TypeError, ValueError):
+            skipped += 1
+            continue
+        try:
+            numbers = json.loads(phones_json) if phones_json else None
+        except ValueError:
+            numbers = []
+        if numbers is None:
+            # NULL and "null": the API returned no numbers
+            ads_rows.append((ad_id, None, None))
+            continue
+        numbers = [n.strip() for n in numbers if isinstance(n, str) and n.strip()] if isinstance(numbers, list) else []
+        ads_rows.append((ad_id, len(numbers), None))
+        phone_rows.extend((ad_id, pos, n, normalize_e164(n)) for pos, n in enumerate(numbers))
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO ads (ad_id, phone_count, fetched_at) VALUES (?, ?, ?)", ads_rows)
+        conn.executemany("INSERT OR REPLACE INTO ad_phones (ad_id, position, number, number_e164) VALUES (?, ?, ?, ?)", phone_rows)
+        conn.execute("DROP TABLE phones")
+    conn.execute("VACUUM")
+    print(f"[PHONE DB] Migrated {len(ads_rows)} ads ({len(phone_rows)} numbers) to typed schema, skipped {skipped} invalid ad ids")
+    return len(ads_rows)
+
+
+_legacy_warned = set()
+
+
+def connect(db_path=PHONE_DB_PATH):
+    """Open phones.db, creating the typed schema if it is missing. Does not migrate (see migrate)."""
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    tables = _table_names(conn)
+    if not {"ads", "ad_phones"} <= tables:
+        conn.executescript(SCHEMA)
+    if "phones" in tables and db_path not in _legacy_warned:
+        _legacy_warned.add(db_path)
+        print(f"[PHONE DB] {db_path} still has the old phones table; run 'python phone_store.py --migrate' "
+              f"(the phone fetcher does it on startup)")
+    return conn
+
+
+def migrate(db_path=PHONE_DB_PATH):
+    """Migrate an old database in place; returns the number of ads moved (0 if there was nothing to do)."""
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    try:
+        migrated = migrate_legacy(conn)
+        conn.executescript(SCHEMA)
+        return migrated
+    finally:
+        conn.close()
+
+
+def save_phones(conn, ad_id, numbers):
+    """Replace the stored numbers of one ad. ``numbers`` is None when the API returned none."""
+    ad_id = int(ad_id)
+    phone_count = None
+    if numbers is not None:
+        numbers = [n.strip() for n in numbers if n and n.strip()]
+        phone_count = len(numbers)
+    with conn:
+        conn.execute("DELETE FROM ad_phones WHERE ad_id=?", (ad_id,))
+        conn.execute("INSERT OR REPLACE INTO ads (ad_id, phone_count, fetched_at) VALUES (?, ?, ?)",
+                     (ad_id, phone_count, int(time.time())))
+        conn.executemany("INSERT INTO ad_phones (ad_id, position, number, number_e164) VALUES (?, ?, ?, ?)",
+                         [(ad_id, pos, n, normalize_e164(n)) for pos, n in enumerate(numbers or [])])
+
+
+def has_ad(conn, ad_id):
+    """True if the phone API was already queried for this ad (with or without result)."""
+    ad_id = int(ad_id)
+    if conn.execute("SELECT 1 FROM ads WHERE ad_id=? LIMIT 1", (ad_id,)).fetchone() is not None:
+        return True
+    # Until the database is migrated the old table still lists the fetched ads
+    return (_has_legacy_table(conn)
+            and conn.execute("SELECT 1 FROM phones WHERE ad_id=? LIMIT 1", (str(ad_id),)).fetchone() is not None)
+
+
+def load_phone_counts(conn):
+    """Return {ad_id: phone_count} for every fetched ad (None: the API returned no numbers)."""
+    return dict(conn.execute("SELECT ad_id, phone_count FROM ads"))
+
+
+def load_fetch_times(conn):
+    """Return {ad_id: fetched_at} for every fetched ad with a known fetch time."""
+    return dict(conn.execute("SELECT ad_id, fetched_at FROM ads WHERE fetched_at IS NOT NULL"))
+
+
+def load_first_phones(conn):
+    """Return {ad_id: first phone number} for every ad that has at least one number."""
+    return dict(conn.execute("SELECT ad_id, number FROM ad_phones WHERE position=0"))
+
+
+def get_phones(conn, ad_id):
+    """All numbers of one ad in API order."""
+    cursor = conn.execute("SELECT number FROM ad_phones WHERE ad_id=? ORDER BY position", (int(ad_id),))
+    return [row[0] for row in cursor]
+
+
+def find_ads_by_number(conn, number):
+    """Reverse lookup: ad ids that list the given number (any formatting)."""
+    e164 = normalize_e164(number)
+    if not e164:
+        return []
+    cursor = conn.execute("SELECT DISTINCT ad_id FROM ad_phones WHERE number_e164=? ORDER BY ad_id", (e164,))
+    return [row[0] for row in cursor]
+
+
+# --- Read-only memory-mapped index of first phone numbers ---
+#
+# Layout (little endian):
+#   header   magic b"NJPHIDX1", count (uint64)
+#   ids      count x int64, sorted ascending
+#   offsets  (count + 1) x uint64 into the blob
+#   blob     UTF-8 numbers, concatenated
+
+PHONE_INDEX_PATH = os.path.join(PHONE_DB_DIR, "phone_index.bin")
+_INDEX_MAGIC = b"NJPHIDX1"
+_INDEX_HEADER = struct.Struct("<8sQ")
+
+
+def build_phone_index(conn, index_path=PHONE_INDEX_PATH):
+    """Write the first phone number of every ad to a compact sorted index file."""
+    rows = conn.execute("SELECT ad_id, number FROM ad_phones WHERE position=0 ORDER BY ad_id").fetchall()
+    ids = array.array("q", (row[0] for row in rows))
+    offsets = array.array("Q", [0])
+    blob = bytearray()
+    for _, number in rows:
+        blob += number.encode("utf-8")
+        offsets.append(len(blob))
+    if sys.byteorder != "little":
+        ids.byteswap()
+        offsets.byteswap()
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, len(rows)))
+        f.write(ids.tobytes())
+        f.write(offsets.tobytes())
+        f.write(blob)
+    os.replace(tmp_path, index_path)
+    return len(rows)
+
+
+def ensure_phone_index(db_path=PHONE_DB_PATH, index_path=PHONE_INDEX_PATH):
+    """Rebuild the index if it is missing or older than phones.db. Returns the index path."""
+    if os.path.exists(index_path) and os.path.exists(db_path) and os.path.getmtime(index_path) >= os.path.getmtime(db_path):
+        return index_path
+    conn = connect(db_path)
+    try:
+        build_phone_index(conn, index_path)
+    finally:
+        conn.close()
+    return index_path
+
+
+class PhoneIndex:
+    """Memory-mapped view of a phone index file.
+
+    Every process that opens the same file shares its pages through the OS page
+    cache. Lookups are a binary search over the id array and do not allocate
+    beyond the returned string.
+    """
+
+    def __init__(self, index_path=PHONE_INDEX_PATH):
+        self.index_path = index_path
+        self._file = open(index_path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < _INDEX_HEADER.size:
+            raise ValueError(f"{index_path} is not a phone index")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = _INDEX_HEADER.unpack_from(self._mmap, 0)
+        if magic != _INDEX_MAGIC or sys.byteorder != "little":
+            self._mmap.close()
+            self._file.close()
+            raise ValueError(f"{index_path} is not a phone index")
+        view = memoryview(self._mmap)
+        ids_start = _INDEX_HEADER.size
+        offsets_start = ids_start + 8 * count
+        blob_start = offsets_start + 8 * (count + 1)
+        self._count = count
+        self._ids = view[ids_start:offsets_start].cast("q")
+        self._offsets = view[offsets_start:blob_start].cast("Q")
+        self._blob = view[blob_start:]
+        self._view = view
+
+    def __len__(self):
+        return self._count
+
+    def get(self, ad_id):
+        """First phone number of ``ad_id`` or None."""
+        try:
+            ad_id = int(ad_id)
+        except (TypeError, ValueError):
+            return None
+        i = bisect.bisect_left(self._ids, ad_id)
+        if i == self._count or self._ids[i] != ad_id:
+            return None
+        return str(self._blob[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+
+    def close(self):
+        for view in (self._ids, self._offsets, self._blob, self._view):
+            view.release()
+        self._mmap.close()
+        self._file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or migrate the phone number database")
+    parser.add_argument("--db", default=PHONE_DB_PATH, help="Path to phones.db")
+    parser.add_argument("--migrate", action="store_true", help="Migrate an old phones(ad_id, phones) table")
+    parser.add_argument("--ad", help="Show the phone numbers of one ad")
+    parser.add_argument("--number", help="Show all ads listing this phone number")
+    parser.add_argument("--stats", action="store_true", help="Show table sizes")
+    parser.add_argument("--build-index", action="store_true", help="Rebuild phone_index.bin for the parser")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"[PHONE DB] {args.db} does not exist")
+        return 1
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.migrate:
+            if not migrate_legacy(conn):
+                print("[PHONE DB] Nothing to migrate")
+        conn.executescript(SCHEMA)
+        if args.ad:
+            print(json.dumps(get_phones(conn, args.ad), ensure_ascii=False))
+        if args.number:
+            ads = find_ads_by_number(conn, args.number)
+            print(f"{normalize_e164(args.number)}: {len(ads)} ads")
+            for ad_id in ads:
+                print(ad_id)
+        if args.stats:
+            ads_total, with_phones = conn.execute("SELECT COUNT(*), SUM(phone_count > 0) FROM ads").fetchone()
+            numbers_total = conn.execute("SELECT COUNT(*), COUNT(DISTINCT number_e164) FROM ad_phones").fetchone()
+            print(f"Ads: {ads_total} ({with_phones or 0} with phones)")
+            print(f"Numbers: {numbers_total[0]} ({numbers_total[1]} distinct)")
+        if args.build_index:
+            index_path = os.path.join(os.path.dirname(os.path.abspath(args.db)), os.path.basename(PHONE_INDEX_PATH))
+            count = build_phone_index(conn, index_path)
+            print(f"[PHONE DB] Wrote {count} entries to {index_path}")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
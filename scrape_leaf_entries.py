@@ -1,19 +1,19 @@
 def phone_already_in_db(ad_id, conn):
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM phones WHERE ad_id=? LIMIT 1", (ad_id,))
-    return cursor.fetchone() is not None
+    return phone_store.has_ad(conn, ad_id)
 
 import os
 import json
 import asyncio
 import random
+import re
 import threading
 import logging
 import sys
 import time
+import multiprocessing
 from datetime import datetime
-import sqlite3
-import json
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 today_str = datetime.now().strftime("%Y-%m-%d")
 
@@ -95,14 +95,26 @@ def log_exception(operation, exception):
     import traceback
     error_logger.error(f"EXCEPTION: {operation} - {str(exception)} | Traceback: {traceback.format_exc()}")
 
-from bs4 import BeautifulSoup
-from curl_cffi.requests import AsyncSession
-
-# Import Playwright token/cookie fetcher
-import importlib.util
-spec = importlib.util.spec_from_file_location("bearer_token_finder", os.path.join(os.path.dirname(__file__), "bearer_token_finder.py"))
-bearer_token_finder = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(bearer_token_finder)
+import page_hashes
+import phone_store
+from event_log import get_event_log
+from html_backends import BACKEND_NAMES, DEFAULT_BACKEND
+import listing_extractors
+import partition_leaves
+import page_cache
+from loop_monitor import LoopLagMonitor, LAG_THRESHOLD_MS
+
+# Playwright token/cookie fetcher, loaded on the first refresh (parser workers re-import this module)
+bearer_token_finder = None
+
+def load_bearer_token_finder():
+    global bearer_token_finder
+    if bearer_token_finder is None:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location("bearer_token_finder", os.path.join(os.path.dirname(__file__), "bearer_token_finder.py"))
+        bearer_token_finder = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(bearer_token_finder)
+    return bearer_token_finder
 
 # --- Load proxies from file ---
 def load_proxies_from_file():
@@ -130,7 +142,7 @@ def load_proxies_from_file():
         return []
 
 # --- Cycling system variables ---
-LOADED_PROXIES = load_proxies_from_file()
+LOADED_PROXIES = []  # Loaded by main()
 current_proxy_index = 0
 proxy_rotation_lock = threading.Lock()
 
@@ -192,7 +204,7 @@ def extract_ad_id(url):
 # Function to refresh headers and cookies using Playwright
 async def refresh_headers_and_cookies():
     print("[INFO] Refreshing headers and cookies using Playwright...")
-    token, cookies = await bearer_token_finder.get_bearer_token_and_cookies(headless=True)
+    token, cookies = await load_bearer_token_finder().get_bearer_token_and_cookies(headless=True)
     if token:
         HEADERS['authorization'] = f"Bearer {token}"
     if cookies:
@@ -201,7 +213,6 @@ async def refresh_headers_and_cookies():
     print("[INFO] Headers and cookies refreshed.")
 
 CHECKPOINTS_DIR = os.path.join(os.path.dirname(__file__), "checkpoints")
-os.makedirs(CHECKPOINTS_DIR, exist_ok=True)
 
 # --- Configuration (copied from realstate.py) ---
 HEADERS = {
@@ -232,65 +243,124 @@ COOKIES = {
     '_clsk': '169b6bk%7C1753173777438%7C11%7C1%7Ce.clarity.ms%2Fcollect'
 }
 
-ENTRY_LIST_UL_CLASS = "EntityList-items"
-ENTRY_ITEM_LI_CLASS = "EntityList-item"
-ENTRY_LINK_A_CLASS = "link"
-
 BACKEND_WEBSITE_DIR = os.path.join(os.path.dirname(__file__), "backend", "website")
 BACKEND_LOGS_DIR = os.path.join(os.path.dirname(__file__), "backend", "logs")
 LEAF_URLS_DIR = os.path.join(os.path.dirname(__file__), "backend", "categories", "leaf_urls")
 CATEGORIES_LOGS_DIR = os.path.join(os.path.dirname(__file__), "backend", "categories", "logs")
 CATEGORIES_HTMLS_DIR = os.path.join(os.path.dirname(__file__), "backend", "categories", "htmls")
 CATEGORIES_TREE_DIR = os.path.join(os.path.dirname(__file__), "backend", "categories", "tree_jsons")
-os.makedirs(BACKEND_WEBSITE_DIR, exist_ok=True)
-os.makedirs(BACKEND_LOGS_DIR, exist_ok=True)
-os.makedirs(LEAF_URLS_DIR, exist_ok=True)
-os.makedirs(CATEGORIES_LOGS_DIR, exist_ok=True)
-os.makedirs(CATEGORIES_HTMLS_DIR, exist_ok=True)
-os.makedirs(CATEGORIES_TREE_DIR, exist_ok=True)
 CONCURRENT_LEAFS = 1
 CONCURRENT_ENTRIES = 6
+INLINE_PARSE_WORKERS = max(1, (os.cpu_count() or 2) // 2)  # Parser processes for --parse-inline
+CARD_CHECK = True  # Skip detail pages whose listing card is unchanged (off with --fetch-all)
+# Incremental crawl: newest ads first, stop paging a leaf after a run of already known ads
+KNOWN_STOP_RUN = 50  # Consecutive known ads that end paging (--known-stop, 0 = never stop early)
+FULL_SWEEP_DAYS = page_hashes.FULL_SWEEP_DAYS  # Every page in the default order once this many days passed (--full-sweep-days)
+FORCE_FULL_SWEEP = False  # --full-sweep
+PAGE_CACHE_TTL = page_cache.TTL_SECONDS  # Listing pages younger than this come from page_cache.db (--page-cache-ttl, 0 = off)
+PAGE_CACHE_STATS = Counter()  # Page cache lookups and hits, page 1 (stored by Step 1) and later pages
+
+# Per-ad fetch events go to one buffered JSONL stream instead of backend/logs/{ad_id}.log
+EVENT_LOG = get_event_log("leaf_entries")
+
+# --- Inline parsing (--parse-inline): fresh pages go straight to a parser pool ---
+PARSE_EXECUTOR = None
+PARSE_NDJSON = None  # parser_ultrafast.NdjsonWriter for --parse-ndjson
+PARSE_WRITE_JSON = True  # False with --parse-no-json-files
+_inline_parse_tasks = set()
+
+def start_inline_parser(backend_name, workers=INLINE_PARSE_WORKERS, ndjson=None, ndjson_max_mb=0, write_json=True):
+    """Start the parser pool; JSON is then written seconds after each fetch instead of in Step 4
+
+    ``ndjson`` streams the records like parser_ultrafast --ndjson (a file, or
+    "-" for stdout, which then leaves the scraper's own output to stderr).
+    """
+    global PARSE_EXECUTOR, PARSE_NDJSON, PARSE_WRITE_JSON
+    import parser_ultrafast
+    if ndjson:
+        PARSE_NDJSON = parser_ultrafast.NdjsonWriter(ndjson, max_bytes=ndjson_max_mb * 1024 * 1024, stream=sys.stdout)
+        if ndjson == "-":
+            sys.stdout = sys.stderr
+    PARSE_WRITE_JSON = write_json
+    phone_index_path = parser_ultrafast.prepare_phone_index()
+    # Spawn, not fork: the scraper runs threads (to_thread, event log) whose locks a fork would copy.
+    # Spawned workers re-import this module, so it keeps proxies, Playwright and curl_cffi for main()
+    PARSE_EXECUTOR = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=parser_ultrafast.init_parse_worker,
+                                         initargs=(backend_name, phone_index_path, "full", False, ndjson == "-"))
+    print(f"[INFO] Inline parsing enabled: {workers} workers, backend {backend_name}"
+          + (f", records to {'stdout' if ndjson == '-' else ndjson}" if ndjson else ""))
+
+async def parse_inline(html, ad_id, page_hash):
+    import parser_ultrafast
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(PARSE_EXECUTOR, parser_ultrafast.process_page_inline, html, ad_id, page_hash,
+                                        PARSE_WRITE_JSON, PARSE_NDJSON is not None)
+    if result.record is not None:
+        PARSE_NDJSON.write(result.record)
+    if result.status == 'success':
+        await asyncio.to_thread(parser_ultrafast.record_parsed, [(ad_id, result.detail)])
+        EVENT_LOG.log("inline_parse", ad_id, "SUCCESS", result.duration_ms, content_hash=result.detail)
+    else:
+        EVENT_LOG.log("inline_parse", ad_id, "FAILED", result.duration_ms, error=result.detail)
+
+def schedule_inline_parse(html, ad_id, page_hash):
+    if PARSE_EXECUTOR is None:
+        return
+    task = asyncio.ensure_future(parse_inline(html, ad_id, page_hash))
+    _inline_parse_tasks.add(task)
+    task.add_done_callback(_inline_parse_tasks.discard)
+
+async def stop_inline_parser():
+    """Wait for queued parses and shut the pool down"""
+    global PARSE_EXECUTOR
+    if PARSE_EXECUTOR is None:
+        return
+    if _inline_parse_tasks:
+        print(f"[INFO] Waiting for {len(_inline_parse_tasks)} inline parses...")
+        results = await asyncio.gather(*_inline_parse_tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"[ERROR] Inline parse failed: {result}")
+    PARSE_EXECUTOR.shutdown()
+    PARSE_EXECUTOR = None
+    if PARSE_NDJSON is not None:
+        PARSE_NDJSON.close()
+        print(f"[INFO] Streamed {PARSE_NDJSON.records_written} parsed records to NDJSON")
 
 import logging
 
+SHIELDSQUARE_PATTERN = re.compile(r'<title>\s*ShieldSquare Captcha\s*</title>', re.IGNORECASE)
+CANONICAL_PATTERN = re.compile(r'<link[^>]+rel=["\']canonical["\'][^>]+href=["\']([^"\']+)["\']', re.IGNORECASE)
+
 def is_proxy_forbidden(response_text):
     if not response_text:
         return False
     forbidden_signals = ["forbidden", "insufficient flow", "errorMsg"]
     return any(sig in response_text.lower() for sig in forbidden_signals)
 
-def extract_entry_urls(html):
+def is_shieldsquare_page(text):
+    return SHIELDSQUARE_PATTERN.search(text) is not None
+
+def check_block(text):
+    """(ShieldSquare captcha, proxy block) for a fetched page; whole-page scans, run off the event loop"""
+    return is_shieldsquare_page(text), is_proxy_forbidden(text)
+
+def canonical_url_of(html):
+    m = CANONICAL_PATTERN.search(html)
+    return m.group(1).rstrip("/") if m else None
+
+def extract_entry_cards(html):
+    """{entry URL: listing card} for the ads on a listing page"""
     try:
-        soup = BeautifulSoup(html, "html.parser")
-        urls = []
-        # Only extract from sections with the correct group title
-        valid_titles = {"Njuškalo oglasi", "Sniff ads"}
-        for section in soup.find_all("section", class_=lambda c: c and "EntityList" in c):
-            h2 = section.find("h2", class_=lambda c: c and "EntityList-groupTitle" in c)
-            if not h2:
-                continue
-            # Extract text, ignoring <font> wrappers
-            title_text = h2.get_text(strip=True)
-            if title_text not in valid_titles:
-                continue
-            ul = section.find("ul", class_=lambda c: c and "EntityList-items" in c)
-            if not ul:
-                continue
-            for li in ul.find_all("li", class_=lambda c: c and "EntityList-item" in c):
-                a = li.find("a", class_=ENTRY_LINK_A_CLASS)
-                if a and a.get("href"):
-                    href = a["href"]
-                    if href.startswith("/"):
-                        href = "https://www.njuskalo.hr" + href
-                    urls.append(href)
-        
-        unique_urls = list(set(urls))
-        log_parsing_completion("extract_entry_urls", len(unique_urls), "entry_urls")
-        return unique_urls
-        
+        cards = {}
+        for card in listing_extractors.entry_cards(html):
+            cards.setdefault(card["url"], card)
+        log_parsing_completion("extract_entry_cards", len(cards), "entry_cards")
+        return cards
     except Exception as e:
-        log_parsing_failure("extract_entry_urls", str(e), html[:1000])
-        return []
+        log_parsing_failure("extract_entry_cards", str(e), html[:1000])
+        return {}
 
 async def fetch_html(session, url):
     """Fetch HTML with cycling between local and proxy connections"""
@@ -333,9 +403,7 @@ async def fetch_html(session, url):
         log_http_completion(url, response.status_code, len(text), "proxy" if not use_local else "local")
         
         # Enhanced block detection with immediate fallback
-        import re
-        is_shieldsquare_blocked = re.search(r'<title>\s*ShieldSquare Captcha\s*</title>', text, re.IGNORECASE)
-        is_general_blocked = is_proxy_forbidden(text)
+        is_shieldsquare_blocked, is_general_blocked = await asyncio.to_thread(check_block, text)
         
         if is_shieldsquare_blocked or is_general_blocked:
             if not use_local:
@@ -355,7 +423,7 @@ async def fetch_html(session, url):
                     text = getattr(response, "text", "")
         
         # Final ShieldSquare check after any retries
-        if re.search(r'<title>\s*ShieldSquare Captcha\s*</title>', text, re.IGNORECASE):
+        if await asyncio.to_thread(is_shieldsquare_page, text):
             ad_id = extract_ad_id(url)
             print(f"[BLOCK DETECTED] {ad_id} - Exiting script and pausing for 1 minute...")
             import sys
@@ -388,8 +456,7 @@ async def fetch_html(session, url):
                     log_http_completion(url, response.status_code, len(text), "proxy_retry")
                     
                     # ShieldSquare block detection
-                    import re
-                    if re.search(r'<title>\s*ShieldSquare Captcha\s*</title>', text, re.IGNORECASE):
+                    if await asyncio.to_thread(is_shieldsquare_page, text):
                         print(f"[BLOCK DETECTED] {ad_id} - Exiting script and pausing for 1 minute...")
                         import sys
                         import time
@@ -414,60 +481,66 @@ def extract_ad_id_from_url(entry_url):
     return None
 
 
+def phone_known(ad_id):
+    # Creates the DB file and tables if not present
+    conn = phone_store.connect()
+    try:
+        return phone_already_in_db(ad_id, conn)
+    finally:
+        conn.close()
+
+def store_page(ad_id, html, save_path):
+    """Hash, record and (if changed) write a fetched page; returns (page_hash, changed)
+
+    Hashing normalizes the whole page and the writes hit SQLite and disk, so
+    this runs in a worker thread rather than on the event loop.
+    """
+    # Skip the rewrite when the normalized content matches the stored copy
+    page_hash = page_hashes.content_hash(html)
+    conn = page_hashes.connect()
+    try:
+        missing = not os.path.exists(save_path)
+        changed = page_hashes.record_fetch(conn, ad_id, page_hash, rewritten=missing) or missing
+    finally:
+        conn.close()
+    if changed:
+        # Save/overwrite HTML file with just ad_id
+        with open(save_path, "w", encoding="utf-8") as f:
+            f.write(html)
+    return page_hash, changed
+
 async def save_entry_html(session, entry_url):
     ad_id = extract_ad_id_from_url(entry_url)
     if not ad_id:
         print(f"[SKIP] Could not extract ad_id from {entry_url}")
         return False
-    db_dir = os.path.join(os.path.dirname(__file__), "backend", "phoneDB")
-    os.makedirs(db_dir, exist_ok=True)
-    db_path = os.path.join(db_dir, "phones.db")
-    # Create the DB file and table if not present
-    if not os.path.exists(db_path):
-        conn = sqlite3.connect(db_path)
-        try:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS phones (
-                    ad_id TEXT PRIMARY KEY,
-                    phones TEXT
-                )
-            """)
-            conn.commit()
-        finally:
-            conn.close()
-    conn = sqlite3.connect(db_path)
-    if phone_already_in_db(ad_id, conn):
+    if await asyncio.to_thread(phone_known, ad_id):
         print(f"[SKIP] Phone already in DB for ad {ad_id}")
-        conn.close()
         return False
-    conn.close()
     
     # Use only ad_id for filename (no datetime)
     filename = f"{ad_id}.html"
     save_path = os.path.join(BACKEND_WEBSITE_DIR, filename)
-    log_path = os.path.join(BACKEND_LOGS_DIR, f"{ad_id}.log")
     
     t0 = time.time()
     html = await fetch_html(session, entry_url)
     duration_ms = int((time.time() - t0) * 1000)
-    timestamp = datetime.now().isoformat()
     
     if html:
-        # Save/overwrite HTML file with just ad_id
-        with open(save_path, "w", encoding="utf-8") as f:
-            f.write(html)
-        
-        # Append to log file (create if doesn't exist)
-        log_line = f"{timestamp} HTML EXTRACTION {filename} SUCCESS {duration_ms}ms\n"
+        page_hash, changed = await asyncio.to_thread(store_page, ad_id, html, save_path)
+        if not changed:
+            print(f"[UNCHANGED] {ad_id}")
+            EVENT_LOG.log("html_extraction", ad_id, "UNCHANGED", duration_ms, file=filename, url=entry_url, content_hash=page_hash)
+            return True
+
+        # Record in the shared event log (see event_log.py)
         print(f"[SAVED] {ad_id}")
-        with open(log_path, "a", encoding="utf-8") as logf:  # Changed to append mode
-            logf.write(log_line)
+        EVENT_LOG.log("html_extraction", ad_id, "SUCCESS", duration_ms, file=filename, url=entry_url, content_hash=page_hash)
+        # The archived copy stays on disk for replay; the parser works from memory
+        schedule_inline_parse(html, ad_id, page_hash)
         return True
     else:
-        # Append failure to log file
-        log_line = f"{timestamp} HTML EXTRACTION {filename} FAILED {duration_ms}ms\n"
-        with open(log_path, "a", encoding="utf-8") as logf:  # Changed to append mode
-            logf.write(log_line)
+        EVENT_LOG.log("html_extraction", ad_id, "FAILED", duration_ms, file=filename, url=entry_url)
         return False
 
 
@@ -512,17 +585,127 @@ def load_unified_checkpoint(leaf_file, leaf_url):
     return 1
 
 
-async def process_leaf_url(session, leaf_url, leaf_file, progress_callback=None):
+def select_changed_entries(entry_urls, cards):
+    """Split entry URLs by their listing card snapshot; returns (URLs to fetch, [(ad_id, card)] unchanged)
+
+    An ad is fetched when it is new, its card changed, its card was not
+    recognized, or its HTML is missing. Unchanged ads get their seen_at updated.
+    """
+    ad_ids = {url: extract_ad_id_from_url(url) for url in entry_urls}
+    conn = page_hashes.connect()
+    try:
+        known = page_hashes.load_card_hashes(conn, [ad_id for ad_id in ad_ids.values() if ad_id])
+        to_fetch, unchanged = [], []
+        for url in entry_urls:
+            ad_id = ad_ids[url]
+            h = page_hashes.card_hash(cards[url]) if url in cards else None
+            if (ad_id and h is not None and known.get(ad_id) == h
+                    and os.path.exists(os.path.join(BACKEND_WEBSITE_DIR, f"{ad_id}.html"))):
+                unchanged.append((ad_id, cards[url]))
+            else:
+                to_fetch.append(url)
+        page_hashes.record_cards(conn, unchanged)
+    finally:
+        conn.close()
+    return to_fetch, unchanged
+
+def record_fetched_cards(fetched):
+    """Snapshot the listing cards of ads whose detail page was fetched. ``fetched`` is [(ad_id, card)]."""
+    conn = page_hashes.connect()
+    try:
+        page_hashes.record_cards(conn, fetched)
+    finally:
+        conn.close()
+
+def cached_listing_page(url):
+    conn = page_cache.connect()
+    try:
+        return page_cache.get(conn, url, PAGE_CACHE_TTL)
+    finally:
+        conn.close()
+
+def cache_listing_page(url, html):
+    conn = page_cache.connect()
+    try:
+        page_cache.put(conn, url, html, "leaf_entries")
+    finally:
+        conn.close()
+
+def needs_full_sweep(leaf_url):
+    if FORCE_FULL_SWEEP:
+        return True
+    conn = page_hashes.connect()
+    try:
+        return page_hashes.full_sweep_due(conn, leaf_url, FULL_SWEEP_DAYS)
+    finally:
+        conn.close()
+
+def known_ad_ids(ad_ids):
+    """Ads seen by an earlier crawl: their card is in the snapshot or their phones were fetched"""
+    ad_ids = [ad_id for ad_id in ad_ids if ad_id]
+    conn = page_hashes.connect()
+    try:
+        known = set(page_hashes.load_card_hashes(conn, ad_ids))
+    finally:
+        conn.close()
+    conn = phone_store.connect()
+    try:
+        known.update(ad_id for ad_id in ad_ids if ad_id not in known and phone_already_in_db(ad_id, conn))
+    finally:
+        conn.close()
+    return known
+
+def record_leaf_crawl(leaf_url, full_sweep):
+    conn = page_hashes.connect()
+    try:
+        page_hashes.record_leaf_crawl(conn, leaf_url, full_sweep)
+    finally:
+        conn.close()
+
+async def process_leaf_url(session, leaf_url, leaf_file, progress_callback=None, first_page=1, last_page=None,
+                           full_sweep=None, record_crawl=True):
+    """Crawl a leaf and save its ads; ``first_page``/``last_page`` limit a full sweep to a page range (--shard)
+
+    A leaf split into page ranges gets the same ``full_sweep`` for every range
+    and ``record_crawl=False``; the caller records the crawl once all are done.
+    """
     entry_urls = []
-    page = load_unified_checkpoint(leaf_file, leaf_url)
+    cards = {}
+    # Incremental runs read the newest ads first and stop at the first long run of known ads
+    if full_sweep is None:
+        full_sweep = await asyncio.to_thread(needs_full_sweep, leaf_url)
+    newest_first = not full_sweep
+    known_run = 0
+    if newest_first and first_page > 1:
+        print(f"[SHARD] No full sweep of {leaf_url} due, pages {first_page}+ are covered by its page 1 unit")
+        return 0
+    if newest_first:
+        last_page = None  # The incremental crawl stops by itself once it reaches known ads
+    if full_sweep:
+        print(f"[SWEEP] Full sweep of {leaf_url}" + (f" (pages {first_page}-{last_page or 'end'})"
+                                                      if first_page > 1 or last_page else ""))
+    checkpoint_key = leaf_url if first_page == 1 and last_page is None else f"{leaf_url}#pages={first_page}-{last_page or ''}"
+    if newest_first:
+        checkpoint_key += "#sort=new"  # Page numbers of the two sort orders do not match
+    page = max(first_page, load_unified_checkpoint(leaf_file, checkpoint_key))
+    end_page = last_page
     last_page = page
     first_page_urls = None
     prev_page_urls = None
-    import re
     while True:
-        url = leaf_url if page == 1 else f"{leaf_url}?page={page}"
-        html = await fetch_html(session, url)
-        save_unified_checkpoint(leaf_file, leaf_url, page)
+        url = page_cache.listing_page_url(leaf_url, page, newest_first)
+        # Step 1 leaves page 1 of every leaf in the page cache, earlier runs the pages they fetched
+        html = await asyncio.to_thread(cached_listing_page, url) if PAGE_CACHE_TTL > 0 else None
+        from_cache = html is not None
+        if PAGE_CACHE_TTL > 0:
+            kind = "first" if page == 1 else "later"
+            PAGE_CACHE_STATS[f"{kind}_lookups"] += 1
+            PAGE_CACHE_STATS[f"{kind}_hits"] += from_cache
+        if from_cache:
+            print(f"[CACHE] Page {page} of {leaf_url} from the page cache")
+        else:
+            html = await fetch_html(session, url)
+        save_unified_checkpoint(leaf_file, checkpoint_key, page)
         if not html:
             print(f"[WARN] Failed to fetch page {page} for {leaf_url}. Skipping this page but will try next page.")
             page += 1
@@ -531,19 +714,20 @@ async def process_leaf_url(session, leaf_url, leaf_file, progress_callback=None)
         base_url = leaf_url.rstrip("/")
         # Only check canonical URL with regex if page > 1
         if page > 1:
-            m = re.search(r'<link[^>]+rel=["\']canonical["\'][^>]+href=["\']([^"\']+)["\']', html, re.IGNORECASE)
-            if m:
-                canonical_url = m.group(1).rstrip("/")
+            canonical_url = await asyncio.to_thread(canonical_url_of, html)
             if canonical_url and canonical_url == base_url:
                 print(f"[INFO] Page {page} for {leaf_url} redirected to page 1 (canonical URL match). Stopping paging for this leaf.")
                 break
-        page_entry_urls = extract_entry_urls(html)
+        page_cards = await asyncio.to_thread(extract_entry_cards, html)
+        page_entry_urls = list(page_cards)
         if not page_entry_urls:
             break
         # Store first page entry URLs for comparison
         if page == 1:
             first_page_urls = set(page_entry_urls)
         # If current page's entry URLs match previous page's, we've looped or stuck
+        if PAGE_CACHE_TTL > 0 and not from_cache:
+            await asyncio.to_thread(cache_listing_page, url, html)
         if prev_page_urls is not None and set(page_entry_urls) == prev_page_urls:
             print(f"[INFO] Page {page} for {leaf_url} is a repeat of previous page. Stopping paging for this leaf.")
             break
@@ -552,13 +736,32 @@ async def process_leaf_url(session, leaf_url, leaf_file, progress_callback=None)
             print(f"[INFO] Page {page} for {leaf_url} is a repeat of page 1. Stopping paging for this leaf.")
             break
         entry_urls.extend(page_entry_urls)
+        for entry_url, card in page_cards.items():
+            cards.setdefault(entry_url, card)
         last_page = page
         prev_page_urls = set(page_entry_urls)
+        if newest_first and KNOWN_STOP_RUN:
+            page_ad_ids = [extract_ad_id_from_url(u) for u in page_entry_urls]
+            known = await asyncio.to_thread(known_ad_ids, page_ad_ids)
+            for ad_id in page_ad_ids:
+                known_run = known_run + 1 if ad_id in known else 0
+            if known_run >= KNOWN_STOP_RUN:
+                print(f"[INCREMENTAL] {known_run} known ads in a row on page {page} of {leaf_url}. Stopping paging for this leaf.")
+                break
         if len(page_entry_urls) < 25:
             break
+        if end_page is not None and page >= end_page:
+            break
         page += 1
-        await asyncio.sleep(random.uniform(0.5, 1.0))
+        if not from_cache:
+            await asyncio.sleep(random.uniform(0.5, 1.0))
     entry_urls = list(set(entry_urls))
+    if CARD_CHECK and entry_urls:
+        entry_urls, unchanged = await asyncio.to_thread(select_changed_entries, entry_urls, cards)
+        if unchanged:
+            print(f"[CARDS] {len(unchanged)} of {len(unchanged) + len(entry_urls)} ads unchanged since the last crawl, "
+                  f"skipping their detail pages")
+    fetched_cards = []
     saved = 0
     total = len(entry_urls)
     t0 = time.time()
@@ -574,6 +777,8 @@ async def process_leaf_url(session, leaf_url, leaf_file, progress_callback=None)
             ok = await save_entry_html(session, entry_url)
             if ok:
                 processed_ads.add(ad_id)
+                if entry_url in cards:
+                    fetched_cards.append((ad_id, cards[entry_url]))
             return ok
     tasks = [save_one(entry_url) for entry_url in entry_urls]
     for i, task in enumerate(asyncio.as_completed(tasks), 1):
@@ -592,6 +797,10 @@ async def process_leaf_url(session, leaf_url, leaf_file, progress_callback=None)
         else:
             print(progress, end='\r', flush=True)
     print()  # Newline after progress
+    if CARD_CHECK and fetched_cards:
+        await asyncio.to_thread(record_fetched_cards, fetched_cards)
+    if record_crawl:
+        await asyncio.to_thread(record_leaf_crawl, leaf_url, full_sweep)
     return saved
 
 
@@ -616,8 +825,14 @@ def load_checkpoint(leaf_file):
 
 
 async def main():
+    global CARD_CHECK, FORCE_FULL_SWEEP, FULL_SWEEP_DAYS, KNOWN_STOP_RUN, PAGE_CACHE_TTL, LOADED_PROXIES
+    from curl_cffi.requests import AsyncSession
     # Setup comprehensive logging
     setup_comprehensive_logging()
+    for directory in (CHECKPOINTS_DIR, BACKEND_WEBSITE_DIR, BACKEND_LOGS_DIR, LEAF_URLS_DIR,
+                      CATEGORIES_LOGS_DIR, CATEGORIES_HTMLS_DIR, CATEGORIES_TREE_DIR):
+        os.makedirs(directory, exist_ok=True)
+    LOADED_PROXIES = load_proxies_from_file()
     
     # Log process start
     start_time = time.time()
@@ -626,7 +841,48 @@ async def main():
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--restart", action="store_true", help="Restart from zero, ignore checkpoint.")
+    parser.add_argument("--parse-inline", action="store_true",
+                        help="Parse each saved page in a process pool right away (writes backend/json like Step 4)")
+    parser.add_argument("--parse-workers", type=int, default=INLINE_PARSE_WORKERS,
+                        help="Parser processes for --parse-inline")
+    parser.add_argument("--parse-backend", choices=BACKEND_NAMES, default=DEFAULT_BACKEND,
+                        help="HTML backend for --parse-inline (see html_backends.py)")
+    parser.add_argument("--parse-ndjson", metavar="TARGET",
+                        help="Stream --parse-inline records as NDJSON to a file, or '-' for stdout (output then goes to stderr)")
+    parser.add_argument("--parse-ndjson-max-mb", type=int, default=0,
+                        help="Rotate the --parse-ndjson file after this many MB (0 = never)")
+    parser.add_argument("--parse-no-json-files", action="store_true",
+                        help="Skip the per-ad JSON writes of --parse-inline (requires --parse-ndjson)")
+    parser.add_argument("--fetch-all", action="store_true",
+                        help="Fetch every ad's detail page, even when its listing card is unchanged")
+    parser.add_argument("--full-sweep", action="store_true",
+                        help="Crawl every page of every leaf in the default order (otherwise only every --full-sweep-days)")
+    parser.add_argument("--full-sweep-days", type=int, default=FULL_SWEEP_DAYS,
+                        help="Days between automatic full sweeps of a leaf")
+    parser.add_argument("--known-stop", type=int, default=KNOWN_STOP_RUN,
+                        help="Stop paging a leaf (newest first) after this many known ads in a row (0 = never)")
+    parser.add_argument("--page-cache-ttl", type=int, default=PAGE_CACHE_TTL,
+                        help="Reuse listing pages fetched (by Step 1 or an earlier run) less than this many seconds ago (0 = off)")
+    parser.add_argument("--shard", type=partition_leaves.parse_shard, metavar="K/N",
+                        help="Only crawl shard K of N of today's leaves, split by estimated size (see partition_leaves.py)")
+    parser.add_argument("--loop-lag-ms", type=int, default=LAG_THRESHOLD_MS,
+                        help="Report event-loop stalls longer than this (0 = off)")
+    parser.add_argument("--loop-debug", action="store_true",
+                        help="asyncio debug mode: log the callback behind each stall (slower)")
     args = parser.parse_args()
+    if args.parse_no_json_files and not args.parse_ndjson:
+        parser.error("--parse-no-json-files requires --parse-ndjson")
+    if args.parse_ndjson and not args.parse_inline:
+        parser.error("--parse-ndjson requires --parse-inline")
+    CARD_CHECK = not args.fetch_all
+    FORCE_FULL_SWEEP = args.full_sweep
+    FULL_SWEEP_DAYS = args.full_sweep_days
+    KNOWN_STOP_RUN = args.known_stop
+    PAGE_CACHE_TTL = args.page_cache_ttl
+    if PAGE_CACHE_TTL > 0:
+        expired = page_cache.purge_expired(PAGE_CACHE_TTL)
+        if expired:
+            print(f"[PAGE CACHE] Deleted {expired} expired pages")
 
     # Use global today_str (do not reassign locally)
     # Find all .txt files in LEAF_URLS_DIR
@@ -635,6 +891,31 @@ async def main():
         print(f"No .txt files found in {LEAF_URLS_DIR}")
         return
 
+    # Work per leaf file: whole leaves, or this machine's shard of page-range units
+    if args.shard:
+        k, n = args.shard
+        # The partition decides each leaf's full sweep once, for all of its page ranges
+        shards, loads = partition_leaves.build_shards(n, today_str, full_sweep_days=FULL_SWEEP_DAYS,
+                                                      force_full_sweep=FORCE_FULL_SWEEP)
+        print(f"[SHARD] Crawling shard {k}/{n}: {len(shards[k - 1])} work units, ~{loads[k - 1]} ads")
+        units = shards[k - 1]
+        work = [(os.path.join(LEAF_URLS_DIR, f"shard_{k}_of_{n}_{today_str}"), units)]
+    else:
+        work = []
+        for leaf_file in leaf_files:
+            with open(leaf_file, "r", encoding="utf-8") as f:
+                work.append((leaf_file, [{"url": line.strip(), "first_page": 1, "last_page": None}
+                                         for line in f if line.strip()]))
+
+    if args.parse_inline:
+        start_inline_parser(args.parse_backend, args.parse_workers, args.parse_ndjson, args.parse_ndjson_max_mb,
+                            write_json=not args.parse_no_json_files)
+
+    loop_monitor = None
+    if args.loop_lag_ms > 0:
+        loop_monitor = LoopLagMonitor(args.loop_lag_ms, event_log=EVENT_LOG, debug=args.loop_debug)
+        loop_monitor.start()
+
     # Check checkpoint files for today's date in filename
     checkpoint_files_today = [os.path.join(CHECKPOINTS_DIR, f) for f in os.listdir(CHECKPOINTS_DIR)
                              if f.startswith(f"scrape_checkpoint_{today_str}_") and f.endswith(".json")]
@@ -648,33 +929,49 @@ async def main():
             except Exception as e:
                 print(f"Could not delete {cp}: {e}")
 
-    for leaf_file in leaf_files:
+    for leaf_file, units in work:
         print(f"\nProcessing leaf URL file: {leaf_file}")
-        with open(leaf_file, "r", encoding="utf-8") as f:
-            leaf_urls = [line.strip() for line in f if line.strip()]
-        if not leaf_urls:
+        if not units:
             print(f"  [SKIP] No URLs in {leaf_file}")
             continue
         start_idx = 0 if args.restart else load_checkpoint(leaf_file)
-        total_leaves = len(leaf_urls)
+        total_leaves = len(units)
         print(f"  Starting from leaf {start_idx+1} of {total_leaves}")
+        # A sharded leaf's crawl is recorded once the last of its page ranges is done
+        ranges_left = Counter(unit["url"] for unit in units[start_idx:])
 
         sem = asyncio.Semaphore(CONCURRENT_LEAFS)
-        async def process_one_leaf(idx, leaf_url):
+        async def process_one_leaf(idx, unit):
             async with sem:
                 # Refresh headers and cookies after every 50 leaf URLs
                 if (idx + 1) % 50 == 0:
                     print(f"[INFO] Refreshing headers and cookies after processing {idx + 1} leaf URLs...")
                     await refresh_headers_and_cookies()
                 
+                leaf_url = unit["url"]
                 async with AsyncSession() as session:
-                    n = await process_leaf_url(session, leaf_url, leaf_file)
+                    # Shard units carry the leaf's full_sweep decision; whole leaves decide and record it themselves
+                    sharded = "full_sweep" in unit
+                    n = await process_leaf_url(session, leaf_url, leaf_file,
+                                               first_page=unit["first_page"], last_page=unit["last_page"],
+                                               full_sweep=unit.get("full_sweep"), record_crawl=not sharded)
+                    ranges_left[leaf_url] -= 1
+                    if sharded and not ranges_left[leaf_url]:
+                        await asyncio.to_thread(record_leaf_crawl, leaf_url, unit["full_sweep"])
                     leaf_name = extract_ad_id(leaf_url)
                     print(f"Saved {n} entries for {leaf_name}")
                     save_checkpoint(idx+1, leaf_file)
-        await asyncio.gather(*(process_one_leaf(idx, url) for idx, url in enumerate(leaf_urls[start_idx:], start=start_idx)))
+        await asyncio.gather(*(process_one_leaf(idx, unit) for idx, unit in enumerate(units[start_idx:], start=start_idx)))
         print(f"  Done with {leaf_file}. All entry HTMLs saved in '{BACKEND_WEBSITE_DIR}' directory.")
     
+    await stop_inline_parser()
+    if PAGE_CACHE_STATS:
+        for kind, label in (("first", "Page 1"), ("later", "Later pages")):
+            lookups, hits = PAGE_CACHE_STATS[f"{kind}_lookups"], PAGE_CACHE_STATS[f"{kind}_hits"]
+            print(f"[PAGE CACHE] {label}: {hits}/{lookups} from the cache ({hits / lookups if lookups else 0:.0%})")
+    if loop_monitor is not None:
+        await loop_monitor.stop()
+
     # Log process end
     log_process_end("leaf_entries_scraping", start_time)
 
@@ -0,0 +1,18 @@
+import os
+import sys
+
+# The scripts live in the repository root and import each other by module name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def fixture_pages(kind):
+    """[(filename, html)] of the saved pages in fixtures/<kind>"""
+    directory = os.path.join(FIXTURES_DIR, kind)
+    pages = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".html"):
+            with open(os.path.join(directory, filename), "r", encoding="utf-8") as f:
+                pages.append((filename, f.read()))
+    return pages
@@ -0,0 +1,59 @@
+"""
+The lxml/selectolax listing and category extractors must give the same
+results as the original BeautifulSoup/html.parser implementations
+(listing_extractors.*_reference) on every saved page.
+"""
+
+import pytest
+
+import listing_extractors
+from html_backends import get_backend, BACKEND_NAMES
+from conftest import fixture_pages
+
+PAGES = fixture_pages("listing_pages") + fixture_pages("category_pages")
+PAGE_IDS = [filename for filename, _ in PAGES]
+
+
+@pytest.fixture(params=BACKEND_NAMES)
+def backend_name(request):
+    try:
+        get_backend(request.param)
+    except ImportError as e:
+        pytest.skip(f"{request.param} is not installed: {e}")
+    return request.param
+
+
+@pytest.mark.parametrize("filename,html", PAGES, ids=PAGE_IDS)
+def test_entry_urls(filename, html, backend_name):
+    assert listing_extractors.entry_urls(html, backend_name) == listing_extractors.entry_urls_reference(html)
+
+
+@pytest.mark.parametrize("filename,html", PAGES, ids=PAGE_IDS)
+def test_entry_cards(filename, html, backend_name):
+    # There is no reference for the card fields: the URLs must match the reference
+    # and the fields must not depend on the backend
+    cards = listing_extractors.entry_cards(html, backend_name)
+    assert [card["url"] for card in cards] == listing_extractors.entry_urls_reference(html)
+    assert cards == listing_extractors.entry_cards(html, "bs4")
+
+
+@pytest.mark.parametrize("filename,html", PAGES, ids=PAGE_IDS)
+def test_category_links(filename, html, backend_name):
+    assert listing_extractors.category_links(html, backend_name) == listing_extractors.category_links_reference(html)
+
+
+@pytest.mark.parametrize("filename,html", PAGES, ids=PAGE_IDS)
+def test_result_count(filename, html, backend_name):
+    assert listing_extractors.result_count(html, backend_name) == listing_extractors.result_count_reference(html)
+
+
+def test_fixtures_are_not_trivial():
+    # Each extractor has pages with and without results
+    for reference in (listing_extractors.entry_urls_reference, listing_extractors.category_links_reference,
+                      listing_extractors.result_count_reference):
+        results = [reference(html) for _, html in PAGES]
+        assert any(results) and not all(results), reference.__name__
+    cards = [card for _, html in PAGES for card in listing_extractors.entry_cards(html)]
+    assert all(card["title"] for card in cards)
+    for field in ("price", "published", "teaser"):
+        assert any(card[field] for card in cards) and not all(card[field] for card in cards), field
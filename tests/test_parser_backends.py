@@ -0,0 +1,52 @@
+"""
+parser_ultrafast field extraction must not depend on the HTML backend, the
+extract mode (full page or html_regions slices) or the embedded-state fast
+path: every variant gives the same record as bs4 on the full page.
+"""
+
+import pytest
+
+import html_regions
+import parser_ultrafast
+from html_backends import get_backend, BACKEND_NAMES, DEFAULT_BACKEND
+from conftest import fixture_pages
+
+AD_PAGES = fixture_pages("ad_pages")
+
+
+def backend_or_skip(name):
+    try:
+        return get_backend(name)
+    except ImportError as e:
+        pytest.skip(f"{name} is not installed: {e}")
+
+
+def reference_record(filename, html):
+    return parser_ultrafast.extract_ad_fields(get_backend(DEFAULT_BACKEND), html, filename[:-len(".html")])
+
+
+@pytest.mark.parametrize("embedded", [False, True], ids=["dom", "embedded"])
+@pytest.mark.parametrize("extract_mode", parser_ultrafast.EXTRACT_MODES)
+@pytest.mark.parametrize("backend_name", BACKEND_NAMES)
+@pytest.mark.parametrize("filename,html", AD_PAGES, ids=[filename for filename, _ in AD_PAGES])
+def test_backends_match_reference(filename, html, backend_name, extract_mode, embedded):
+    backend = backend_or_skip(backend_name)
+    got = parser_ultrafast.extract_ad_fields(backend, html, filename[:-len(".html")], extract_mode, embedded)
+    assert got == reference_record(filename, html)
+
+
+def test_fixtures_cover_the_fast_paths():
+    records = {filename: reference_record(filename, html) for filename, html in AD_PAGES}
+    # Every field extractor finds something on at least one page
+    found = set().union(*records.values())
+    expected = {"link", "lokacija", "naslov", "cijena", "Lokacija", "opis", "Grijanje", "naziv_agencije",
+                "profil_agencije", "email_agencije", "adresa_agencije", "oglas_objavljen", "do_isteka",
+                "oglas_prikazan", "slike"}
+    assert expected <= found, expected - found
+    # Regions mode slices most pages and falls back to the full page on one
+    sliced = [html_regions.slice_regions(html) is not None for _, html in AD_PAGES]
+    assert any(sliced) and not all(sliced)
+    # The embedded state fills price and images on some pages and leaves them to the DOM on others
+    embedded = [parser_ultrafast.embedded_state.extract_embedded_fields(html) for _, html in AD_PAGES]
+    assert any("cijena" in fields for fields in embedded) and not all("cijena" in fields for fields in embedded)
+    assert any("slike" in fields for fields in embedded) and not all("slike" in fields for fields in embedded)